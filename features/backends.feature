@@ -0,0 +1,31 @@
+@backends
+Feature: database backends
+
+  Scenario Outline: pairs written to a backend can be read back
+    Given a database on the <backend> backend
+    When the pairs {'a': 'A' * 10, 'b': 'B' * 40} are written and flushed
+    Then a new DB on the same database gets {'a': 'A' * 10, 'b': 'B' * 40}
+    When the key 'a' is deleted
+    Then a new DB on the same database does not find 'a'
+
+    Examples:
+      | backend |
+      | memory  |
+      | leveldb |
+      | lmdb    |
+
+
+  Scenario Outline: the state does not depend on the backend
+    Given a database on the <backend> backend
+    When a genesis block of 100 accounts and a trie of 500 pairs are made on it
+    Then the roots are the same as on the leveldb backend
+
+    Examples:
+      | backend |
+      | memory  |
+      | lmdb    |
+
+
+  Scenario: a database stays with the backend it was opened with
+    Given a database on the memory backend
+    Then opening it with the leveldb backend fails
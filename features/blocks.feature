@@ -0,0 +1,51 @@
+Feature: blocks
+
+  Scenario: account changes are cached until the state is committed
+    Given a genesis block with the accounts {'a' * 40: 1000, 'b' * 40: 5}
+    When 300 is moved from the account 'a' * 40 to the account 'c' * 40
+    Then the balances are {'a' * 40: 700, 'b' * 40: 5, 'c' * 40: 300}
+    And the state root has not changed
+    When the state is committed
+    Then the state root is the one of a genesis block with those balances
+
+  Scenario: reverting a snapshot drops the cached changes
+    Given a genesis block with the accounts {'a' * 40: 1000, 'b' * 40: 5}
+    When 300 is moved from the account 'a' * 40 to the account 'c' * 40
+    And a snapshot is taken
+    And 5 is moved from the account 'b' * 40 to the account 'a' * 40
+    And the account 'c' * 40 is deleted
+    And the snapshot is reverted
+    Then the balances are {'a' * 40: 700, 'b' * 40: 5, 'c' * 40: 300}
+    When the state is committed
+    Then the state root is the one of a genesis block with those balances
+
+  Scenario: taking a snapshot does not commit the cached changes
+    Given a genesis block with the accounts {'a' * 40: 1000, 'b' * 40: 5}
+    When 300 is moved from the account 'a' * 40 to the account 'c' * 40
+    And a snapshot is taken
+    Then the state root has not changed
+
+  Scenario: deleted accounts are removed from the state
+    Given a genesis block with the accounts {'a' * 40: 1000, 'b' * 40: 5}
+    When the account 'b' * 40 is deleted
+    And the state is committed
+    Then the balances are {'a' * 40: 1000, 'b' * 40: 0}
+    And the state root is the one of a genesis block with {'a' * 40: 1000}
+
+  Scenario: storage values are cached until the state is committed
+    Given a genesis block with the accounts {'a' * 40: 1000}
+    When the storage of 'a' * 40 is set to {1: 5, 2: 7}
+    Then the storage of 'a' * 40 is {1: 5, 2: 7, 3: 0}
+    And the state root has not changed
+    When the state is committed
+    Then the storage trie of 'a' * 40 holds {1: 5, 2: 7}
+
+  Scenario: reverting a snapshot drops the cached storage values
+    Given a genesis block with the accounts {'a' * 40: 1000}
+    When the storage of 'a' * 40 is set to {1: 5}
+    And a snapshot is taken
+    And the storage of 'a' * 40 is set to {1: 0, 2: 7}
+    And the snapshot is reverted
+    Then the storage of 'a' * 40 is {1: 5, 2: 0}
+    When the state is committed
+    Then the storage trie of 'a' * 40 holds {1: 5}
@@ -0,0 +1,24 @@
+@db @chainmanager
+Feature: chain manager
+
+  Scenario: a restart after a clean shutdown keeps the head
+    Given the durability mode is "sync_interval" every 3600000 ms
+    And a chain manager
+    When block "A1" with difficulty 10 is added on top of "genesis"
+    And block "A2" with difficulty 10 is added on top of "A1"
+    And the last sync was 3600 seconds ago
+    And block "A3" with difficulty 10 is added on top of "A2"
+    Then the checkpoint in the database is the hash of block "A2"
+    When the chain manager is shut down
+    And the chain manager is restarted
+    Then block "A3" is the head
+
+  Scenario: a restart after a crash rolls the head back to the checkpoint
+    Given the durability mode is "sync_interval" every 3600000 ms
+    And a chain manager
+    When block "B1" with difficulty 100 is added on top of "genesis"
+    And block "B2" with difficulty 100 is added on top of "B1"
+    And the last sync was 3600 seconds ago
+    And block "B3" with difficulty 100 is added on top of "B2"
+    And the chain manager is restarted
+    Then block "B2" is the head
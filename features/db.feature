@@ -0,0 +1,120 @@
+@db
+Feature: database write-back journal
+
+  Scenario: committed writes are flushed and cleared from memory
+    When the pairs {'a': 'A' * 10, 'b': 'B' * 20} are put
+    Then 32 bytes are pending
+    When committed
+    Then nothing is pending
+    And 32 bytes were flushed in 1 flush
+    And the pairs {'a': 'A' * 10, 'b': 'B' * 20} are in the database
+
+  Scenario: per block flush policy
+    Given the flush policy is "block"
+    When the pairs {'c': 'C'} are put
+    And committed
+    Then 2 bytes are pending
+    And a new DB on the same file gets 'C' for 'c'
+    When the block is committed
+    Then nothing is pending
+    And the pairs {'c': 'C'} are in the database
+
+  Scenario: per bytes flush policy
+    Given the flush policy is "bytes" with a limit of 100 bytes
+    When the pairs {'d': 'D' * 49} are put
+    And committed
+    Then 50 bytes are pending
+    When the pairs {'e': 'E' * 49} are put
+    And committed
+    Then nothing is pending
+    And 100 bytes were flushed in 1 flush
+
+  Scenario: timer flush policy
+    Given the flush policy is "timer" with an interval of 3600000 ms
+    When the pairs {'f': 'F'} are put
+    And committed
+    Then 2 bytes are pending
+    When the last flush was 3600 seconds ago
+    And committed
+    Then nothing is pending
+
+  Scenario: the journal is bounded whatever the policy
+    Given the flush policy is "block"
+    And at most 100 bytes may be pending
+    When the pairs {'g': 'G' * 60, 'h': 'H' * 60} are put
+    Then nothing is pending
+    And 122 bytes were flushed in 1 flush
+
+  Scenario: overwriting a pending key
+    Given the flush policy is "block"
+    When the pairs {'i': 'I' * 10} are put
+    And the pairs {'i': 'I'} are put
+    Then 2 bytes are pending
+
+  Scenario: sync every commit
+    When the pairs {'j': 'J'} are put
+    And committed
+    Then 1 flush was synced
+
+  Scenario: sync per block writes a checkpoint of the block head
+    Given the durability mode is "sync_per_block"
+    When the pairs {'k': 'K'} are put
+    And committed
+    Then 0 flush was synced
+    When the block with head 'head1' is committed
+    Then nothing is pending
+    And 1 flush was synced
+    And the checkpoint in the database is 'head1'
+
+  Scenario: sync on interval
+    Given the durability mode is "sync_interval" every 3600000 ms
+    When the pairs {'l': 'L'} are put
+    And the block with head 'head2' is committed
+    Then nothing is pending
+    And 0 flush was synced
+    When the last sync was 3600 seconds ago
+    And the pairs {'m': 'M'} are put
+    And committed
+    Then 1 flush was synced
+    And the checkpoint in the database is 'head2'
+
+  Scenario: writes to a reverted overlay never reach the database
+    When an overlay is pushed
+    And the pairs {'n': 'N'} are put
+    And committed
+    Then nothing is pending
+    And the DB gets 'N' for 'n'
+    When the overlay is reverted
+    Then the DB does not find 'n'
+
+  Scenario: committed overlays are merged into the one below
+    When an overlay is pushed
+    And the pairs {'o': 'O', 'p': 'P'} are put
+    And an overlay is pushed
+    And the pairs {'o': 'O2', 'q': 'Q'} are put
+    And the overlay is committed
+    Then the DB gets 'O2' for 'o'
+    And nothing is pending
+    When an overlay is pushed
+    And the pairs {'p': 'P2'} are put
+    And the overlay is reverted
+    And the overlay is committed
+    And committed
+    Then the pairs {'o': 'O2', 'p': 'P', 'q': 'Q'} are in the database
+
+  Scenario: overlays left at the end of a block are kept
+    When an overlay is pushed
+    And the pairs {'r': 'R'} are put
+    And an overlay is pushed
+    And the pairs {'s': 'S'} are put
+    And the block is committed
+    Then the pairs {'r': 'R', 's': 'S'} are in the database
+
+  Scenario: the node cache size applies to open databases
+    When 10 nodes are put in the node cache
+    And the node cache size is configured to 4
+    Then the node cache holds the last 4 nodes
+
+  Scenario: the flush thresholds apply to open databases
+    When the flush thresholds are configured to 1024 bytes and 100 ms
+    Then the flush thresholds of the database are 1024 bytes and 100 ms
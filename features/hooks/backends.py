@@ -0,0 +1,27 @@
+import os
+import shutil
+from os import path
+
+
+class BackendsHook(object):
+    db_dir = "tmp"
+
+    def db_path(self, backend):
+        return path.abspath(path.join(self.db_dir, "%s-test.db" % backend))
+
+    def before_feature(self, context, feature):
+        if not path.exists(self.db_dir):
+            os.mkdir(self.db_dir)
+        context.backend_db_path = self.db_path
+
+    def after_scenario(self, context, scenario):
+        from pyethereum import db
+        from pyethereum.db import backends
+        for backend in backends:
+            db_path = self.db_path(backend)
+            for registry in (db.databases, db.node_caches, db.journals,
+                             db.pruners):
+                registry.pop(db_path, None)
+            shutil.rmtree(db_path, ignore_errors=True)
+
+hook = BackendsHook()
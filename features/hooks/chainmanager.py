@@ -0,0 +1,22 @@
+class ChainManagerHook(object):
+    ''' for features importing pyethereum.chainmanager
+    '''
+    def after_feature(self, context, feature):
+        from pyethereum import chainmanager
+        from pyethereum import signals
+        # else the global chain manager handles the signals of the other
+        # features as well
+        for signal, receiver in (
+                (signals.config_ready, chainmanager.config_chainmanager),
+                (signals.new_transactions_received,
+                 chainmanager.new_transactions_received_handler),
+                (signals.transactions_requested,
+                 chainmanager.transactions_requested_handler),
+                (signals.blocks_requested,
+                 chainmanager.blocks_requested_handler),
+                (signals.new_blocks_received,
+                 chainmanager.new_blocks_received_handler)):
+            signal.disconnect(receiver)
+
+
+hook = ChainManagerHook()
@@ -0,0 +1,47 @@
+import gc
+import os
+from os import path
+
+
+class DBHook(object):
+    db_dir = "tmp"
+    db_file_name = "db-test.db"
+
+    def __init__(self):
+        self.db_path = path.abspath(path.join(self.db_dir, self.db_file_name))
+
+    def before_feature(self, context, feature):
+        if not path.exists(self.db_dir):
+            os.mkdir(self.db_dir)
+        self._delete_db()
+        context.db_path = self.db_path
+
+    def after_feature(self, context, feature):
+        from pyethereum import db
+        for registry in (db.databases, db.node_caches, db.journals,
+                         db.pruners):
+            registry.pop(self.db_path, None)
+        # e.g. threads of the scenarios may still hold it, in cycles
+        gc.collect()
+        self._delete_db()
+
+    def _delete_db(self):
+        import leveldb
+        leveldb.DestroyDB(self.db_path)
+
+    def before_scenario(self, context, scenario):
+        from pyethereum import db
+        context.db = db.DB(self.db_path)
+        context.db.flush()
+        journal = context.db.journal
+        journal.flush_policy = db.FLUSH_POLICY
+        journal.max_pending_bytes = db.MAX_PENDING_BYTES
+        journal.flush_interval_ms = db.FLUSH_INTERVAL_MS
+        journal.durability = db.DURABILITY
+        journal.sync_interval_ms = db.SYNC_INTERVAL_MS
+        journal.head = None
+        journal.overlays = []
+        journal.flushed_bytes = journal.flushes = journal.syncs = 0
+        db.pruners.pop(self.db_path, None)
+
+hook = DBHook()
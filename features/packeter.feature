@@ -13,3 +13,24 @@ Feature: packeter
       | ''      |
       | 'a'*15  |
       | [1]*15  |
+
+
+  Scenario Outline: packets received in chunks are read incrementally
+    Given to be packeted payloads: <payloads>
+    When the packets are fed to a packet reader in chunks of <size> bytes
+    Then the packet reader returns each command and its data once, in order
+
+    Examples:
+      | payloads                                                   | size  |
+      | [[0x02], [0x03]]                                           | 1     |
+      | [[0x02], [0x13] + ['a' * 1000] * 100, [0x12, 'tx', 'tx2']] | 7     |
+      | [[0x13] + [['b' * 500, ['c'] * 10]] * 2000]                | 2048  |
+      | [[0x02], [0x03], [0x10]]                                   | 10000 |
+
+
+  Scenario: only the blocks of Blocks packets are decoded lazily
+    Given to be packeted payloads: [[0x13] + [[['h'] * 13, [['tx', 'v', 'r']] * 3, []]] * 2, [0x11, ['ip', 'port', 'id']]]
+    When the packets are fed to a packet reader in chunks of 100 bytes
+    Then the packet reader returns each command and its data once, in order
+    And the items of the Blocks packets are lazily decoded lists
+    And the items of the other packets are lists
@@ -39,6 +39,15 @@ Feature: peer
       | protocol version    |
       | network id          |
 
+  Scenario: receive a malformed packet
+    Given a packet with a bad sync token
+    When peer.send_Disconnect is instrumented
+    And the sizes of the data received from peer are recorded
+    And the packet is received from peer
+    And all data with the peer is processed
+    Then peer.send_Disconnect should be called once with args: reason
+    And the size of the packet is among the recorded sizes
+
   Scenario: send Ping to peer
     When peer.send_Ping is called
     And all data with the peer is processed
@@ -0,0 +1,36 @@
+@db @chainmanager
+Feature: pruning of unreachable trie nodes
+
+  Scenario: nodes only reachable from dropped states are deleted
+    Given a pruner keeping the last 2 states
+    When 30 pairs are inserted one by one, retaining the state after each
+    And the pruner runs in steps of 10 nodes
+    Then it took more than one step
+    And no node was deleted yet
+    When the block is committed
+    Then the last 2 retained states are complete
+    And of the nodes written, only those reachable from them are left
+
+  Scenario: nodes written again after the latest retained state are kept
+    Given a pruner keeping the last 1 states
+    When 10 pairs are inserted one by one, retaining the state after each
+    And the first pair is changed and the state retained
+    And the first pair is changed back
+    And the pruner runs to completion
+    And the block is committed
+    Then every pair can be read from the trie
+
+  Scenario: a side chain becomes the head after a sweep
+    Given a chain manager whose pruner keeps the last 2 block numbers
+    When block "A1" with difficulty 10 is added on top of "genesis"
+    And block "B1" with difficulty 5 is added on top of "genesis"
+    And block "A2" with difficulty 10 is added on top of "A1"
+    And the pruner runs to completion
+    And the block is committed
+    Then the nodes of the other states were deleted
+    And block "A2" is the head
+    And the state of block "B1" is complete
+    When block "B2" with difficulty 100 is added on top of "B1"
+    Then block "B2" is the head
+    And the state of block "B1" is complete
+    And the state of block "B2" is complete
@@ -80,6 +80,44 @@ Feature: RLP encoding and decoding
       | ['a'] * 1024                 |
 
 
+  Scenario: payload is a list nested deeper than the recursion limit
+    Given a to be rlp encoded payload nested 5000 lists deep: 'a'
+    When encoded in RLP
+    Then descending 4999 levels into the RLP encoded data will get "c161"
+
+
+  Scenario Outline: lazily decode a list
+    Given a to be rlp encoded payload: <src>
+    When encoded in RLP
+    And lazily decoded
+    Then item <index> of the lazily decoded data is <item>
+    And the lists on the way to item <index> are decoded once
+    And the lazily decoded data equals the original data
+    And encode the lazily decoded data will get the RLP encoded data
+
+    Examples:
+      | src                                  | index     | item           |
+      | ['foo', 'bar']                       | (1,)      | 'bar'          |
+      | [['a', ['b', 'c' * 60]], 'd']        | (0, 1, 1) | 'c' * 60       |
+      | [str(x) for x in range(100)]         | (-1,)     | '99'           |
+      | [[], ['a' * 1024, ['x', 'y']], 'z']  | (1, 1)    | ['x', 'y']     |
+
+
+  Scenario Outline: index the items of an RLP encoded list
+    Given a to be rlp encoded payload: <src>
+    When encoded in RLP
+    And indexed
+    Then every path in the original data leads to the same item in the index
+    And the index descends to the same RLP data as descend
+
+    Examples:
+      | src                                          |
+      | []                                           |
+      | [['a', ['b', 'c' * 60]], 'd', [], 'x' * 300] |
+      | [str(x) for x in range(100)]                 |
+      | [[[[]]], [['y'] * 60, []], 'z']              |
+
+
   Scenario Outline: payload containing elements of unsupported type
     Given a to be rlp encoded payload: <src>
     Then raise TypeError
@@ -0,0 +1,75 @@
+from behave import register_type
+from .utils import parse_py
+
+from pyethereum import blocks
+from pyethereum.db import DB
+from pyethereum.trie import Trie, sha3
+
+register_type(Py=parse_py)
+
+
+@given(u'a database on the {backend} backend')  # noqa
+def step_impl(context, backend):
+    if backend == 'lmdb':
+        try:
+            import lmdb  # noqa
+        except ImportError:
+            context.scenario.skip('the lmdb package is not installed')
+            return
+    context.backend = backend
+    context.db_path = context.backend_db_path(backend)
+    context.db = DB(context.db_path, backend)
+
+
+@when(u'the pairs {pairs:Py} are written and flushed')  # noqa
+def step_impl(context, pairs):
+    for k, v in pairs.items():
+        context.db.put(k, v)
+    context.db.flush()
+
+
+@then(u'a new DB on the same database gets {pairs:Py}')  # noqa
+def step_impl(context, pairs):
+    for k, v in pairs.items():
+        assert DB(context.db_path).get(k) == v
+
+
+@when(u'the key {key:Py} is deleted')  # noqa
+def step_impl(context, key):
+    context.db.delete(key)
+
+
+@then(u'a new DB on the same database does not find {key:Py}')  # noqa
+def step_impl(context, key):
+    try:
+        DB(context.db_path).get(key)
+        assert False, 'still there'
+    except KeyError:
+        pass
+
+
+def make_state(db_path, backend=None):
+    alloc = dict((sha3(str(i))[:20], 10 ** 18 + i) for i in range(100))
+    block = blocks.genesis(alloc, db_path=db_path, backend=backend)
+    t = Trie(db_path)
+    t.update_many((sha3(str(i)), str(i)) for i in range(500))
+    return block.state.root, t.root
+
+
+@when(u'a genesis block of 100 accounts and a trie of 500 pairs are made on it')  # noqa
+def step_impl(context):
+    context.roots = make_state(context.db_path)
+
+
+@then(u'the roots are the same as on the leveldb backend')  # noqa
+def step_impl(context):
+    assert context.roots == make_state(context.backend_db_path('leveldb'))
+
+
+@then(u'opening it with the {backend} backend fails')  # noqa
+def step_impl(context, backend):
+    try:
+        DB(context.db_path, backend)
+        assert False, 'opened twice'
+    except Exception as e:
+        assert 'memory backend' in str(e)
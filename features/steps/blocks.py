@@ -0,0 +1,86 @@
+from behave import register_type
+from .utils import parse_py
+
+from pyethereum import blocks
+from pyethereum import utils
+
+register_type(Py=parse_py)
+
+DB_PATH = 'memory-blocks-test'
+
+
+def genesis(alloc):
+    return blocks.genesis(alloc, db_path=DB_PATH, backend='memory')
+
+
+@given(u'a genesis block with the accounts {alloc:Py}')  # noqa
+def step_impl(context, alloc):
+    context.block = genesis(alloc)
+    context.genesis_root = context.block.state.root
+
+
+@when(u'{value:d} is moved from the account {sender:Py} to the account {to:Py}')  # noqa
+def step_impl(context, value, sender, to):
+    assert context.block.delta_balance(sender, -value)
+    context.block.delta_balance(to, value)
+
+
+@when(u'the account {address:Py} is deleted')  # noqa
+def step_impl(context, address):
+    context.block.del_account(address)
+
+
+@when(u'a snapshot is taken')  # noqa
+def step_impl(context):
+    context.snapshot = context.block.snapshot()
+
+
+@when(u'the snapshot is reverted')  # noqa
+def step_impl(context):
+    context.block.revert(context.snapshot)
+
+
+@when(u'the state is committed')  # noqa
+def step_impl(context):
+    context.block.commit_state()
+
+
+@then(u'the balances are {balances:Py}')  # noqa
+def step_impl(context, balances):
+    context.balances = balances
+    for address, balance in balances.items():
+        assert context.block.get_balance(address) == balance
+
+
+@then(u'the state root has not changed')  # noqa
+def step_impl(context):
+    assert context.block.state.root == context.genesis_root
+
+
+@then(u'the state root is the one of a genesis block with those balances')  # noqa
+def step_impl(context):
+    assert context.block.state.root == genesis(context.balances).state.root
+
+
+@then(u'the state root is the one of a genesis block with {alloc:Py}')  # noqa
+def step_impl(context, alloc):
+    assert context.block.state.root == genesis(alloc).state.root
+
+
+@when(u'the storage of {address:Py} is set to {values:Py}')  # noqa
+def step_impl(context, address, values):
+    for index, value in values.items():
+        context.block.set_storage_data(address, index, value)
+
+
+@then(u'the storage of {address:Py} is {values:Py}')  # noqa
+def step_impl(context, address, values):
+    for index, value in values.items():
+        assert context.block.get_storage_data(address, index) == value
+
+
+@then(u'the storage trie of {address:Py} holds {values:Py}')  # noqa
+def step_impl(context, address, values):
+    items = context.block.get_storage(address).iter_items()
+    assert dict((utils.decode_int(k), utils.decode_int(v))
+                for k, v in items) == values
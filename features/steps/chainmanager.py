@@ -0,0 +1,89 @@
+from behave import register_type
+from .utils import parse_py
+
+from ConfigParser import ConfigParser
+from pyethereum import rlp
+from pyethereum import utils
+from pyethereum import blocks
+from pyethereum.db import DB, CHECKPOINT_KEY
+from pyethereum.trie import Trie
+from pyethereum.pruning import Pruner
+
+register_type(Py=parse_py)
+
+
+def chain_manager(context):
+    # imported here, its signal receivers are connected until the end of
+    # the feature only, see hooks/chainmanager.py
+    from pyethereum.chainmanager import ChainManager
+    chain_manager = ChainManager()
+    chain_manager.blockchain = DB(context.db_path)
+    return chain_manager
+
+
+def start_chain(context):
+    context.chain_manager = chain_manager(context)
+    genesis = blocks.genesis({'1' * 40: 10 ** 18}, db_path=context.db_path)
+    # not the genesis of the network, which add_block would accept as is
+    context.db.put(genesis.hash(), rlp.encode(
+        [genesis.serialize(), utils.int_to_big_endian(genesis.difficulty)]))
+    context.blocks = dict(genesis=genesis)
+    context.states = {}
+
+
+@given(u'a chain manager')  # noqa
+def step_impl(context):
+    start_chain(context)
+
+
+@given(u'a chain manager whose pruner keeps the last {count:d} block numbers')  # noqa
+def step_impl(context, count):
+    # created first, to collect the genesis state as well
+    context.pruner = Pruner(context.db, count)
+    start_chain(context)
+    context.chain_manager.pruner = context.pruner
+
+
+@when(u'block "{name}" with difficulty {difficulty:d} is added on top of "{parent}"')  # noqa
+def step_impl(context, name, difficulty, parent):
+    parent = context.blocks[parent]
+    block = blocks.Block(prevhash=parent.hash(), number=parent.number + 1,
+                         state_root=parent.state.root, difficulty=difficulty,
+                         db_path=context.db_path)
+    # a state of its own
+    block.set_balance(utils.sha3(str(name))[:20], difficulty)
+    block.commit_state()
+    context.blocks[name] = block
+    context.states[name] = Trie(context.db_path, block.state.root).to_dict()
+    context.chain_manager.add_block(block)
+
+
+@when(u'the chain manager is shut down')  # noqa
+def step_impl(context):
+    context.chain_manager.post_loop()
+
+
+@when(u'the chain manager is restarted')  # noqa
+def step_impl(context):
+    context.chain_manager = chain_manager(context)
+    config = ConfigParser()
+    config.add_section('misc')
+    config.set('misc', 'prune_retain_blocks', '0')
+    context.chain_manager.configure(config)
+
+
+@then(u'block "{name}" is the head')  # noqa
+def step_impl(context, name):
+    blockhash = context.blocks[name].hash()
+    assert context.db.get('head') == blockhash
+
+
+@then(u'the state of block "{name}" is complete')  # noqa
+def step_impl(context, name):
+    state = Trie(context.db_path, context.blocks[name].state.root)
+    assert state.to_dict() == context.states[name]
+
+
+@then(u'the checkpoint in the database is the hash of block "{name}"')  # noqa
+def step_impl(context, name):
+    assert context.db.db.get(CHECKPOINT_KEY) == context.blocks[name].hash()
@@ -0,0 +1,182 @@
+from behave import register_type
+from .utils import parse_py
+
+import time
+import leveldb
+from pyethereum import db
+from pyethereum.db import DB, CHECKPOINT_KEY
+
+register_type(Py=parse_py)
+
+
+@given(u'the flush policy is "{policy}"')  # noqa
+def step_impl(context, policy):
+    context.db.journal.flush_policy = policy
+
+
+@given(u'the flush policy is "{policy}" with a limit of {limit:d} bytes')  # noqa
+def step_impl(context, policy, limit):
+    context.db.journal.flush_policy = policy
+    context.db.journal.max_pending_bytes = limit
+
+
+@given(u'the flush policy is "{policy}" with an interval of {interval:d} ms')  # noqa
+def step_impl(context, policy, interval):
+    context.db.journal.flush_policy = policy
+    context.db.journal.flush_interval_ms = interval
+
+
+@given(u'at most {limit:d} bytes may be pending')  # noqa
+def step_impl(context, limit):
+    context.db.journal.max_pending_bytes = limit
+
+
+@when(u'the pairs {pairs:Py} are put')  # noqa
+def step_impl(context, pairs):
+    for k, v in sorted(pairs.items()):
+        context.db.put(k, v)
+
+
+@when(u'committed')  # noqa
+def step_impl(context):
+    context.db.commit()
+
+
+@when(u'the block is committed')  # noqa
+def step_impl(context):
+    context.db.commit_block()
+
+
+@when(u'the last flush was {seconds:d} seconds ago')  # noqa
+def step_impl(context, seconds):
+    context.db.journal.last_flush = time.time() - seconds
+
+
+@then(u'{size:d} bytes are pending')  # noqa
+def step_impl(context, size):
+    assert context.db.journal.metrics()['pending_bytes'] == size
+
+
+@then(u'nothing is pending')  # noqa
+def step_impl(context):
+    metrics = context.db.journal.metrics()
+    assert metrics['pending_bytes'] == 0
+    assert metrics['pending_keys'] == 0
+
+
+@then(u'{size:d} bytes were flushed in {count:d} flush')  # noqa
+def step_impl(context, size, count):
+    metrics = context.db.journal.metrics()
+    assert metrics['flushed_bytes'] == size
+    assert metrics['flushes'] == count
+
+
+@then(u'the pairs {pairs:Py} are in the database')  # noqa
+def step_impl(context, pairs):
+    for k, v in pairs.items():
+        assert context.db.db.get(k) == v
+
+
+@then(u'a new DB on the same file gets {value:Py} for {key:Py}')  # noqa
+def step_impl(context, value, key):
+    assert DB(context.db_path).get(key) == value
+    try:
+        context.db.db.get(key)
+        assert False, 'not flushed yet'
+    except KeyError:
+        pass
+
+
+@given(u'the durability mode is "{durability}"')  # noqa
+def step_impl(context, durability):
+    context.db.journal.durability = durability
+
+
+@given(u'the durability mode is "{durability}" every {interval:d} ms')  # noqa
+def step_impl(context, durability, interval):
+    context.db.journal.durability = durability
+    context.db.journal.sync_interval_ms = interval
+
+
+@when(u'the block with head {head:Py} is committed')  # noqa
+def step_impl(context, head):
+    context.db.commit_block(head=head)
+
+
+@when(u'the last sync was {seconds:d} seconds ago')  # noqa
+def step_impl(context, seconds):
+    context.db.journal.last_sync = time.time() - seconds
+
+
+@then(u'{count:d} flush was synced')  # noqa
+def step_impl(context, count):
+    assert context.db.journal.metrics()['syncs'] == count
+
+
+@then(u'the checkpoint in the database is {head:Py}')  # noqa
+def step_impl(context, head):
+    assert context.db.db.get(CHECKPOINT_KEY) == head
+
+
+@when(u'an overlay is pushed')  # noqa
+def step_impl(context):
+    context.overlays = getattr(context, 'overlays', [])
+    context.overlays.append(context.db.push_overlay())
+
+
+@when(u'the overlay is committed')  # noqa
+def step_impl(context):
+    context.db.commit_overlay(context.overlays.pop())
+
+
+@when(u'the overlay is reverted')  # noqa
+def step_impl(context):
+    context.db.revert_overlay(context.overlays.pop())
+
+
+@then(u'the DB gets {value:Py} for {key:Py}')  # noqa
+def step_impl(context, value, key):
+    assert context.db.get(key) == value
+
+
+@then(u'the DB does not find {key:Py}')  # noqa
+def step_impl(context, key):
+    try:
+        context.db.get(key)
+        assert False, 'found'
+    except KeyError:
+        pass
+
+
+@when(u'{count:d} nodes are put in the node cache')  # noqa
+def step_impl(context, count):
+    context.nodes = [str(i) * 32 for i in range(count)]
+    for node in context.nodes:
+        context.db.node_cache.put(node, [node])
+
+
+@when(u'the node cache size is configured to {size:d}')  # noqa
+def step_impl(context, size):
+    context.add_cleanup(db.configure, node_cache_size=db.NODE_CACHE_SIZE)
+    db.configure(node_cache_size=size)
+
+
+@when(u'the flush thresholds are configured to {limit:d} bytes and {interval:d} ms')  # noqa
+def step_impl(context, limit, interval):
+    context.add_cleanup(db.configure,
+                        max_pending_bytes=db.MAX_PENDING_BYTES,
+                        flush_interval_ms=db.FLUSH_INTERVAL_MS)
+    db.configure(max_pending_bytes=limit, flush_interval_ms=interval)
+
+
+@then(u'the flush thresholds of the database are {limit:d} bytes and {interval:d} ms')  # noqa
+def step_impl(context, limit, interval):
+    assert context.db.journal.max_pending_bytes == limit
+    assert context.db.journal.flush_interval_ms == interval
+
+
+@then(u'the node cache holds the last {count:d} nodes')  # noqa
+def step_impl(context, count):
+    cache = context.db.node_cache
+    assert len(cache) == count
+    assert all(node in cache for node in context.nodes[-count:])
@@ -2,6 +2,7 @@ from behave import register_type
 from .utils import parse_py
 
 from pyethereum import rlp
+from pyethereum.packeter import Packeter, PacketReader
 from pyethereum.utils import big_endian_to_int, recursive_int_to_big_endian
 
 register_type(Py=parse_py)
@@ -33,3 +34,41 @@ def step_impl(context):
 @then(u'bytes [8:] data equal to RLP-serialised payload data')  # noqa
 def step_impl(context):
     assert context.packet[8:] == context.encoded_data
+
+
+@given(u'to be packeted payloads: {payloads:Py}')  # noqa
+def step_impl(context, payloads):
+    context.payloads = payloads
+
+
+@when(u'the packets are fed to a packet reader in chunks of {size:d} bytes')  # noqa
+def step_impl(context, size):
+    stream = ''.join(context.packeter.dump_packet(p) for p in context.payloads)
+    reader = PacketReader()
+    context.frames = []
+    for i in range(0, len(stream), size):
+        context.frames.extend(reader.feed(stream[i:i + size]))
+
+
+@then(u'the packet reader returns each command and its data once, in order')  # noqa
+def step_impl(context):
+    expected = []
+    for payload in context.payloads:
+        payload = recursive_int_to_big_endian(payload)
+        expected.append((Packeter.cmd_map[big_endian_to_int(payload[0])],
+                         payload[1:]))
+    assert context.frames == expected
+
+
+@then(u'the items of the Blocks packets are lazily decoded lists')  # noqa
+def step_impl(context):
+    for cmd, data in context.frames:
+        if cmd == 'Blocks':
+            assert all(isinstance(item, rlp.LazyList) for item in data)
+
+
+@then(u'the items of the other packets are lists')  # noqa
+def step_impl(context):
+    for cmd, data in context.frames:
+        if cmd != 'Blocks':
+            assert all(isinstance(item, list) for item in data)
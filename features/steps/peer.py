@@ -88,6 +88,29 @@ def step_impl(context):
     context.add_recv_packet(context.packet)
 
 
+@given(u'a packet with a bad sync token')  # noqa
+def step_impl(context):
+    packet = context.packeter.dump_packet('this is a test packet')
+    context.packet = '\x00' * 4 + packet[4:]
+
+
+@when(u'the sizes of the data received from peer are recorded')  # noqa
+def step_impl(context):
+    process_recv = context.peer._process_recv
+    context.recv_sizes = []
+
+    def recorded():
+        size = process_recv()
+        context.recv_sizes.append(size)
+        return size
+    context.peer._process_recv = recorded
+
+
+@then(u'the size of the packet is among the recorded sizes')  # noqa
+def step_impl(context):
+    assert len(context.packet) in context.recv_sizes
+
+
 @then(u'peer.send_Disconnect should be called once with args: reason')  # noqa
 def step_impl(context):
     func = context.peer.send_Disconnect
@@ -0,0 +1,121 @@
+from behave import register_type
+from .utils import parse_py
+
+import random
+from pyethereum import db
+from pyethereum.trie import Trie, size_key
+from pyethereum.pruning import Pruner
+
+register_type(Py=parse_py)
+
+
+def reachable(trie, node, nodes):
+    '''collect the hashes of the nodes and values under node'''
+    if isinstance(node, str):
+        if len(node) < 32:
+            return nodes
+        nodes.add(node)
+        node = trie._decode_node(node)
+    if len(node) == 17:
+        for child in node[:16]:
+            reachable(trie, child, nodes)
+        value = node[16]
+    elif ord(node[0][0]) & 0x20:
+        value = node[1]
+    else:
+        return reachable(trie, node[1], nodes)
+    if len(value) == 32:
+        nodes.add(value)
+    return nodes
+
+
+@given(u'a pruner keeping the last {count:d} states')  # noqa
+def step_impl(context, count):
+    context.pruner = Pruner(context.db, count)
+    context.trie = Trie(context.db_path)
+    context.roots = []
+    context.pairs = {}
+    context.keys = []
+
+
+@when(u'{count:d} pairs are inserted one by one, retaining the state after each')  # noqa
+def step_impl(context, count):
+    random.seed(0)
+    for i in range(count):
+        key = ''.join(chr(random.randint(0, 255)) for j in range(20))
+        context.pairs[key] = str(i) * 40
+        context.keys.append(key)
+        context.trie.update(key, context.pairs[key])
+        context.pruner.retain(roots=[context.trie.root])
+        context.roots.append(context.trie.root)
+    context.first_key = context.keys[0]
+
+
+@when(u'the first pair is changed and the state retained')  # noqa
+def step_impl(context):
+    context.trie.update(context.first_key, 'changed')
+    context.pruner.retain(roots=[context.trie.root])
+
+
+@when(u'the first pair is changed back')  # noqa
+def step_impl(context):
+    context.trie.update(context.first_key, context.pairs[context.first_key])
+
+
+@when(u'the pruner runs in steps of {size:d} nodes')  # noqa
+def step_impl(context, size):
+    context.written = set(context.pruner.written)
+    context.steps = 1
+    while context.pruner.step(size):
+        context.steps += 1
+
+
+@when(u'the pruner runs to completion')  # noqa
+def step_impl(context):
+    context.pruner.collect()
+
+
+@then(u'it took more than one step')  # noqa
+def step_impl(context):
+    assert context.steps > 1
+
+
+@then(u'no node was deleted yet')  # noqa
+def step_impl(context):
+    assert context.pruner.garbage
+    for key in context.written:
+        context.db.get(key)
+
+
+@then(u'the last {count:d} retained states are complete')  # noqa
+def step_impl(context, count):
+    for i in range(len(context.roots) - count, len(context.roots)):
+        t = Trie(context.db_path, context.roots[i])
+        for key in context.keys[:i + 1]:
+            assert t.get(key) == context.pairs[key]
+
+
+@then(u'of the nodes written, only those reachable from them are left')  # noqa
+def step_impl(context):
+    live = set()
+    for root in context.roots[-2:]:
+        reachable(context.trie, root, live)
+        live.add(size_key(root))
+    assert context.pruner.pruned
+    for key in context.written:
+        try:
+            context.db.get(key)
+            assert key in live
+        except KeyError:
+            assert key not in live
+
+
+@then(u'every pair can be read from the trie')  # noqa
+def step_impl(context):
+    for key, value in context.pairs.items():
+        assert context.trie.get(key) == value
+
+
+@then(u'the nodes of the other states were deleted')  # noqa
+def step_impl(context):
+    assert context.pruner.pruned
@@ -12,6 +12,13 @@ def step_impl(context, src):
     context.src = recursive_int_to_big_endian(src)
 
 
+@given(u'a to be rlp encoded payload nested {depth:d} lists deep: {src:Py}')  # noqa
+def step_impl(context, depth, src):
+    for i in range(depth):
+        src = [src]
+    context.src = src
+
+
 @when(u'encoded in RLP')  # noqa
 def step_impl(context):
     context.dst = rlp.encode(context.src)
@@ -91,3 +98,72 @@ def step_impl(context):
 @then(u'the rlp encoded result will be equal to {dst:Py}')  # noqa
 def step_impl(context, dst):
     assert context.dst.encode('hex') == dst
+
+
+@then(u'descending {depth:d} levels into the RLP encoded data will get {dst:Py}')  # noqa
+def step_impl(context, depth, dst):
+    assert rlp.descend(context.dst, *([0] * depth)).encode('hex') == dst
+
+
+@when(u'lazily decoded')  # noqa
+def step_impl(context):
+    context.lazy = rlp.decode_lazy(context.dst)
+    assert isinstance(context.lazy, rlp.LazyList)
+
+
+@then(u'item {index:Py} of the lazily decoded data is {item:Py}')  # noqa
+def step_impl(context, index, item):
+    res = context.lazy
+    for i in index:
+        res = res[i]
+    assert res == item
+
+
+@then(u'the lists on the way to item {index:Py} are decoded once')  # noqa
+def step_impl(context, index):
+    res = context.lazy
+    for i in index[:-1]:
+        assert res[i] is res[i]
+        res = res[i]
+
+
+@then(u'the lazily decoded data equals the original data')  # noqa
+def step_impl(context):
+    assert context.lazy == context.src
+    assert context.lazy.to_list() == context.src
+
+
+@then(u'encode the lazily decoded data will get the RLP encoded data')  # noqa
+def step_impl(context):
+    assert rlp.encode(context.lazy) == context.dst
+    assert rlp.encode([context.lazy]) == rlp.encode([context.src])
+
+
+def item_paths(item, path=()):
+    yield path, item
+    if isinstance(item, list):
+        for i, child in enumerate(item):
+            for res in item_paths(child, path + (i,)):
+                yield res
+
+
+@when(u'indexed')  # noqa
+def step_impl(context):
+    context.index = rlp.OffsetIndex(context.dst)
+
+
+@then(u'every path in the original data leads to the same item in the index')  # noqa
+def step_impl(context):
+    for path, item in item_paths(context.src):
+        assert context.index.decode(*path) == item
+        assert context.index.descend(*path) == rlp.encode(item)
+        if isinstance(item, list):
+            assert context.index.count(*path) == len(item)
+
+
+@then(u'the index descends to the same RLP data as descend')  # noqa
+def step_impl(context):
+    for path, item in item_paths(context.src):
+        if path:
+            assert context.index.descend(*path) == \
+                rlp.descend(context.dst, *path)
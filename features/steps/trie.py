@@ -81,17 +81,191 @@ def step_impl(context, key):
     context.pairs = new_pairs
 
 
+@when(u'update the values of the keys: {keys:Py} to lists')  # noqa
+def step_impl(context, keys):
+    new_pairs = []
+    for (k, v) in context.pairs:
+        if k in keys:
+            v = ['', k]
+            context.trie.update(k, v)
+        new_pairs.append((k, v))
+    context.pairs = new_pairs
+
+
+@when(u'delete by the keys: {keys:Py}')  # noqa
+def step_impl(context, keys):
+    for key in keys:
+        context.trie.delete(key)
+    context.pairs = [(k, v) for (k, v) in context.pairs if k not in keys]
+
+
+@when(u'delete by the keys in a batch: {keys:Py}')  # noqa
+def step_impl(context, keys):
+    with context.trie.batch():
+        for key in keys:
+            context.trie.delete(key)
+    context.pairs = [(k, v) for (k, v) in context.pairs if k not in keys]
+
+
+@then(u'get with each key returns its value')  # noqa
+def step_impl(context):
+    for (key, value) in context.pairs:
+        assert context.trie.get(key) == value
+
+
 @then(u'get size will return the correct number')  # noqa
 def step_impl(context):
     assert context.trie.get_size() == len(context.pairs)
 
 
+@then(u'a new trie on the same database and root reads its size without counting')  # noqa
+def step_impl(context):
+    t = trie.Trie(context.trie.db.dbfile, context.trie.root)
+    t._count_pairs = None
+    assert t.get_size() == len(context.pairs)
+
+
 @then(u'to_dict will return the correct dict')  # noqa
 def step_impl(context):
     res = context.trie.to_dict()
     assert dict(context.pairs) == res
 
 
+@then(u'the proof of each key verifies its value against the root')  # noqa
+def step_impl(context):
+    for (key, value) in context.pairs:
+        proof = context.trie.get_proof(key)
+        assert trie.verify_proof(context.trie.root, key, proof) == value
+
+
+@then(u'the proof of the key: {key:Py} verifies that it does not exist')  # noqa
+def step_impl(context, key):
+    proof = context.trie.get_proof(key)
+    assert proof
+    assert trie.verify_proof(context.trie.root, key, proof) is None
+
+
+@then(u'a proof missing one of its nodes is rejected')  # noqa
+def step_impl(context):
+    key = context.pairs[-1][0]
+    proof = context.trie.get_proof(key)
+    for i in range(len(proof)):
+        try:
+            trie.verify_proof(context.trie.root, key,
+                              proof[:i] + proof[i + 1:])
+        except trie.InvalidProof:
+            pass
+        else:
+            assert False, "proof without node %d verified" % i
+
+
+@then(u'iterating with {bounds:Py} returns the pairs in that range in key order')  # noqa
+def step_impl(context, bounds):
+    prefix = bounds.get('prefix', '')
+    start = bounds.get('start', '')
+    end = bounds.get('end')
+    expected = [(k, v) for (k, v) in sorted(context.pairs)
+                if k.startswith(prefix) and k >= start
+                and (end is None or k < end)]
+    expected = expected[:bounds.get('limit')]
+    assert list(context.trie.iter_items(**bounds)) == expected
+
+
+@when(u'insert pairs in a batch')  # noqa
+def step_impl(context):
+    with context.trie.batch():
+        for (key, value) in context.pairs[:1]:
+            context.trie.update(key, value)
+        context.trie.update_many(context.pairs[1:])
+        key, value = context.pairs[-1]
+        assert context.trie.get(key) == value
+    assert not isinstance(context.trie.root, list) \
+        or len(rlp.encode(context.trie.root)) < 32
+
+
+@when(u'remember the root')  # noqa
+def step_impl(context):
+    context.remembered = (context.trie.root, dict(context.pairs))
+
+
+@then(u'the diff from the remembered root lists the changed pairs in key order')  # noqa
+def step_impl(context):
+    old_root, old = context.remembered
+    new = dict(context.pairs)
+    expected = [(k, old.get(k), new.get(k)) for k in sorted(set(old) | set(new))
+                if old.get(k) != new.get(k)]
+    assert expected
+    assert list(context.trie.diff(old_root, context.trie.root)) == expected
+
+
+@then(u'the diff of a root with itself is empty')  # noqa
+def step_impl(context):
+    root = context.trie.root
+    assert list(context.trie.diff(root, root)) == []
+
+
+@when(u'insert pairs in a batch hashed by {workers:d} worker processes')  # noqa
+def step_impl(context, workers):
+    min_updates = trie.HASH_WORKERS_MIN_UPDATES
+    trie.HASH_WORKERS_MIN_UPDATES = 1
+    trie.configure_hashing(workers)
+    try:
+        with context.trie.batch():
+            for (key, value) in context.pairs:
+                context.trie.update(key, value)
+    finally:
+        trie.configure_hashing(0)
+        trie.HASH_WORKERS_MIN_UPDATES = min_updates
+
+
+@when(u'load the pairs in bulk, sorted by key')  # noqa
+def step_impl(context):
+    context.trie.bulk_load(sorted(context.pairs))
+
+
+@then(u'the root is the same as inserting the pairs one by one')  # noqa
+def step_impl(context):
+    root = context.trie.root
+    context.trie.clear()
+    for (key, value) in context.pairs:
+        context.trie.update(key, value)
+    assert context.trie.root == root
+
+
+@then(u'deleting every pair in a batch makes the root blank')  # noqa
+def step_impl(context):
+    with context.trie.batch():
+        for (key, value) in context.pairs:
+            context.trie.delete(key)
+    assert context.trie.root == ''
+
+
+@when(u'read every pair once')  # noqa
+def step_impl(context):
+    for (key, value) in context.pairs:
+        assert context.trie.get(key) == str(value)
+
+
+@then(u'reading every pair again does not miss the node cache')  # noqa
+def step_impl(context):
+    cache = context.trie.db.node_cache
+    cache.reset_stats()
+    for (key, value) in context.pairs:
+        assert context.trie.get(key) == str(value)
+    assert cache.misses == 0
+
+
+@then(u'a new trie on the same database and root shares the node cache')  # noqa
+def step_impl(context):
+    t = trie.Trie(context.trie.db.dbfile, context.trie.root)
+    assert t.db.node_cache is context.trie.db.node_cache
+    cache = t.db.node_cache
+    cache.reset_stats()
+    for (key, value) in context.pairs:
+        assert t.get(key) == str(value)
+    assert cache.misses == 0
+
+
 @given(u'input dictionary: {input_dict:Py}')  # noqa
 def step_impl(context, input_dict):
     context.input_dict = input_dict
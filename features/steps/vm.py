@@ -0,0 +1,80 @@
+from behave import register_type
+from .utils import parse_py
+
+from pyethereum import blocks
+from pyethereum import processblock
+from pyethereum import transactions
+from pyethereum import utils
+
+register_type(Py=parse_py)
+
+DB_PATH = 'memory-vm-test'
+SENDER = '1' * 40
+CONTRACT = '2' * 40
+KEY = utils.sha3('vm')
+
+
+@given(u'a contract with the code {code:Py}')  # noqa
+def step_impl(context, code):
+    context.block = blocks.genesis(
+        {SENDER: 1, utils.privtoaddr(KEY): 10 ** 18}, db_path=DB_PATH,
+        backend='memory')
+    context.block.set_code(CONTRACT, code.decode('hex'))
+    processblock.program_cache.clear()
+    processblock.program_cache.reset_stats()
+
+
+@given(u'the contract {address:Py} has the code {code:Py}')  # noqa
+def step_impl(context, address, code):
+    context.block.set_code(address, code.decode('hex'))
+
+
+@when(u'it is called with {gas:d} gas')  # noqa
+def step_impl(context, gas):
+    msg = processblock.Message(SENDER, CONTRACT, 0, gas, '')
+    context.result = processblock.apply_msg(context.block, None, msg)
+
+
+@when(u'it is called with {gas:d} gas and a value of {value:d}')  # noqa
+def step_impl(context, gas, value):
+    msg = processblock.Message(SENDER, CONTRACT, value, gas, '')
+    context.result = processblock.apply_msg(context.block, None, msg)
+
+
+@when(u'a transaction calls it with {gas:d} gas')  # noqa
+def step_impl(context, gas):
+    sender = utils.privtoaddr(KEY)
+    tx = transactions.Transaction(
+        context.block.get_nonce(sender), 1, gas, CONTRACT, 0, '').sign(KEY)
+    context.result = processblock.apply_tx(context.block, tx)
+
+
+@then(u'the transaction succeeds')  # noqa
+def step_impl(context):
+    assert context.result[0]
+
+
+@then(u'the balance of {address:Py} is {balance:d}')  # noqa
+def step_impl(context, address, balance):
+    assert context.block.get_balance(address) == balance
+
+
+@then(u'no database overlay is open')  # noqa
+def step_impl(context):
+    assert not context.block.state.db.journal.overlays
+
+
+@then(u'the call returns {result:d} with {gas_left:d} gas left')  # noqa
+def step_impl(context, result, gas_left):
+    assert context.result[:2] == (result, gas_left)
+
+
+@then(u'the output is {output:Py}')  # noqa
+def step_impl(context, output):
+    assert str(context.result[2]) == output.decode('hex')
+
+
+@then(u'its code was decoded once')  # noqa
+def step_impl(context):
+    cache = processblock.program_cache
+    assert (cache.misses, cache.hits) == (1, 1)
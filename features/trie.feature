@@ -206,6 +206,163 @@ Feature: trie tree manipulate
       | ["\x03\xe8", "\x03\xe9", "\x03\xe8"] |
 
 
+  Scenario Outline: insert and delete pairs in a batch
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And insert pairs in a batch
+    Then for each pair, get with key will return the correct value
+    And the root is the same as inserting the pairs one by one
+    And deleting every pair in a batch makes the root blank
+
+    Examples:
+      | keys                                                                     |
+      | ["AB"]                                                                   |
+      | ["A", "Z", "B"]                                                          |
+      | ["AB", "AC", "ABCD", "ACD", "A", "B", "CD", "BCD", "Z", "0", "Z0", "0Z"] |
+      | [str(x) * 16 for x in range(20)]                                         |
+      | [chr(x) + chr(y) for x in range(10) for y in range(10)]                  |
+
+
+  Scenario Outline: diff two roots
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And insert pairs
+    And remember the root
+    And update the values of the keys: <updated> to lists
+    And delete by the keys: <deleted>
+    Then the diff from the remembered root lists the changed pairs in key order
+    And the diff of a root with itself is empty
+
+    Examples:
+      | keys                                                    | updated        | deleted              |
+      | ["dog", "doge", "do", "horse"]                          | ["do", "dog"]  | ["doge", "horse"]    |
+      | ["AB", "AC", "ACD", "A", "B", "CD", "BCD", "Z", "0"]    | ["A", "ACD"]   | ["AC", "B", "CD"]    |
+      | [chr(x) + chr(y) for x in range(16) for y in range(16)] | ["\x01\x01"]   | ["\x01\x02", "\x0f"] |
+
+
+  Scenario Outline: load sorted pairs in bulk
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And load the pairs in bulk, sorted by key
+    Then for each pair, get with key will return the correct value
+    And the root is the same as inserting the pairs one by one
+    And get size will return the correct number
+
+    Examples:
+      | keys                                                                     |
+      | []                                                                       |
+      | ["AB"]                                                                   |
+      | ["AB", "AC", "ABCD", "ACD", "A", "B", "CD", "BCD", "Z", "0", "Z0", "0Z"] |
+      | [str(x) * 16 for x in range(20)]                                         |
+      | [chr(x) + chr(y) for x in range(16) for y in range(16)]                  |
+
+
+  Scenario Outline: hash the nodes of a batch in worker processes
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And insert pairs in a batch hashed by 2 worker processes
+    Then for each pair, get with key will return the correct value
+    And the root is the same as inserting the pairs one by one
+
+    Examples:
+      | keys                                                                     |
+      | ["AB"]                                                                   |
+      | ["AB", "AC", "ABCD", "ACD", "A", "B", "CD", "BCD", "Z", "0", "Z0", "0Z"] |
+      | [chr(x) + chr(y) for x in range(16) for y in range(16)]                  |
+      | ["\x01" + chr(x) + chr(y) for x in range(16) for y in range(16)]          |
+
+
+  Scenario Outline: the root only depends on the pairs in the trie
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And insert pairs
+    And update the values of the keys: <updated> to lists
+    And delete by the keys: <deleted>
+    Then get with each key returns its value
+    And the root is the same as inserting the pairs one by one
+
+    Examples:
+      | keys                                          | updated       | deleted             |
+      | ["a", "ab", "abc"]                            | ["ab"]        | ["abc"]             |
+      | ["dog", "doge", "do", "horse"]                | ["do", "dog"] | ["doge", "horse"]   |
+      | ["AB", "AC", "ACD", "A", "B", "CD", "BCD"]    | ["A", "ACD"]  | ["AC", "B", "CD"]   |
+      | [chr(x) + chr(y) for x in range(4) for y in range(4)] | ["\x01\x01"] | ["\x01\x02", "\x02\x01"] |
+
+
+  Scenario Outline: the size is stored along with committed roots
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And insert pairs in a batch
+    And delete by the keys in a batch: <deleted>
+    Then get size will return the correct number
+    And a new trie on the same database and root reads its size without counting
+
+    Examples:
+      | keys                                                    | deleted                  |
+      | ["dog", "doge", "do", "horse"]                          | ["doge", "cat"]          |
+      | [chr(x) + chr(y) for x in range(16) for y in range(16)] | ["\x01\x01", "\x0f"]    |
+
+
+  Scenario Outline: the size is stored by updates outside a batch
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And insert pairs
+    And delete by the keys: <deleted>
+    Then a new trie on the same database and root reads its size without counting
+
+    Examples:
+      | keys                                                    | deleted                  |
+      | ["dog", "doge", "do", "horse"]                          | ["doge", "cat"]          |
+
+
+  Scenario Outline: prove the value of a key, or that it does not exist
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And insert pairs
+    And update the values of the keys: <updated> to lists
+    Then the proof of each key verifies its value against the root
+    And the proof of the key: <missing> verifies that it does not exist
+    And a proof missing one of its nodes is rejected
+
+    Examples:
+      | keys                                                    | updated       | missing    |
+      | ["dog", "doge", "do", "horse"]                          | ["do"]        | "dogs"     |
+      | ["AB", "AC", "ACD", "A", "B", "CD", "BCD", "Z", "0"]    | ["A", "ACD"]  | "AD"       |
+      | [chr(x) + chr(y) for x in range(16) for y in range(16)] | ["\x01\x01"]  | "\x01"     |
+
+
+  Scenario Outline: iterate over the pairs in key order
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And insert pairs
+    Then iterating with <bounds> returns the pairs in that range in key order
+
+    Examples:
+      | keys                                                    | bounds                                      |
+      | ["dog", "doge", "do", "horse"]                          | dict()                                      |
+      | ["dog", "doge", "do", "horse"]                          | dict(prefix="do")                           |
+      | ["dog", "doge", "do", "horse"]                          | dict(start="dog", end="horse")              |
+      | ["dog", "doge", "do", "horse"]                          | dict(start="dp", limit=1)                   |
+      | ["AB", "AC", "ACD", "A", "B", "CD", "BCD", "Z", "0"]    | dict(prefix="A", start="AB", limit=2)       |
+      | [chr(x) + chr(y) for x in range(16) for y in range(16)] | dict(prefix="\x0f")                         |
+      | [chr(x) + chr(y) for x in range(16) for y in range(16)] | dict(start="\x03\x0e", end="\x05", limit=9) |
+      | [chr(x) + chr(y) for x in range(16) for y in range(16)] | dict(end="")                                |
+
+
+  Scenario Outline: repeated reads are served from the node cache
+    Given pairs with keys: <keys>
+    When clear trie tree
+    And insert pairs
+    And read every pair once
+    Then reading every pair again does not miss the node cache
+    And a new trie on the same database and root shares the node cache
+
+    Examples:
+      | keys                                                             |
+      | ["AB", "AC", "ACD", "A", "B", "CD", "BCD", "Z", "0", "Z0", "0Z"] |
+      | [str(x) * 16 for x in range(20)]                                 |
+
+
   Scenario Outline: conform to fixture
     Given input dictionary: <in>
     When clear trie tree
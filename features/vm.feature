@@ -0,0 +1,52 @@
+Feature: vm
+
+  Scenario Outline: running code charges the gas of each operation
+    Given a contract with the code <code>
+    When it is called with <gas> gas
+    Then the call returns <result> with <gas_left> gas left
+    And the output is <output>
+
+  Examples:
+    | code                         | gas  | result | gas_left | output           |
+    | '6000600101600258'           | 1000 | 0      | 0        | ''               |
+    | '600360050160005460206000f2' | 100  | 1      | 60       | '00' * 31 + '08' |
+    | '6000600504'                 | 100  | 1      | 97       | ''               |
+    | '5c60005460206000f2'         | 100  | 1      | 62       | '00' * 31 + '64' |
+    | 'a06001a06000f2'             | 10   | 1      | 6        | '00'             |
+    | '60006005046001600101'       | 100  | 1      | 97       | ''               |
+    | '6001600101016001'           | 100  | 1      | 97       | ''               |
+    | '6001600054600160010100'     | 38   | 1      | 0        | ''               |
+    | '6001600054600160010100'     | 37   | 0      | 0        | ''               |
+    | '602060002060005460206000f2' | 100  | 1      | 41       | '9e6291970cb44dd94008c79bcaf9d86f18b4b49ba5b2a04781db7199ed3b9e4e' |
+
+  Scenario: the code of a contract is decoded once
+    Given a contract with the code '6000600101600258'
+    When it is called with 100 gas
+    And it is called with 100 gas
+    Then its code was decoded once
+
+  Scenario: a call writes the output of the called contract to memory
+    Given a contract with the code '6020600060006000600073' + '33' * 20 + '6064f160206000f2'
+    And the contract '33' * 20 has the code '600360050160005460206000f2'
+    When it is called with 1000 gas
+    Then the call returns 1 with 898 gas left
+    And the output is '00' * 31 + '08'
+
+  Scenario: a message failing to transfer its value changes nothing
+    Given a contract with the code '00'
+    When it is called with 100 gas and a value of 5
+    Then the call returns 0 with 100 gas left
+    And the balance of '2' * 40 is 0
+    And the balance of '1' * 40 is 1
+    And no database overlay is open
+
+  Scenario: a call failing to transfer its value, then another transaction
+    Given a contract with the code '60206000600060006005' + '73' + '33' * 20 + '6064f100'
+    When a transaction calls it with 10000 gas
+    Then the transaction succeeds
+    And the balance of '33' * 20 is 0
+    And no database overlay is open
+    When a transaction calls it with 10000 gas
+    Then the transaction succeeds
+    And the balance of '33' * 20 is 0
+    And no database overlay is open
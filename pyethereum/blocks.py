@@ -43,6 +43,41 @@ for i, (name, typ, default) in enumerate(acct_structure):
     acct_structure_rev[name] = [i, typ, default]
 
 
+class Account(object):
+
+    '''an account of the state, with its items decoded
+
+    `exists` is false for an account which is not in the state, `dirty` is
+    set while it differs from the state. `storage_cache` holds the storage
+    values read and written by key, the keys in `storage_dirty` are not in
+    the storage trie yet.
+    '''
+
+    __slots__ = ['nonce', 'balance', 'code', 'storage', 'exists', 'dirty',
+                 'storage_cache', 'storage_dirty']
+
+    def __init__(self, rlpdata=None):
+        for i, (name, typ, default) in enumerate(acct_structure):
+            setattr(self, name, utils.decoders[typ](rlpdata[i])
+                    if rlpdata else default)
+        self.exists = bool(rlpdata)
+        self.dirty = False
+        self.storage_cache = {}
+        self.storage_dirty = set()
+
+    def serialize(self):
+        return [utils.encoders[typ](getattr(self, name))
+                for name, typ, default in acct_structure]
+
+    def copy(self):
+        acct = Account.__new__(Account)
+        for name in self.__slots__:
+            setattr(acct, name, getattr(self, name))
+        acct.storage_cache = dict(self.storage_cache)
+        acct.storage_dirty = set(self.storage_dirty)
+        return acct
+
+
 def calc_difficulty(parent, timestamp):
     offset = parent.difficulty / BLOCK_DIFF_FACTOR
     sign = 1 if timestamp - parent.timestamp < 42 else -1
@@ -69,7 +104,14 @@ class Block(object):
                  gas_limit=block_structure_rev['gas_limit'][2],
                  gas_used=0, timestamp=0, extra_data='', nonce='',
                  transaction_list=[],
-                 uncles=[]):
+                 uncles=[],
+                 db_path=None,
+                 backend=None):
+        '''
+        :param db_path: database of the state, by default the one of the
+        configured data directory
+        :param backend: backend to open it with, see `db.backends`
+        '''
 
         self.prevhash = prevhash
         self.uncles_hash = uncles_hash
@@ -87,14 +129,18 @@ class Block(object):
         self.transaction_list = transaction_list
         self.uncles = uncles
 
-        self.transactions = Trie(get_db_path())
+        self.db_path = db_path or get_db_path()
+        self.backend = backend
+        self.transactions = Trie(self.db_path, backend=backend)
         self.transaction_count = 0
 
         # Fill in nodes for transaction trie
         for tx in transaction_list:
             self.add_transaction_to_list(tx)
 
-        self.state = Trie(get_db_path(), self.state_root)
+        self.state = Trie(self.db_path, self.state_root, backend)
+        # decoded accounts by binary address, see `commit_state`
+        self._accounts = {}
 
         # Basic consistency verifications
         if self.state.root != '' and self.state.db.get(self.state.root) == '':
@@ -110,17 +156,56 @@ class Block(object):
         # TODO: check POW
 
     @classmethod
-    def deserialize(cls, rlpdata):
-        header_args, transaction_list, uncles = rlp.decode(rlpdata)
-        kargs = dict(transaction_list=transaction_list, uncles=uncles)
+    def deserialize(cls, rlpdata, db_path=None, backend=None):
+        '''
+        :param rlpdata: the RLP encoded block, or the block decoded already,
+        e.g. a `rlp.LazyList` from a Blocks packet
+        '''
+        # lazily decoded: the transaction list and uncles are only reencoded
+        # from their raw slices and never materialized
+        if isinstance(rlpdata, str):
+            rlpdata = rlp.decode_lazy(rlpdata)
+        header_args, transaction_list, uncles = rlpdata
+        kargs = dict(transaction_list=transaction_list, uncles=uncles,
+                     db_path=db_path, backend=backend)
         # Deserialize all properties
         for i, (name, typ, default) in enumerate(block_structure):
             kargs[name] = utils.decoders[typ](header_args[i])
         return Block(**kargs)
 
     @classmethod
-    def hex_deserialize(cls, hexrlpdata):
-        return cls.deserialize(hexrlpdata.decode('hex'))
+    def hex_deserialize(cls, hexrlpdata, db_path=None, backend=None):
+        return cls.deserialize(hexrlpdata.decode('hex'), db_path, backend)
+
+    def _get_acct(self, address):
+        ''' get the cached account, read from the state on first use
+        :param address: account address, can be binary or hex string
+        '''
+        if len(address) == 40:
+            address = address.decode('hex')
+        acct = self._accounts.get(address)
+        if acct is None:
+            acct = self._accounts[address] = Account(self.state.get(address))
+        return acct
+
+    def commit_state(self):
+        '''write the accounts changed since the last call to the state
+
+        Account changes are only cached until then, `state.root` is up to
+        date after it.
+        '''
+        dirty = [(address, acct) for address, acct in self._accounts.items()
+                 if acct.dirty]
+        if not dirty:
+            return
+        with self.state.batch():
+            for address, acct in dirty:
+                self._commit_storage(acct)
+                if acct.exists:
+                    self.state.update(address, acct.serialize())
+                else:
+                    self.state.delete(address)
+                acct.dirty = False
 
     # _get_acct_item(bin or hex, int) -> bin
     def _get_acct_item(self, address, param):
@@ -128,11 +213,7 @@ class Block(object):
         :param address: account address, can be binary or hex string
         :param param: parameter to get
         '''
-        if len(address) == 40:
-            address = address.decode('hex')
-        acct = self.state.get(address) or ['', '', '', '']
-        decoder = utils.decoders[acct_structure_rev[param][1]]
-        return decoder(acct[acct_structure_rev[param][0]])
+        return getattr(self._get_acct(address), param)
 
     # _set_acct_item(bin or hex, int, bin)
     def _set_acct_item(self, address, param, value):
@@ -141,12 +222,11 @@ class Block(object):
         :param param: parameter to set
         :param value: new value
         '''
-        if len(address) == 40:
-            address = address.decode('hex')
-        acct = self.state.get(address) or ['', '', '', '']
-        encoder = utils.encoders[acct_structure_rev[param][1]]
-        acct[acct_structure_rev[param][0]] = encoder(value)
-        self.state.update(address, acct)
+        acct = self._get_acct(address)
+        # raises for a value which can not be stored
+        utils.encoders[acct_structure_rev[param][1]](value)
+        setattr(acct, param, value)
+        acct.exists = acct.dirty = True
 
     # _delta_item(bin or hex, int, int) -> success/fail
     def _delta_item(self, address, param, value):
@@ -155,16 +235,24 @@ class Block(object):
         :param param: parameter to increase/decrease
         :param value: can be positive or negative
         '''
-        if len(address) == 40:
-            address = address.decode('hex')
-        acct = self.state.get(address) or ['', '', '', '']
-        index = acct_structure_rev[param][0]
-        if utils.decode_int(acct[index]) + value < 0:
+        acct = self._get_acct(address)
+        value += getattr(acct, param)
+        if value < 0:
             return False
-        acct[index] = utils.encode_int(utils.decode_int(acct[index]) + value)
-        self.state.update(address, acct)
+        utils.encode_int(value)
+        setattr(acct, param, value)
+        acct.exists = acct.dirty = True
         return True
 
+    def del_account(self, address):
+        '''remove an account from the state
+        :param address: account address, can be binary or hex string
+        '''
+        if len(address) == 40:
+            address = address.decode('hex')
+        acct = self._accounts[address] = Account()
+        acct.dirty = True
+
     def add_transaction_to_list(self, tx_rlp):
         self.transactions.update(encode_int(self.transaction_count), tx_rlp)
         self.transaction_count += 1
@@ -195,55 +283,92 @@ class Block(object):
         self._set_acct_item(address, 'code', sha3(value))
 
     def get_storage(self, address):
-        storage_root = self._get_acct_item(address, 'storage')
-        return Trie(utils.get_db_path(), storage_root)
+        acct = self._get_acct(address)
+        self._commit_storage(acct)
+        return Trie(self.db_path, acct.storage, self.backend)
 
     def get_storage_data(self, address, index):
-        t = self.get_storage(address)
-        val = t.get(utils.coerce_to_bytes(index))
-        return utils.decode_int(val) if val else 0
+        acct = self._get_acct(address)
+        key = utils.coerce_to_bytes(index)
+        val = acct.storage_cache.get(key)
+        if val is None:
+            val = Trie(self.db_path, acct.storage, self.backend).get(key)
+            val = acct.storage_cache[key] = utils.decode_int(val) if val else 0
+        return val
 
     def set_storage_data(self, address, index, val):
-        t = self.get_storage(address)
-        if val:
-            t.update(utils.coerce_to_bytes(index), encode_int(val))
-        else:
-            t.delete(utils.coerce_to_bytes(index))
-        self._set_acct_item(address, 'storage', t.root)
+        '''set a storage value, written to the storage trie of the account
+        along with the account by `commit_state`
+        '''
+        acct = self._get_acct(address)
+        key = utils.coerce_to_bytes(index)
+        # raises for a value which can not be stored
+        encode_int(val)
+        acct.storage_cache[key] = val
+        acct.storage_dirty.add(key)
+        acct.exists = acct.dirty = True
+
+    def _commit_storage(self, acct):
+        '''write the storage values set to the storage trie of `acct`'''
+        if not acct.storage_dirty:
+            return
+        t = Trie(self.db_path, acct.storage, self.backend)
+        with t.batch():
+            for key in acct.storage_dirty:
+                val = acct.storage_cache[key]
+                if val:
+                    t.update(key, encode_int(val))
+                else:
+                    t.delete(key)
+        acct.storage = t.root
+        acct.storage_dirty.clear()
 
     def _account_to_dict(self, acct):
         med_dict = {}
         for i, (name, typ, default) in enumerate(acct_structure):
             med_dict[name] = utils.decoders[typ](acct[i])
         chash = med_dict['code']
-        strie = Trie(utils.get_db_path(), med_dict['storage']).to_dict()
+        strie = Trie(self.db_path, med_dict['storage'], self.backend)
         med_dict['code'] = \
             self.state.db.get(chash).encode('hex') if chash else ''
         med_dict['storage'] = {
-            utils.decode_int(k): utils.decode_int(strie[k]) for k in strie
+            utils.decode_int(k): utils.decode_int(v)
+            for k, v in strie.iter_items()
         }
         return med_dict
 
     def account_to_dict(self, address):
-        if len(address) == 40:
-            address = address.decode('hex')
-        acct = self.state.get(address) or ['', '', '', '']
-        return self._account_to_dict(acct)
+        acct = self._get_acct(address)
+        self._commit_storage(acct)
+        return self._account_to_dict(acct.serialize())
 
     # Revert computation
     def snapshot(self):
+        '''start a frame of changes, which `revert` undoes and
+        `commit_snapshot` keeps. The cached accounts are copied rather than
+        committed, and until then the database writes go to an overlay,
+        which reverting drops without writing it.
+        '''
         return {
             'state': self.state.root,
+            'accounts': dict((address, acct.copy())
+                             for address, acct in self._accounts.items()),
             'gas': self.gas_used,
             'txs': self.transactions,
             'txcount': self.transaction_count,
+            'overlay': self.state.db.push_overlay(),
         }
 
     def revert(self, mysnapshot):
         self.state.root = mysnapshot['state']
+        self._accounts = mysnapshot['accounts']
         self.gas_used = mysnapshot['gas']
         self.transactions = mysnapshot['txs']
         self.transaction_count = mysnapshot['txcount']
+        self.state.db.revert_overlay(mysnapshot['overlay'])
+
+    def commit_snapshot(self, mysnapshot):
+        self.state.db.commit_overlay(mysnapshot['overlay'])
 
     # Serialization method; should act as perfect inverse function of the
     # constructor assuming no verification failures
@@ -251,6 +376,7 @@ class Block(object):
         txlist = []
         for i in range(self.transaction_count):
             txlist.append(self.transactions.get(utils.encode_int(i)))
+        self.commit_state()
         self.state_root = self.state.root
         self.tx_list_root = self.transactions.root
         self.uncles_hash = sha3(rlp.encode(self.uncles))
@@ -266,10 +392,10 @@ class Block(object):
         b = {}
         for name, typ, default in block_structure:
             b[name] = getattr(self, name)
-        state = self.state.to_dict(True)
         b["state"] = {}
-        for s in state:
-            b["state"][s.encode('hex')] = self._account_to_dict(state[s])
+        self.commit_state()
+        for address, acct in self.state.iter_items():
+            b["state"][address.encode('hex')] = self._account_to_dict(acct)
         # txlist = []
         # for i in range(self.transaction_count):
         #     txlist.append(self.transactions.get(utils.encode_int(i)))
@@ -285,6 +411,7 @@ class Block(object):
     @classmethod
     def init_from_parent(cls, parent, coinbase, extra_data='',
                          now=time.time()):
+        parent.commit_state()
         return Block(
             prevhash=parent.hash,
             uncles_hash=sha3(rlp.encode([])),
@@ -300,14 +427,23 @@ class Block(object):
             extra_data=extra_data,
             nonce='',
             transaction_list=[],
-            uncles=[])
+            uncles=[],
+            db_path=parent.db_path,
+            backend=parent.backend)
 
 
-def genesis(initial_alloc={}):
+def genesis(initial_alloc={}, db_path=None, backend=None):
     # https://ethereum.etherpad.mozilla.org/11
     block = Block(prevhash="\x00" * 32, coinbase="0" * 40,
                   difficulty=2 ** 22, nonce=sha3(chr(42)),
-                  gas_limit=10 ** 6)
-    for addr in initial_alloc:
-        block.set_balance(addr, initial_alloc[addr])
+                  gas_limit=10 ** 6, db_path=db_path, backend=backend)
+    accounts = []
+    for addr, balance in initial_alloc.iteritems():
+        if len(addr) == 40:
+            addr = addr.decode('hex')
+        acct = [utils.encoders[typ](default)
+                for name, typ, default in acct_structure]
+        acct[acct_structure_rev['balance'][0]] = utils.encode_int(balance)
+        accounts.append((addr, acct))
+    block.state.bulk_load(sorted(accounts))
     return block
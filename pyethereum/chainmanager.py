@@ -5,7 +5,8 @@ from dispatch import receiver
 from stoppable import StoppableLoopThread
 from trie import rlp_hash, rlp_hash_hex
 import signals
-from db import DB
+from db import DB, CHECKPOINT_KEY
+from pruning import Pruner
 import utils
 import rlp
 from blocks import Block
@@ -27,6 +28,7 @@ class ChainManager(StoppableLoopThread):
         self.transactions = set()
         self.blockchain = DB(utils.get_db_path())
         self.head = None
+        self.pruner = None
         # FIXME: intialize blockchain with genesis block
 
     def _initialize_blockchain(self):
@@ -44,23 +46,71 @@ class ChainManager(StoppableLoopThread):
             except:
                 raise Exception("Parent of block not found")
             parent_score = utils.big_endian_to_int(parent[1])
-        total_score = utils.int_to_big_endian(block.difficulty + parent_score)
+        total_score = block.difficulty + parent_score
         self.blockchain.put(
-            blockhash, rlp.encode([block.serialize(), total_score]))
+            blockhash, rlp.encode([block.serialize(),
+                                   utils.int_to_big_endian(total_score)]))
+        if self.pruner:
+            # blocks of side chains too, one of them may become the head
+            self.pruner.retain(state_roots=[block.state.root],
+                               roots=[block.tx_list_root],
+                               number=block.number)
         try:
             head = self.blockchain.get('head')
             head_data = rlp.decode(self.blockchain.get(head))
             head_score = utils.big_endian_to_int(head_data[1])
         except:
             head_score = 0
-        if total_score > head_score:
+        is_head = total_score > head_score
+        if is_head:
             self.head = blockhash
             self.blockchain.put('head', blockhash)
-            return True
-        return False
+        self.blockchain.commit_block(head=blockhash if is_head else None)
+        return is_head
 
     def configure(self, config):
         self.config = config
+        self._restore_checkpoint()
+        retain = config.getint('misc', 'prune_retain_blocks')
+        if retain:
+            self.pruner = Pruner(self.blockchain, retain)
+
+    def pre_loop(self):
+        super(ChainManager, self).pre_loop()
+        if self.pruner:
+            self.pruner.start()
+
+    def post_loop(self):
+        if self.pruner:
+            self.pruner.stop()
+        # whatever the flush policy and durability leave pending, and the
+        # head as checkpoint, so the next start does not roll it back
+        try:
+            head = self.blockchain.get('head')
+        except KeyError:
+            head = None
+        self.blockchain.flush(head=head)
+        super(ChainManager, self).post_loop()
+
+    def _restore_checkpoint(self):
+        '''roll the head back to the last one known to be synced to disk
+
+        Writes after it may have been lost in a crash, depending on the
+        configured durability.
+        '''
+        try:
+            checkpoint = self.blockchain.get(CHECKPOINT_KEY)
+        except KeyError:
+            return
+        try:
+            head = self.blockchain.get('head')
+        except KeyError:
+            head = None
+        if head != checkpoint:
+            logger.info('rolling back head to checkpoint {0}'.format(
+                checkpoint.encode('hex')))
+            self.blockchain.put('head', checkpoint)
+            self.blockchain.flush()
 
     def synchronize_blockchain(self):
         # FIXME: execute once, when connected to required num peers
@@ -80,7 +130,8 @@ class ChainManager(StoppableLoopThread):
 
     def recv_blocks(self, block_lst):
         """
-        block_lst is rlp decoded data
+        block_lst is rlp decoded data, each block a `rlp.LazyList` which
+        is deserialized and hashed without decoding it again
         """
 
         block_lst.reverse()  # oldest block is sent first in list
@@ -88,7 +139,7 @@ class ChainManager(StoppableLoopThread):
         # FIXME validate received chain, compare with local chain
         for data in block_lst:
             logger.debug("processing block: %r" % rlp_hash_hex(data))
-            block = Block.deserialize(rlp.encode(data))
+            block = Block.deserialize(data)
             h = rlp_hash(data)
             try:
                 self.blockchain.get(h)
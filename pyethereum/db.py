@@ -1,29 +1,471 @@
+import os
+import time
+import itertools
 import leveldb
+from collections import OrderedDict
+import dispatch
+import signals
 
 databases = {}
+node_caches = {}
+journals = {}
+pruners = {}
+
+# decoded trie nodes cached per database
+NODE_CACHE_SIZE = 4096
+
+(
+    FLUSH_ON_COMMIT,
+    FLUSH_PER_BLOCK,
+    FLUSH_PER_BYTES,
+    FLUSH_ON_TIMER
+) = ('commit', 'block', 'bytes', 'timer')
+
+(
+    SYNC_EVERY_COMMIT,
+    SYNC_PER_BLOCK,
+    SYNC_INTERVAL
+) = ('sync_every_commit', 'sync_per_block', 'sync_interval')
+
+(
+    BACKEND_MEMORY,
+    BACKEND_LEVELDB,
+    BACKEND_LMDB
+) = ('memory', 'leveldb', 'lmdb')
+
+# key of the last block head known to be synced to disk
+CHECKPOINT_KEY = 'checkpoint'
+
+# defaults for new journals
+FLUSH_POLICY = FLUSH_ON_COMMIT
+MAX_PENDING_BYTES = 16 * 1024 * 1024
+FLUSH_INTERVAL_MS = 5000
+DURABILITY = SYNC_EVERY_COMMIT
+SYNC_INTERVAL_MS = 1000
+# backend of new databases
+DB_BACKEND = BACKEND_LEVELDB
+# address space reserved for an LMDB environment, not allocated
+LMDB_MAP_SIZE = 1 << 40
+
+
+class MemoryBackend(object):
+
+    '''a dict, for tests and throwaway state which is never read back from
+    disk; every `DB` on the same name shares it until the process exits
+    '''
+
+    name = BACKEND_MEMORY
+
+    def __init__(self, path):
+        self.data = {}
+
+    def get(self, key):
+        return self.data[key]
+
+    def write(self, items, sync):
+        self.data.update(items)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class LevelDBBackend(object):
+
+    name = BACKEND_LEVELDB
+
+    def __init__(self, path):
+        self.db = leveldb.LevelDB(path)
+
+    def get(self, key):
+        return self.db.Get(key)
+
+    def write(self, items, sync):
+        batch = leveldb.WriteBatch()
+        for k, v in items:
+            batch.Put(k, v)
+        self.db.Write(batch, sync=sync)
+
+    def delete(self, key):
+        self.db.Delete(key)
+
+
+class LMDBBackend(object):
+
+    '''an LMDB environment, read through a memory map of the file
+
+    Reads copy the value straight out of the page cache, without the block
+    decompression and caching layers of LevelDB, at the cost of slower
+    writes. Needs the lmdb package.
+    '''
+
+    name = BACKEND_LMDB
+
+    def __init__(self, path):
+        import lmdb
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # synced explicitly, as the durability mode says
+        self.env = lmdb.open(path, map_size=LMDB_MAP_SIZE, sync=False,
+                             metasync=False)
+
+    def get(self, key):
+        with self.env.begin() as txn:
+            value = txn.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def write(self, items, sync):
+        with self.env.begin(write=True) as txn:
+            for k, v in items:
+                txn.put(k, v)
+        if sync:
+            self.env.sync(True)
+
+    def delete(self, key):
+        with self.env.begin(write=True) as txn:
+            txn.delete(key)
+
+
+backends = dict((backend.name, backend) for backend in
+                (MemoryBackend, LevelDBBackend, LMDBBackend))
+
+
+class LRUCache(object):
+
+    '''bounded mapping which evicts the least recently used entry
+
+    `hits` and `misses` count the lookups done through `get`.
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.items[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        self._evict()
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        self._evict()
+
+    def _evict(self):
+        while len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+
+    def peek(self, key):
+        '''like `get`, without counting or refreshing the entry'''
+        return self.items.get(key)
+
+    def pop(self, key):
+        return self.items.pop(key, None)
+
+    def clear(self):
+        self.items.clear()
+
+    def reset_stats(self):
+        self.hits = self.misses = 0
+
+
+class Journal(object):
+
+    '''write-back buffer of one database, shared by all its `DB` instances
+
+    Writes are kept in `dirty` until they are flushed to the backend in one
+    batch and dropped from memory. When that happens is decided by the
+    flush policy at every commit point:
+
+    * ``FLUSH_ON_COMMIT``: on every `DB.commit`
+    * ``FLUSH_PER_BLOCK``: on `DB.commit_block`, i.e. once per block
+    * ``FLUSH_PER_BYTES``: once `max_pending_bytes` are pending
+    * ``FLUSH_ON_TIMER``: once `flush_interval_ms` passed since the last
+      flush
+
+    Whatever the policy, the journal is flushed as soon as more than
+    `max_pending_bytes` are pending, which bounds its size.
+
+    The durability mode decides which flushes wait for the data to be
+    synced to disk:
+
+    * ``SYNC_EVERY_COMMIT``: every flush
+    * ``SYNC_PER_BLOCK``: the flush at the end of each block, which then
+      happens whatever the flush policy
+    * ``SYNC_INTERVAL``: the first flush `sync_interval_ms` after the last
+      synced one
+
+    Every synced flush also stores the block head last passed to `commit`
+    under `CHECKPOINT_KEY`, in the same batch. As everything written before
+    is synced along with it, that head is always complete on disk.
+
+    Overlays stack on top of `dirty`, e.g. one per call frame of a
+    transaction: while there is one, writes go to the topmost overlay,
+    which is either merged into the one below or dropped with all its
+    writes. Overlays left at the end of a block are merged.
+    '''
+
+    def __init__(self, db):
+        self.db = db
+        self.dirty = {}
+        self.flush_policy = FLUSH_POLICY
+        self.max_pending_bytes = MAX_PENDING_BYTES
+        self.flush_interval_ms = FLUSH_INTERVAL_MS
+        self.durability = DURABILITY
+        self.sync_interval_ms = SYNC_INTERVAL_MS
+        self.head = None
+        self.overlays = []
+        self.pending_bytes = 0
+        self.flushed_bytes = 0
+        self.flushes = 0
+        self.syncs = 0
+        self.last_flush = self.last_sync = time.time()
+
+    def put(self, key, value):
+        if self.overlays:
+            self.overlays[-1][key] = value
+            return
+        old = self.dirty.get(key)
+        if old is not None:
+            self.pending_bytes -= len(key) + len(old)
+        self.dirty[key] = value
+        self.pending_bytes += len(key) + len(value)
+        if self.pending_bytes > self.max_pending_bytes:
+            self.flush()
+
+    def discard(self, key):
+        for overlay in self.overlays:
+            overlay.pop(key, None)
+        old = self.dirty.pop(key, None)
+        if old is not None:
+            self.pending_bytes -= len(key) + len(old)
+
+    def push_overlay(self):
+        ''':return: the depth of the new overlay'''
+        self.overlays.append({})
+        return len(self.overlays)
+
+    def merge_overlay(self, depth):
+        '''merge the overlay at depth, and any above, into the one below'''
+        while len(self.overlays) >= depth:
+            overlay = self.overlays.pop()
+            if self.overlays:
+                self.overlays[-1].update(overlay)
+            else:
+                for k, v in overlay.iteritems():
+                    self.put(k, v)
+
+    def drop_overlay(self, depth):
+        '''drop the overlay at depth, and any above, with their writes'''
+        del self.overlays[depth - 1:]
+
+    def commit(self, block=False, head=None):
+        '''a commit point, flushes if the flush policy says so
+
+        :param block: whether this is the end of a block
+        :param head: the new block head, if any
+        '''
+        if block and self.overlays:
+            self.merge_overlay(1)
+        if head is not None:
+            self.head = head
+        policy = self.flush_policy
+        if policy == FLUSH_ON_COMMIT \
+                or (block and (policy == FLUSH_PER_BLOCK or
+                               self.durability == SYNC_PER_BLOCK)) \
+                or (policy == FLUSH_PER_BYTES
+                    and self.pending_bytes >= self.max_pending_bytes) \
+                or (policy == FLUSH_ON_TIMER and
+                    (time.time() - self.last_flush) * 1000
+                    >= self.flush_interval_ms):
+            self.flush(block)
+
+    def _needs_sync(self, block):
+        if self.durability == SYNC_PER_BLOCK:
+            return block
+        if self.durability == SYNC_INTERVAL:
+            return (time.time() - self.last_sync) * 1000 \
+                >= self.sync_interval_ms
+        return True
+
+    def flush(self, block=False, sync=None):
+        if sync is None:
+            sync = self._needs_sync(block)
+        if self.dirty or sync:
+            items = self.dirty.iteritems()
+            if sync and self.head is not None:
+                items = itertools.chain(items, [(CHECKPOINT_KEY, self.head)])
+            self.db.write(items, sync)
+            self.flushed_bytes += self.pending_bytes
+            self.flushes += 1
+            self.dirty = {}
+            self.pending_bytes = 0
+        if sync:
+            self.syncs += 1
+            self.last_sync = time.time()
+        self.last_flush = time.time()
+
+    def metrics(self):
+        return dict(pending_keys=len(self.dirty),
+                    pending_bytes=self.pending_bytes,
+                    flushed_bytes=self.flushed_bytes,
+                    flushes=self.flushes,
+                    syncs=self.syncs)
 
 
 class DB(object):
 
-    def __init__(self, dbfile):
+    def __init__(self, dbfile, backend=None):
+        '''
+        :param dbfile: path of the database, or name of a memory one
+        :param backend: one of `backends` to open dbfile with, by default
+        `DB_BACKEND`; a database already open keeps its backend
+        '''
         if dbfile not in databases:
-            databases[dbfile] = leveldb.LevelDB(dbfile)
+            databases[dbfile] = backends[backend or DB_BACKEND](dbfile)
+            node_caches[dbfile] = LRUCache(NODE_CACHE_SIZE)
+            journals[dbfile] = Journal(databases[dbfile])
+        elif backend is not None and databases[dbfile].name != backend:
+            raise Exception("%s is open with the %s backend" %
+                            (dbfile, databases[dbfile].name))
+        self.dbfile = dbfile
         self.db = databases[dbfile]
-        self.uncommitted = {}
+        # decoded trie nodes by hash, shared by all users of the dbfile
+        self.node_cache = node_caches[dbfile]
+        self.journal = journals[dbfile]
 
     def get(self, key):
-        if key in self.uncommitted:
-            return self.uncommitted[key]
-        return self.db.Get(key)
+        for overlay in reversed(self.journal.overlays):
+            if key in overlay:
+                return overlay[key]
+        dirty = self.journal.dirty
+        if key in dirty:
+            return dirty[key]
+        return self.db.get(key)
 
     def put(self, key, value):
-        self.uncommitted[key] = value
+        self.journal.put(key, value)
+
+    def put_node(self, key, value):
+        '''put a trie node, which the pruner of the database may delete
+        once no retained state refers to it any more
+        '''
+        pruner = pruners.get(self.dbfile)
+        if pruner is not None:
+            # recorded first, a sweep running meanwhile must not drop it
+            pruner.record(key)
+        self.journal.put(key, value)
 
     def commit(self):
-        batch = leveldb.WriteBatch()
-        for k in self.uncommitted:
-            batch.Put(k, self.uncommitted[k])
-        self.db.Write(batch, sync=True)
+        self.journal.commit()
+
+    def commit_block(self, head=None):
+        '''commit point at the end of a block
+
+        :param head: hash of the new block head, to be checkpointed
+        '''
+        pruner = pruners.get(self.dbfile)
+        if pruner is not None:
+            pruner.delete_garbage()
+        self.journal.commit(block=True, head=head)
+
+    def push_overlay(self):
+        '''start keeping the writes to the database apart, until they are
+        committed or reverted
+
+        :return: the depth of the overlay, to commit or revert it
+        '''
+        return self.journal.push_overlay()
+
+    def commit_overlay(self, depth):
+        '''keep the writes of an overlay, in the one below it'''
+        self.journal.merge_overlay(depth)
+
+    def revert_overlay(self, depth):
+        '''forget the writes of an overlay, which never reach the disk'''
+        self.journal.drop_overlay(depth)
+
+    def flush(self, head=None):
+        '''write and sync all pending data, regardless of the settings
+
+        :param head: hash of the block head to checkpoint, by default the
+        last one committed
+        '''
+        if head is not None:
+            self.journal.head = head
+        self.journal.flush(sync=True)
 
     def delete(self, key):
-        return self.db.Delete(key)
+        self.node_cache.pop(key)
+        self.journal.discard(key)
+        return self.db.delete(key)
+
+
+def configure(flush_policy=None, durability=None, sync_interval_ms=None,
+              backend=None, node_cache_size=None, max_pending_bytes=None,
+              flush_interval_ms=None):
+    '''set the write-back settings and node cache size of new and open
+    databases, and the backend of new ones
+    '''
+    global FLUSH_POLICY, DURABILITY, SYNC_INTERVAL_MS, DB_BACKEND, \
+        NODE_CACHE_SIZE, MAX_PENDING_BYTES, FLUSH_INTERVAL_MS
+    if backend is not None:
+        if backend not in backends:
+            raise Exception("unknown database backend %r" % backend)
+        DB_BACKEND = backend
+    if flush_policy is not None:
+        if flush_policy not in (FLUSH_ON_COMMIT, FLUSH_PER_BLOCK,
+                                FLUSH_PER_BYTES, FLUSH_ON_TIMER):
+            raise Exception("unknown flush policy %r" % flush_policy)
+        FLUSH_POLICY = flush_policy
+    if max_pending_bytes is not None:
+        MAX_PENDING_BYTES = max_pending_bytes
+    if flush_interval_ms is not None:
+        FLUSH_INTERVAL_MS = flush_interval_ms
+    if durability is not None:
+        if durability not in (SYNC_EVERY_COMMIT, SYNC_PER_BLOCK,
+                              SYNC_INTERVAL):
+            raise Exception("unknown durability mode %r" % durability)
+        DURABILITY = durability
+    if sync_interval_ms is not None:
+        SYNC_INTERVAL_MS = sync_interval_ms
+    if node_cache_size is not None:
+        NODE_CACHE_SIZE = node_cache_size
+        for cache in node_caches.values():
+            cache.resize(NODE_CACHE_SIZE)
+    for journal in journals.values():
+        journal.flush_policy = FLUSH_POLICY
+        journal.max_pending_bytes = MAX_PENDING_BYTES
+        journal.flush_interval_ms = FLUSH_INTERVAL_MS
+        journal.durability = DURABILITY
+        journal.sync_interval_ms = SYNC_INTERVAL_MS
+
+
+@dispatch.receiver(signals.config_ready)
+def config_db(sender, **kwargs):
+    config = sender
+    configure(flush_policy=config.get('misc', 'flush_policy'),
+              max_pending_bytes=config.getint('misc', 'max_pending_bytes'),
+              flush_interval_ms=config.getint('misc', 'flush_interval_ms'),
+              durability=config.get('misc', 'durability'),
+              sync_interval_ms=config.getint('misc', 'sync_interval_ms'),
+              backend=config.get('misc', 'db_backend'),
+              node_cache_size=config.getint('misc', 'node_cache_size'))
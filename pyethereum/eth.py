@@ -39,6 +39,26 @@ def create_config():
     config.set('misc', 'verbosity', '1')
     config.set('misc', 'config_file', None)
     config.set('misc', 'logging', None)
+    # storage of the state database: leveldb, lmdb (memory mapped, needs
+    # the lmdb package) or memory (lost on exit)
+    config.set('misc', 'db_backend', 'leveldb')
+    # when to write the state database: commit, block, bytes or timer
+    config.set('misc', 'flush_policy', 'commit')
+    # pending bytes which trigger a flush, whatever the policy, and the
+    # interval of the timer policy
+    config.set('misc', 'max_pending_bytes', str(16 * 1024 * 1024))
+    config.set('misc', 'flush_interval_ms', '5000')
+    # when to wait for writes to reach the disk: sync_every_commit,
+    # sync_per_block or sync_interval (every sync_interval_ms)
+    config.set('misc', 'durability', 'sync_every_commit')
+    config.set('misc', 'sync_interval_ms', '1000')
+    # decoded trie nodes kept in memory per database
+    config.set('misc', 'node_cache_size', '4096')
+    # number of recent block numbers whose states, of every chain, keep
+    # their trie nodes, 0 keeps every state ever written
+    config.set('misc', 'prune_retain_blocks', '0')
+    # worker processes hashing the trie nodes of large batches, 0 for none
+    config.set('misc', 'hash_workers', '0')
 
     config.add_section('wallet')
 
@@ -12,8 +12,8 @@ logger = logging.getLogger(__name__)
 
 
 def lrlp_decode(data):
-    "always return a list"
-    d = rlp.decode(data)
+    "always return a list, decoded lazily"
+    d = rlp.decode_lazy(data)
     if isinstance(d, str):
         d = [d]
     return d
@@ -50,6 +50,10 @@ class Packeter(object):
                    (0x16, 'GetTransactions')))
     cmd_map_by_name = dict((v, k) for k, v in cmd_map.items())
 
+    # commands whose items are passed on as `rlp.LazyList`, only decoded as
+    # far as they are read; those of the others are decoded in full
+    LAZY_CMDS = ('Blocks',)
+
     disconnect_reasons_map = dict((
         ('Disconnect requested', 0x00),
         ('TCP sub-system error', 0x01),
@@ -105,17 +109,32 @@ class Packeter(object):
         if len(packet) < payload_len + 8:
             return False, 'Packet is broken'
 
+        success, res = cls.load_payload(packet[8:8 + payload_len])
+        if not success:
+            return False, res
+        cmd, data = res
+        remain = packet[8 + payload_len:]
+        return True, (header, payload_len, cmd, data, remain)
+
+    @classmethod
+    def load_payload(cls, payload):
+        '''
+        :param payload: the RLP-serialised data structure of a packet
+        :return: (success, result), where result is an error message when
+        fail, and (cmd, data) when success
+        '''
         try:
-            payload = lrlp_decode(packet[8:8 + payload_len])
+            payload = lrlp_decode(payload)
+            if (not len(payload)) or (idec(payload[0]) not in cls.cmd_map):
+                return False, 'check cmd failed'
+            cmd = Packeter.cmd_map.get(idec(payload[0]))
+            data = payload[1:]
+            if cmd not in cls.LAZY_CMDS:
+                data = [item.to_list() if isinstance(item, rlp.LazyList)
+                        else item for item in data]
         except Exception as e:
             return False, str(e)
-
-        if (not len(payload)) or (idec(payload[0]) not in cls.cmd_map):
-            return False, 'check cmd failed'
-
-        cmd = Packeter.cmd_map.get(idec(payload[0]))
-        remain = packet[8 + payload_len:]
-        return True, (header, payload_len, cmd, payload[1:], remain)
+        return True, (cmd, data)
 
     def load_cmd(self, packet):
         success, res = self.load_packet(packet)
@@ -225,6 +244,71 @@ class Packeter(object):
         return self.dump_packet(data)
 
 
+class PacketReader(object):
+
+    """
+    Incremental parser for the packets received on one connection.
+
+    Chunks are fed as they arrive from the socket. The packet header is only
+    inspected once all 8 bytes of it are buffered and the payload is only
+    joined and RLP decoded once it is complete, so every byte is looked at a
+    constant number of times, no matter how many chunks a packet spans.
+    At most one packet of up to `MAX_PAYLOAD_SIZE` bytes is buffered.
+    """
+
+    MAX_PAYLOAD_SIZE = 32 * 1024 * 1024
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''drop all buffered data, e.g. after a protocol error'''
+        self._chunks = []
+        self._buffered = 0
+        self._payload_len = None
+
+    def _take(self, size):
+        buf = ''.join(self._chunks)
+        self._chunks = [buf[size:]] if len(buf) > size else []
+        self._buffered -= size
+        return buf[:size]
+
+    def feed(self, data):
+        '''
+        :param data: the next chunk of bytes received
+        :return: a list of (cmd, data) for each packet completed by the
+        chunk, raises an Exception when a malformed packet is received
+        '''
+        if data:
+            self._chunks.append(data)
+            self._buffered += len(data)
+
+        frames = []
+        while True:
+            if self._payload_len is None:
+                if self._buffered < 8:
+                    break
+                header = self._take(8)
+                if idec(header[:4]) != Packeter.SYNCHRONIZATION_TOKEN:
+                    raise Exception(
+                        'check header failed, sync token was hex: '
+                        '{0}'.format(header[:4].encode('hex')))
+                self._payload_len = idec(header[4:8])
+                if self._payload_len > self.MAX_PAYLOAD_SIZE:
+                    raise Exception('payload size {0} exceeds limit'.format(
+                        self._payload_len))
+
+            if self._buffered < self._payload_len:
+                break
+            success, res = Packeter.load_payload(
+                self._take(self._payload_len))
+            self._payload_len = None
+            if not success:
+                raise Exception(res)
+            frames.append(res)
+        return frames
+
+
 packeter = Packeter()
 
 
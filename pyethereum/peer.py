@@ -5,7 +5,7 @@ import logging
 
 import signals
 from stoppable import StoppableLoopThread
-from packeter import packeter
+from packeter import packeter, PacketReader
 from utils import big_endian_to_int as idec, recursive_int_to_big_endian
 import rlp
 
@@ -31,7 +31,7 @@ class Peer(StoppableLoopThread):
         self.last_asked_for_peers = 0
         self.last_pinged = 0
 
-        self.recv_buffer = ''
+        self.packet_reader = PacketReader()
 
         # connect signals
 
@@ -93,24 +93,27 @@ class Peer(StoppableLoopThread):
         '''
         :return: size of processed data
         '''
+        length = 0
         while True:
             try:
-                self.recv_buffer += self.connection().recv(2048)
+                chunk = self.connection().recv(2048)
             except socket.error:
                 break
-        length = len(self.recv_buffer)
-        if length:
-            self._process_recv_buffer()
+            if not chunk:
+                break
+            length += len(chunk)
+            try:
+                frames = self.packet_reader.feed(chunk)
+            except Exception as e:
+                self.packet_reader.reset()
+                logger.warn(e)
+                self.send_Disconnect(reason='Bad protocol')
+                return length
+            for cmd, data in frames:
+                self._process_frame(cmd, data)
         return length
 
-    def _process_recv_buffer(self):
-        try:
-            cmd, data, self.recv_buffer = packeter.load_cmd(self.recv_buffer)
-        except Exception as e:
-            self.recv_buffer = ''
-            logger.warn(e)
-            return self.send_Disconnect(reason='Bad protocol')
-
+    def _process_frame(self, cmd, data):
         # good peer
         self.last_valid_packet_received = time.time()
 
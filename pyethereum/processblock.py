@@ -1,5 +1,6 @@
 import rlp
-from opcodes import opcodes
+from db import LRUCache
+from opcodes import opcodes, reverse_opcodes, GSTOP, GMEMORY
 
 from utils import big_endian_to_int as decode_int
 from utils import int_to_big_endian as encode_int
@@ -14,20 +15,14 @@ debug = 0
 
 # params
 
-GSTEP = 1
-GSTOP = 0
-GSHA3 = 20
-GSLOAD = 20
-GSSTORE = 100
-GBALANCE = 20
-GCREATE = 100
-GCALL = 20
-GMEMORY = 1
 GTXDATA = 5
 GTXCOST = 500
 
 OUT_OF_GAS = -1
 
+# number of decoded programs kept, by the hash of their code
+PROGRAM_CACHE_SIZE = 1000
+
 
 def process(block, txs):
     for tx in txs:
@@ -37,6 +32,8 @@ def process(block, txs):
 
 def finalize(block):
     block.delta_balance(block.coinbase, block.reward)
+    block.commit_state()
+    block.state.db.commit_block()
 
 
 def verify(block, parent):
@@ -78,27 +75,33 @@ def apply_tx(block, tx):
     if acctnonce != tx.nonce:
         raise Exception("Invalid nonce! Sender %s tx %s" %
                         (acctnonce, tx.nonce))
-    o = block.delta_balance(tx.sender, -tx.gasprice * tx.startgas)
-    if not o:
-        raise Exception("Insufficient balance to pay fee!")
-    block.increment_nonce(tx.sender)
-    snapshot = block.snapshot()
-    message_gas = tx.startgas - GTXDATA * len(tx.serialize()) - GTXCOST
-    message = Message(tx.sender, tx.to, tx.value, message_gas, tx.data)
-    if tx.to:
-        result, gas, data = apply_msg(block, tx, message)
-    else:
-        result, gas = create_contract(block, tx, message)
-    if not result:  # 0 = OOG failure in both cases
-        block.revert(snapshot)
-        block.gas_used += tx.startgas
-        block.delta_balance(block.coinbase, tx.gasprice * tx.startgas)
-        output = OUT_OF_GAS
-    else:
-        block.delta_balance(tx.sender, tx.gasprice * gas)
-        block.delta_balance(block.coinbase, tx.gasprice * (tx.startgas - gas))
-        block.gas_used += tx.startgas - gas
-        output = ''.join(map(chr, data)) if tx.to else result.encode('hex')
+    # state changes of the tx are hashed and written once, at its end
+    with block.state.batch():
+        o = block.delta_balance(tx.sender, -tx.gasprice * tx.startgas)
+        if not o:
+            raise Exception("Insufficient balance to pay fee!")
+        block.increment_nonce(tx.sender)
+        snapshot = block.snapshot()
+        message_gas = tx.startgas - GTXDATA * len(tx.serialize()) - GTXCOST
+        message = Message(tx.sender, tx.to, tx.value, message_gas, tx.data)
+        if tx.to:
+            result, gas, data = apply_msg(block, tx, message)
+        else:
+            result, gas = create_contract(block, tx, message)
+        if not result:  # 0 = OOG failure in both cases
+            block.revert(snapshot)
+            block.gas_used += tx.startgas
+            block.delta_balance(block.coinbase, tx.gasprice * tx.startgas)
+            output = OUT_OF_GAS
+        else:
+            block.commit_snapshot(snapshot)
+            block.delta_balance(tx.sender, tx.gasprice * gas)
+            block.delta_balance(block.coinbase,
+                                tx.gasprice * (tx.startgas - gas))
+            block.gas_used += tx.startgas - gas
+            output = str(data) if tx.to \
+                else result.encode('hex')
+        block.commit_state()
     tx_data = [tx.serialize(), block.state.root, encode_int(block.gas_used)]
     block.add_transaction_to_list(tx_data)
     success = output is not OUT_OF_GAS
@@ -108,7 +111,7 @@ def apply_tx(block, tx):
 class Compustate():
 
     def __init__(self, **kwargs):
-        self.memory = []
+        self.memory = bytearray()
         self.stack = []
         self.pc = 0
         self.gas = 0
@@ -119,6 +122,8 @@ class Compustate():
 def decode_datalist(arr):
     if isinstance(arr, list):
         arr = ''.join(map(chr, arr))
+    elif isinstance(arr, bytearray):
+        arr = str(arr)
     o = []
     for i in range(0, len(arr), 32):
         o.append(decode_int(arr[i:i + 32]))
@@ -132,27 +137,18 @@ def apply_msg(block, tx, msg):
     block.delta_balance(msg.to, msg.value)
     o = block.delta_balance(msg.sender, -msg.value)
     if not o:
-        return 0, msg.gas, []
+        block.revert(snapshot)
+        return 0, msg.gas, bytearray()
     compustate = Compustate(gas=msg.gas)
-    # Main loop
-    while 1:
-        if debug:
-            print({
-                "Stack": compustate.stack,
-                "PC": compustate.pc,
-                "Gas": compustate.gas,
-                "Memory": decode_datalist(compustate.memory),
-                "Storage": block.get_storage(msg.to).to_dict(),
-            })
-        o = apply_op(block, tx, msg, code, compustate)
-        if o is not None:
-            if debug:
-                print('done', o)
-            if o == OUT_OF_GAS:
-                block.revert(snapshot)
-                return 0, 0, []
-            else:
-                return 1, compustate.gas, o
+    o = run_program(block, tx, msg, get_program(code), compustate)
+    if debug:
+        print('done', o)
+    if o == OUT_OF_GAS:
+        block.revert(snapshot)
+        return 0, 0, bytearray()
+    else:
+        block.commit_snapshot(snapshot)
+        return 1, compustate.gas, o
 
 
 def create_contract(block, tx, msg):
@@ -164,290 +160,466 @@ def create_contract(block, tx, msg):
     block.delta_balance(recvaddr, msg.value)
     o = block.delta_balance(msg.sender, msg.value)
     if not o:
+        block.revert(snapshot)
         return 0, msg.gas
     block.set_code(recvaddr, msg.data)
     compustate = Compustate(gas=msg.gas)
-    # Main loop
-    while 1:
-        o = apply_op(block, tx, msg, msg.data, compustate)
-        if o is not None:
-            if o == OUT_OF_GAS:
-                block.revert(snapshot)
-                return 0, 0
+    o = run_program(block, tx, msg, get_program(msg.data), compustate)
+    if o == OUT_OF_GAS:
+        block.revert(snapshot)
+        return 0, 0
+    else:
+        block.set_code(recvaddr, str(o))
+        block.commit_snapshot(snapshot)
+        return recvaddr, compustate.gas
+
+
+class Program(object):
+    '''code decoded once for execution
+
+    Jumps may land on any byte, PUSH data included, so everything is known
+    for each byte of the code: `ops` holds the opcode, `pushes` the value
+    and the next pc of every PUSH, `block_ends` the pc of the last operation
+    run straight from there, the one leaving the basic block, and
+    `block_fees` the static fees of the operations up to it.
+    '''
+    __slots__ = ['code', 'ops', 'pushes', 'block_ends', 'block_fees']
+
+    def __init__(self, code):
+        self.code = code
+        self.ops = map(ord, code)
+        self.pushes = {}
+        for pc, op in enumerate(self.ops):
+            if PUSH1 <= op <= PUSH32:
+                n = op - PUSH1 + 1
+                self.pushes[pc] = (decode_int(code[pc + 1:pc + 1 + n]),
+                                   pc + 1 + n)
+        size = len(self.ops)
+        self.block_ends = [0] * size
+        self.block_fees = [0] * size
+        for pc in range(size - 1, -1, -1):
+            op = self.ops[pc]
+            following = self.pushes[pc][1] if pc in self.pushes else pc + 1
+            if op_ends_block[op] or following >= size:
+                self.block_ends[pc] = pc
+                self.block_fees[pc] = op_fees[op]
             else:
-                block.set_code(recvaddr, ''.join(map(chr, o)))
-                return recvaddr, compustate.gas
+                self.block_ends[pc] = self.block_ends[following]
+                self.block_fees[pc] = op_fees[op] + self.block_fees[following]
+
+
+def get_program(code):
+    '''the decoded `code`, shared by all calls running it'''
+    key = sha3(code)
+    program = program_cache.get(key)
+    if program is None:
+        program = Program(code)
+        program_cache.put(key, program)
+    return program
+
+program_cache = LRUCache(PROGRAM_CACHE_SIZE)
+
 
+def run_program(block, tx, msg, program, compustate):
+    '''execute until the code stops, returns or runs out of gas
 
-def get_op_data(code, index):
-    opcode = ord(code[index]) if index < len(code) else 0
-    if opcode < 96 or (opcode > 240 and opcode <= 255):
-        if opcode in opcodes:
-            return opcodes[opcode]
+    :return: the output as a bytearray, or OUT_OF_GAS
+    '''
+    ops, pushes, size = program.ops, program.pushes, len(program.ops)
+    block_fees = program.block_fees
+    stk, mem = compustate.stack, compustate.memory
+    # paid for the operations ahead in the basic block being run
+    ahead = 0
+    while 1:
+        if debug:
+            print({
+                "Stack": stk,
+                "PC": compustate.pc,
+                "Gas": compustate.gas + ahead,
+                "Memory": decode_datalist(mem),
+                "Storage": block.get_storage(msg.to).to_dict(),
+            })
+        pc = compustate.pc
+        op = ops[pc] if pc < size else 0
+        # empty stack error
+        if op_in_args[op] > len(stk):
+            compustate.gas += ahead
+            return bytearray()
+        if not ahead and pc < size and block_fees[pc] <= compustate.gas:
+            # the static fees of the whole basic block at once
+            compustate.gas -= block_fees[pc]
+            ahead = block_fees[pc]
+        if ahead:
+            # paid already, up to what depends on the stack
+            ahead -= op_fees[op]
+            fee = op_memory_fees[op](stk, mem) if op_memory_fees[op] else 0
+            if fee > compustate.gas:
+                # not enough for the rest of the block, pay per operation
+                compustate.gas += ahead
+                ahead = 0
         else:
-            return 'INVALID', 0, 0
-    elif opcode < 128:
-        return 'PUSH' + str(opcode - 95), 0, 1
+            fee = op_fees[op]
+            if op_memory_fees[op]:
+                fee += op_memory_fees[op](stk, mem)
+        # out of gas error
+        if fee > compustate.gas:
+            if debug:
+                print("Out of gas", compustate.gas, "need", fee)
+                print(op_names[op], list(reversed(stk)))
+            return OUT_OF_GAS
+        stackargs = [stk.pop() for i in op_pops[op]]
+        if debug:
+            print(op_names[op], ' '.join(map(str, stackargs)),
+                  decode_datalist(mem))
+        if fee:
+            compustate.gas -= fee
+        if PUSH1 <= op <= PUSH32:
+            value, compustate.pc = pushes[pc]
+            stk.append(value)
+            continue
+        compustate.pc = pc + 1
+        o = op_handlers[op](block, tx, msg, compustate, stackargs)
+        if o is not None:
+            # the rest of the block is not run
+            compustate.gas += ahead
+            return o
+
+
+def memory_extension(mem, start, size):
+    if len(mem) < start + size:
+        mem.extend(bytearray(start + size - len(mem)))
+
+
+def op_stop(block, tx, msg, compustate, args):
+    return bytearray()
+
+
+def op_invalid(block, tx, msg, compustate, args):
+    pass
+
+
+def op_add(block, tx, msg, compustate, args):
+    compustate.stack.append((args[0] + args[1]) % 2 ** 256)
+
+
+def op_sub(block, tx, msg, compustate, args):
+    compustate.stack.append((args[0] - args[1]) % 2 ** 256)
+
+
+def op_mul(block, tx, msg, compustate, args):
+    compustate.stack.append((args[0] * args[1]) % 2 ** 256)
+
+
+def op_div(block, tx, msg, compustate, args):
+    if args[1] == 0:
+        return bytearray()
+    compustate.stack.append(args[0] / args[1])
+
+
+def op_mod(block, tx, msg, compustate, args):
+    if args[1] == 0:
+        return bytearray()
+    compustate.stack.append(args[0] % args[1])
+
+
+def op_sdiv(block, tx, msg, compustate, args):
+    if args[1] == 0:
+        return bytearray()
+    if args[0] >= 2 ** 255:
+        args[0] -= 2 ** 256
+    if args[1] >= 2 ** 255:
+        args[1] -= 2 ** 256
+    compustate.stack.append((args[0] / args[1]) % 2 ** 256)
+
+
+def op_smod(block, tx, msg, compustate, args):
+    if args[1] == 0:
+        return bytearray()
+    if args[0] >= 2 ** 255:
+        args[0] -= 2 ** 256
+    if args[1] >= 2 ** 255:
+        args[1] -= 2 ** 256
+    compustate.stack.append((args[0] % args[1]) % 2 ** 256)
+
+
+def op_exp(block, tx, msg, compustate, args):
+    compustate.stack.append(pow(args[0], args[1], 2 ** 256))
+
+
+def op_neg(block, tx, msg, compustate, args):
+    compustate.stack.append(2 ** 256 - args[0])
+
+
+def op_lt(block, tx, msg, compustate, args):
+    compustate.stack.append(1 if args[0] < args[1] else 0)
+
+
+def op_gt(block, tx, msg, compustate, args):
+    compustate.stack.append(1 if args[0] > args[1] else 0)
+
+
+def op_eq(block, tx, msg, compustate, args):
+    compustate.stack.append(1 if args[0] == args[1] else 0)
+
+
+def op_not(block, tx, msg, compustate, args):
+    compustate.stack.append(0 if args[0] else 1)
+
+
+def op_and(block, tx, msg, compustate, args):
+    compustate.stack.append(args[0] & args[1])
+
+
+def op_or(block, tx, msg, compustate, args):
+    compustate.stack.append(args[0] | args[1])
+
+
+def op_xor(block, tx, msg, compustate, args):
+    compustate.stack.append(args[0] ^ args[1])
+
+
+def op_byte(block, tx, msg, compustate, args):
+    if args[0] >= 32:
+        compustate.stack.append(0)
     else:
-        return 'INVALID', 0, 0
+        compustate.stack.append((args[1] / 256 ** args[0]) % 256)
 
 
-def calcfee(block, tx, msg, compustate, op):
-    stk, mem = compustate.stack, compustate.memory
-    if op == 'SHA3':
-        m_extend = max(0, stk[-1] + stk[-2] - len(mem))
-        return GSHA3 + m_extend * GMEMORY
-    elif op == 'SLOAD':
-        return GSLOAD
-    elif op == 'SSTORE':
-        return GSSTORE
-    elif op == 'MLOAD':
-        m_extend = max(0, stk[-1] + 32 - len(mem))
-        return GSTEP + m_extend * GMEMORY
-    elif op == 'MSTORE':
-        m_extend = max(0, stk[-1] + 32 - len(mem))
-        return GSTEP + m_extend * GMEMORY
-    elif op == 'MSTORE8':
-        m_extend = max(0, stk[-1] + 1 - len(mem))
-        return GSTEP + m_extend * GMEMORY
-    elif op == 'CALL':
-        m_extend = max(
-            0, stk[-4] + stk[-5] - len(mem), stk[-6] + stk[-7] - len(mem))
-        return GCALL + stk[-1] + m_extend * GMEMORY
-    elif op == 'CREATE':
-        m_extend = max(0, stk[-3] + stk[-4] - len(mem))
-        return GCREATE + stk[-2] + m_extend * GMEMORY
-    elif op == 'RETURN':
-        m_extend = max(0, stk[-1] + stk[-2] - len(mem))
-        return GSTEP + m_extend * GMEMORY
-    elif op == 'CALLDATACOPY':
-        m_extend = max(0, stk[-1] + stk[-3] - len(mem))
-        return GSTEP + m_extend * GMEMORY
-    elif op == 'STOP' or op == 'INVALID':
-        return GSTOP
+def op_sha3(block, tx, msg, compustate, args):
+    mem = compustate.memory
+    memory_extension(mem, args[0], args[1])
+    data = memoryview(mem)[args[0]:args[0] + args[1]]
+    compustate.stack.append(decode_int(sha3(data.tobytes())))
+
+
+def op_address(block, tx, msg, compustate, args):
+    compustate.stack.append(msg.to)
+
+
+def op_balance(block, tx, msg, compustate, args):
+    compustate.stack.append(block.get_balance(msg.to))
+
+
+def op_origin(block, tx, msg, compustate, args):
+    compustate.stack.append(tx.sender)
+
+
+def op_caller(block, tx, msg, compustate, args):
+    compustate.stack.append(utils.coerce_to_int(msg.sender))
+
+
+def op_callvalue(block, tx, msg, compustate, args):
+    compustate.stack.append(msg.value)
+
+
+def op_calldataload(block, tx, msg, compustate, args):
+    if args[0] >= len(msg.data):
+        compustate.stack.append(0)
     else:
-        return GSTEP
+        dat = msg.data[args[0]:args[0] + 32]
+        compustate.stack.append(decode_int(dat + '\x00' * (32 - len(dat))))
 
-# Does not include paying opfee
 
+def op_calldatasize(block, tx, msg, compustate, args):
+    compustate.stack.append(len(msg.data))
 
-def apply_op(block, tx, msg, code, compustate):
-    op, in_args, out_args = get_op_data(code, compustate.pc)
-    # empty stack error
-    if in_args > len(compustate.stack):
-        return []
-    # out of gas error
-    fee = calcfee(block, tx, msg, compustate, op)
-    if fee > compustate.gas:
-        if debug:
-            print("Out of gas", compustate.gas, "need", fee)
-            print(op, list(reversed(compustate.stack)))
-        return OUT_OF_GAS
-    stackargs = []
-    for i in range(in_args):
-        stackargs.append(compustate.stack.pop())
+
+def op_calldatacopy(block, tx, msg, compustate, args):
+    mem = compustate.memory
+    # memory is extended for the offset in the call data, as it always was
+    memory_extension(mem, args[0], args[2])
+    if not args[2]:
+        return
+    if args[1] + args[2] > len(mem):
+        raise IndexError('bytearray index out of range')
+    dat = msg.data[args[0]:args[0] + args[2]]
+    mem[args[1]:args[1] + args[2]] = dat + '\x00' * (args[2] - len(dat))
+
+
+def op_gasprice(block, tx, msg, compustate, args):
+    compustate.stack.append(tx.gasprice)
+
+
+def op_prevhash(block, tx, msg, compustate, args):
+    compustate.stack.append(decode_int(block.prevhash))
+
+
+def op_coinbase(block, tx, msg, compustate, args):
+    compustate.stack.append(decode_int(block.coinbase.decode('hex')))
+
+
+def op_timestamp(block, tx, msg, compustate, args):
+    compustate.stack.append(block.timestamp)
+
+
+def op_number(block, tx, msg, compustate, args):
+    compustate.stack.append(block.number)
+
+
+def op_difficulty(block, tx, msg, compustate, args):
+    compustate.stack.append(block.difficulty)
+
+
+def op_gaslimit(block, tx, msg, compustate, args):
+    compustate.stack.append(block.gaslimit)
+
+
+def op_pop(block, tx, msg, compustate, args):
+    pass
+
+
+def op_dup(block, tx, msg, compustate, args):
+    compustate.stack.append(args[0])
+    compustate.stack.append(args[0])
+
+
+def op_swap(block, tx, msg, compustate, args):
+    compustate.stack.append(args[0])
+    compustate.stack.append(args[1])
+
+
+def op_mload(block, tx, msg, compustate, args):
+    mem = compustate.memory
+    memory_extension(mem, args[0], 32)
+    compustate.stack.append(decode_int(str(mem[args[0]:args[0] + 32])))
+
+
+def op_mstore(block, tx, msg, compustate, args):
+    mem = compustate.memory
+    memory_extension(mem, args[0], 32)
+    mem[args[0]:args[0] + 32] = utils.zpad(encode_int(args[1] % 2 ** 256), 32)
+
+
+def op_mstore8(block, tx, msg, compustate, args):
+    mem = compustate.memory
+    memory_extension(mem, args[0], 1)
+    mem[args[0]] = args[1] % 256
+
+
+def op_sload(block, tx, msg, compustate, args):
+    compustate.stack.append(block.get_storage_data(msg.to, args[0]))
+
+
+def op_sstore(block, tx, msg, compustate, args):
+    block.set_storage_data(msg.to, args[0], args[1])
+
+
+def op_jump(block, tx, msg, compustate, args):
+    compustate.pc = args[0]
+
+
+def op_jumpi(block, tx, msg, compustate, args):
+    if args[1]:
+        compustate.pc = args[0]
+
+
+def op_pc(block, tx, msg, compustate, args):
+    compustate.stack.append(compustate.pc)
+
+
+def op_msize(block, tx, msg, compustate, args):
+    compustate.stack.append(len(compustate.memory))
+
+
+def op_gas(block, tx, msg, compustate, args):
+    # the gas before paying for GAS itself
+    compustate.stack.append(compustate.gas + op_fees[reverse_opcodes['GAS']])
+
+
+def op_create(block, tx, msg, compustate, args):
+    mem = compustate.memory
+    memory_extension(mem, args[2], args[3])
+    gas = args[0]
+    value = args[1]
+    data = str(mem[args[2]:args[2] + args[3]])
     if debug:
-        import serpent
-        if op[:4] == 'PUSH':
-            start, n = compustate.pc + 1, int(op[4:])
-            print(op, decode_int(code[start:start + n]))
-        else:
-            print(op, ' '.join(map(str, stackargs)),
-                  serpent.decode_datalist(compustate.memory))
-    # Apply operation
-    oldgas = compustate.gas
-    oldpc = compustate.pc
-    compustate.gas -= fee
-    compustate.pc += 1
-    stk = compustate.stack
+        print("Sub-contract:", msg.to, value, gas, data)
+    create_contract(block, tx, Message(msg.to, '', value, gas, data))
+
+
+def op_call(block, tx, msg, compustate, args):
     mem = compustate.memory
-    if op == 'STOP':
-        return []
-    elif op == 'ADD':
-        stk.append((stackargs[0] + stackargs[1]) % 2 ** 256)
-    elif op == 'SUB':
-        stk.append((stackargs[0] - stackargs[1]) % 2 ** 256)
-    elif op == 'MUL':
-        stk.append((stackargs[0] * stackargs[1]) % 2 ** 256)
-    elif op == 'DIV':
-        if stackargs[1] == 0:
-            return []
-        stk.append(stackargs[0] / stackargs[1])
-    elif op == 'MOD':
-        if stackargs[1] == 0:
-            return []
-        stk.append(stackargs[0] % stackargs[1])
-    elif op == 'SDIV':
-        if stackargs[1] == 0:
-            return []
-        if stackargs[0] >= 2 ** 255:
-            stackargs[0] -= 2 ** 256
-        if stackargs[1] >= 2 ** 255:
-            stackargs[1] -= 2 ** 256
-        stk.append((stackargs[0] / stackargs[1]) % 2 ** 256)
-    elif op == 'SMOD':
-        if stackargs[1] == 0:
-            return []
-        if stackargs[0] >= 2 ** 255:
-            stackargs[0] -= 2 ** 256
-        if stackargs[1] >= 2 ** 255:
-            stackargs[1] -= 2 ** 256
-        stk.append((stackargs[0] % stackargs[1]) % 2 ** 256)
-    elif op == 'EXP':
-        stk.append(pow(stackargs[0], stackargs[1], 2 ** 256))
-    elif op == 'NEG':
-        stk.append(2 ** 256 - stackargs[0])
-    elif op == 'LT':
-        stk.append(1 if stackargs[0] < stackargs[1] else 0)
-    elif op == 'GT':
-        stk.append(1 if stackargs[0] > stackargs[1] else 0)
-    elif op == 'EQ':
-        stk.append(1 if stackargs[0] == stackargs[1] else 0)
-    elif op == 'NOT':
-        stk.append(0 if stackargs[0] else 1)
-    elif op == 'AND':
-        stk.append(stackargs[0] & stackargs[1])
-    elif op == 'OR':
-        stk.append(stackargs[0] | stackargs[1])
-    elif op == 'XOR':
-        stk.append(stackargs[0] ^ stackargs[1])
-    elif op == 'BYTE':
-        if stackargs[0] >= 32:
-            stk.append(0)
-        else:
-            stk.append((stackargs[1] / 256 ** stackargs[0]) % 256)
-    elif op == 'SHA3':
-        if len(mem) < stackargs[0] + stackargs[1]:
-            mem.extend([0] * (stackargs[0] + stackargs[1] - len(mem)))
-        data = ''.join(map(chr, mem[stackargs[0]:stackargs[0] + stackargs[1]]))
-        stk.append(rlp.decode(sha3(data), 256))
-    elif op == 'ADDRESS':
-        stk.append(msg.to)
-    elif op == 'BALANCE':
-        stk.append(block.get_balance(msg.to))
-    elif op == 'ORIGIN':
-        stk.append(tx.sender)
-    elif op == 'CALLER':
-        stk.append(utils.coerce_to_int(msg.sender))
-    elif op == 'CALLVALUE':
-        stk.append(msg.value)
-    elif op == 'CALLDATALOAD':
-        if stackargs[0] >= len(msg.data):
-            stk.append(0)
-        else:
-            dat = msg.data[stackargs[0]:stackargs[0] + 32]
-            stk.append(decode_int(dat + '\x00' * (32 - len(dat))))
-    elif op == 'CALLDATASIZE':
-        stk.append(len(msg.data))
-    elif op == 'CALLDATACOPY':
-        if len(mem) < stackargs[0] + stackargs[2]:
-            mem.extend([0] * (stackargs[0] + stackargs[2] - len(mem)))
-        for i in range(stackargs[2]):
-            if stackargs[0] + i < len(msg.data):
-                mem[stackargs[1] + i] = ord(msg.data[stackargs[0] + i])
-            else:
-                mem[stackargs[1] + i] = 0
-    elif op == 'GASPRICE':
-        stk.append(tx.gasprice)
-    elif op == 'PREVHASH':
-        stk.append(decode_int(block.prevhash))
-    elif op == 'COINBASE':
-        stk.append(decode_int(block.coinbase.decode('hex')))
-    elif op == 'TIMESTAMP':
-        stk.append(block.timestamp)
-    elif op == 'NUMBER':
-        stk.append(block.number)
-    elif op == 'DIFFICULTY':
-        stk.append(block.difficulty)
-    elif op == 'GASLIMIT':
-        stk.append(block.gaslimit)
-    elif op == 'POP':
-        pass
-    elif op == 'DUP':
-        stk.append(stackargs[0])
-        stk.append(stackargs[0])
-    elif op == 'SWAP':
-        stk.append(stackargs[0])
-        stk.append(stackargs[1])
-    elif op == 'MLOAD':
-        if len(mem) < stackargs[0] + 32:
-            mem.extend([0] * (stackargs[0] + 32 - len(mem)))
-        data = ''.join(map(chr, mem[stackargs[0]:stackargs[0] + 32]))
-        stk.append(decode_int(data))
-    elif op == 'MSTORE':
-        if len(mem) < stackargs[0] + 32:
-            mem.extend([0] * (stackargs[0] + 32 - len(mem)))
-        v = stackargs[1]
-        for i in range(31, -1, -1):
-            mem[stackargs[0] + i] = v % 256
-            v /= 256
-    elif op == 'MSTORE8':
-        if len(mem) < stackargs[0] + 1:
-            mem.extend([0] * (stackargs[0] + 1 - len(mem)))
-        mem[stackargs[0]] = stackargs[1] % 256
-    elif op == 'SLOAD':
-        stk.append(block.get_storage_data(msg.to, stackargs[0]))
-    elif op == 'SSTORE':
-        block.set_storage_data(msg.to, stackargs[0], stackargs[1])
-    elif op == 'JUMP':
-        compustate.pc = stackargs[0]
-    elif op == 'JUMPI':
-        if stackargs[1]:
-            compustate.pc = stackargs[0]
-    elif op == 'PC':
-        stk.append(compustate.pc)
-    elif op == 'MSIZE':
-        stk.append(len(mem))
-    elif op == 'GAS':
-        stk.append(oldgas)
-    elif op[:4] == 'PUSH':
-        pushnum = int(op[4:])
-        compustate.pc = oldpc + 1 + pushnum
-        dat = code[oldpc + 1: oldpc + 1 + pushnum]
-        stk.append(decode_int(dat))
-    elif op == 'CREATE':
-        if len(mem) < stackargs[2] + stackargs[3]:
-            mem.extend([0] * (stackargs[2] + stackargs[3] - len(mem)))
-        gas = stackargs[0]
-        value = stackargs[1]
-        data = ''.join(map(chr, mem[stackargs[2]:stackargs[2] + stackargs[3]]))
-        if debug:
-            print("Sub-contract:", msg.to, value, gas, data)
-        create_contract(block, tx, Message(msg.to, '', value, gas, data))
-    elif op == 'CALL':
-        if len(mem) < stackargs[3] + stackargs[4]:
-            mem.extend([0] * (stackargs[3] + stackargs[4] - len(mem)))
-        if len(mem) < stackargs[5] + stackargs[6]:
-            mem.extend([0] * (stackargs[5] + stackargs[6] - len(mem)))
-        gas = stackargs[0]
-        to = encode_int(stackargs[1])
-        to = (('\x00' * (32 - len(to))) + to)[12:]
-        value = stackargs[2]
-        data = ''.join(map(chr, mem[stackargs[3]:stackargs[3] + stackargs[4]]))
-        if debug:
-            print("Sub-call:", utils.coerce_addr_to_hex(msg.to),
-                  utils.coerce_addr_to_hex(to), value, gas, data)
-        result, gas, data = apply_msg(
-            block, tx, Message(msg.to, to, value, gas, data))
-        if debug:
-            print("Output of sub-call:", result, data, "length", len(data),
-                  "expected", stackargs[6])
-        for i in range(stackargs[6]):
-            mem[stackargs[5] + i] = 0
-        if result == 0:
-            stk.append(0)
-        else:
-            stk.append(1)
-            compustate.gas += gas
-            for i in range(len(data)):
-                mem[stackargs[5] + i] = data[i]
-    elif op == 'RETURN':
-        if len(mem) < stackargs[0] + stackargs[1]:
-            mem.extend([0] * (stackargs[0] + stackargs[1] - len(mem)))
-        return mem[stackargs[0]:stackargs[0] + stackargs[1]]
-    elif op == 'SUICIDE':
-        to = encode_int(stackargs[0])
-        to = (('\x00' * (32 - len(to))) + to)[12:]
-        block.delta_balance(to, block.get_balance(msg.to))
-        block.state.update(msg.to, '')
-        return []
+    memory_extension(mem, args[3], args[4])
+    memory_extension(mem, args[5], args[6])
+    gas = args[0]
+    to = encode_int(args[1])
+    to = (('\x00' * (32 - len(to))) + to)[12:]
+    value = args[2]
+    data = str(mem[args[3]:args[3] + args[4]])
+    if debug:
+        print("Sub-call:", utils.coerce_addr_to_hex(msg.to),
+              utils.coerce_addr_to_hex(to), value, gas, data)
+    result, gas, data = apply_msg(
+        block, tx, Message(msg.to, to, value, gas, data))
+    if debug:
+        print("Output of sub-call:", result, data, "length", len(data),
+              "expected", args[6])
+    mem[args[5]:args[5] + args[6]] = bytearray(args[6])
+    if result == 0:
+        compustate.stack.append(0)
+    else:
+        compustate.stack.append(1)
+        compustate.gas += gas
+        # all of the output is written, not only the size asked for
+        if args[5] + len(data) > len(mem):
+            raise IndexError('bytearray index out of range')
+        mem[args[5]:args[5] + len(data)] = data
+
+
+def op_return(block, tx, msg, compustate, args):
+    mem = compustate.memory
+    memory_extension(mem, args[0], args[1])
+    return mem[args[0]:args[0] + args[1]]
+
+
+def op_suicide(block, tx, msg, compustate, args):
+    to = encode_int(args[0])
+    to = (('\x00' * (32 - len(to))) + to)[12:]
+    block.delta_balance(to, block.get_balance(msg.to))
+    block.del_account(msg.to)
+    return bytearray()
+
+
+def memory_fee(start, size, mem):
+    return max(0, start + size - len(mem)) * GMEMORY
+
+# fees on top of the static ones, computed from the stack before the pops
+memory_fees = {
+    'SHA3': lambda stk, mem: memory_fee(stk[-1], stk[-2], mem),
+    'MLOAD': lambda stk, mem: memory_fee(stk[-1], 32, mem),
+    'MSTORE': lambda stk, mem: memory_fee(stk[-1], 32, mem),
+    'MSTORE8': lambda stk, mem: memory_fee(stk[-1], 1, mem),
+    'CALL': lambda stk, mem: stk[-1] + max(
+        memory_fee(stk[-4], stk[-5], mem), memory_fee(stk[-6], stk[-7], mem)),
+    'CREATE': lambda stk, mem: stk[-2] + memory_fee(stk[-3], stk[-4], mem),
+    'RETURN': lambda stk, mem: memory_fee(stk[-1], stk[-2], mem),
+    'CALLDATACOPY': lambda stk, mem: memory_fee(stk[-1], stk[-3], mem),
+}
+
+PUSH1 = reverse_opcodes['PUSH']
+PUSH32 = PUSH1 + 31
+
+# tables indexed by opcode, bytes which are no operation run `op_invalid`
+op_names = ['INVALID'] * 256
+op_in_args = [0] * 256
+op_pops = [()] * 256
+op_fees = [GSTOP] * 256
+op_memory_fees = [None] * 256
+op_handlers = [op_invalid] * 256
+for opcode, (name, in_args, out_args, fee) in opcodes.items():
+    # CREATE is among the bytes 0x80...0xf0 which never were executed
+    if name == 'PUSH' or PUSH32 < opcode <= 0xf0:
+        continue
+    op_names[opcode] = name
+    op_in_args[opcode] = in_args
+    op_pops[opcode] = range(in_args)
+    op_fees[opcode] = fee
+    op_memory_fees[opcode] = memory_fees.get(name)
+    op_handlers[opcode] = globals()['op_' + name.lower()]
+for opcode in range(PUSH1, PUSH32 + 1):
+    op_names[opcode] = 'PUSH' + str(opcode - PUSH1 + 1)
+    op_fees[opcode] = opcodes[PUSH1][3]
+# operations after which the next one run is not the following in the code,
+# and GAS, which must see the fees of the operations after it unpaid
+op_ends_block = [name in ('STOP', 'JUMP', 'JUMPI', 'RETURN', 'SUICIDE', 'GAS')
+                 for name in op_names]
@@ -0,0 +1,194 @@
+'''garbage collection of trie nodes no longer reachable from recent states
+
+Trie nodes are stored under their hash and shared between states, so an
+update never deletes the nodes it replaces. A `Pruner` records every node
+written to its database, together with the era it was written in; an era
+ends whenever a state is retained. In the background it marks the nodes
+reachable from the last retained states and collects the recorded nodes of
+past eras which were not marked; those are deleted by the thread writing
+the database, at the end of its next block, see `delete_garbage`.
+
+Only nodes written while the pruner runs are collected, and a state which
+is neither one of the retained ones nor built on top of the latest of them
+must not be used afterwards.
+'''
+import time
+import logging
+import threading
+from collections import deque
+
+import rlp
+from db import pruners
+from stoppable import StoppableLoopThread
+from trie import size_key
+from blocks import acct_structure_rev
+
+logger = logging.getLogger(__name__)
+
+STORAGE_INDEX = acct_structure_rev['storage'][0]
+
+# nodes marked per step of the background thread
+PRUNE_STEP_SIZE = 1000
+# seconds to wait when there is nothing to collect
+PRUNE_IDLE_INTERVAL = 1.0
+
+
+class Pruner(StoppableLoopThread):
+
+    def __init__(self, db, retain):
+        '''
+        :param db: the `DB` to collect
+        :param retain: number of states to keep, or of block numbers when
+        they are retained with theirs
+        '''
+        super(Pruner, self).__init__()
+        self.db = db
+        self.retain_count = retain
+        self.era = 0
+        # node hash -> era it was last written in
+        self.written = {}
+        # (era, number, roots) of the retained states
+        self.retained = deque()
+        self.height = -1
+        self.swept_era = -1
+        # swept nodes, to be deleted by `delete_garbage`
+        self.garbage = []
+        self.pruned = 0
+        self._cycle = None
+        self._written_lock = threading.Lock()
+        pruners[db.dbfile] = self
+
+    def record(self, key):
+        with self._written_lock:
+            self.written[key] = self.era
+
+    def retain(self, state_roots=(), roots=(), number=None):
+        '''keep a state, ending the current era
+
+        States are kept while their number is among the last `retain_count`
+        ones, so several states of the same number, e.g. of blocks on side
+        chains, are kept alike.
+
+        :param state_roots: roots of state tries, the storage tries of their
+        accounts are kept as well
+        :param roots: roots of other tries to keep, e.g. the transactions
+        :param number: e.g. the block number, by default one more than the
+        highest so far
+        '''
+        with self._written_lock:
+            if number is None:
+                number = self.height + 1
+            self.height = max(self.height, number)
+            self.retained.append(
+                (self.era, number, [(r, True) for r in state_roots] +
+                 [(r, False) for r in roots]))
+            lowest = self.height - self.retain_count
+            self.retained = deque(r for r in self.retained if r[1] > lowest)
+            self.era += 1
+
+    def step(self, budget=PRUNE_STEP_SIZE):
+        '''mark up to `budget` nodes, sweep once all of them are marked
+
+        :return: True if the collection is not finished yet
+        '''
+        if self._cycle is None:
+            with self._written_lock:
+                if not self.retained or \
+                        self.retained[-1][0] <= self.swept_era:
+                    return False
+                # everything written up to the latest retained state
+                cutoff = self.retained[-1][0]
+                stack = [root for era, number, roots in self.retained
+                         for root in roots]
+            # the number of pairs stored along with the roots
+            marked = set(size_key(root) for root, is_state in stack
+                         if isinstance(root, (str, unicode)))
+            self._cycle = (cutoff, stack, marked)
+
+        cutoff, stack, marked = self._cycle
+        while stack and budget > 0:
+            node, is_state = stack.pop()
+            self._mark(node, is_state, stack, marked)
+            budget -= 1
+        if stack:
+            return True
+
+        self._sweep(cutoff, marked)
+        self._cycle = None
+        return False
+
+    def collect(self):
+        '''run a whole collection at once'''
+        while self.step():
+            pass
+
+    def _load(self, key):
+        try:
+            return rlp.decode(self.db.get(key))
+        except KeyError:
+            # e.g. the state of a block which was not processed here
+            return None
+
+    def _mark(self, node, is_state, stack, marked):
+        '''mark a node and push its children
+
+        :param node: node or hash
+        :param is_state: whether the values are accounts
+        '''
+        if isinstance(node, (str, unicode)):
+            if len(node) < 32 or node in marked:
+                return
+            marked.add(node)
+            node = self._load(node)
+            if not node:
+                return
+
+        if len(node) == 17:
+            stack.extend((child, is_state) for child in node[:16])
+            value = node[16]
+        elif ord(node[0][0]) & 0x20:
+            # terminator flag, a leaf
+            value = node[1]
+        else:
+            stack.append((node[1], is_state))
+            return
+
+        if isinstance(value, (str, unicode)) and len(value) == 32:
+            # values which encode to 32 bytes or more are stored by hash
+            marked.add(value)
+            if not is_state:
+                return
+            value = self._load(value)
+        if is_state and isinstance(value, list):
+            storage = value[STORAGE_INDEX]
+            if isinstance(storage, (str, unicode)):
+                marked.add(size_key(storage))
+            stack.append((storage, False))
+
+    def _sweep(self, cutoff, marked):
+        with self._written_lock:
+            garbage = [key for key, era in self.written.iteritems()
+                       if era <= cutoff and key not in marked]
+            for key in garbage:
+                del self.written[key]
+            self.garbage.extend(garbage)
+            self.swept_era = cutoff
+        logger.debug('swept {0} trie nodes up to era {1}, {2} marked'.format(
+            len(garbage), cutoff, len(marked)))
+
+    def delete_garbage(self):
+        '''delete the swept nodes from the database
+
+        Called by the thread writing the database, which the sweep must not
+        modify meanwhile. Nodes written again since they were swept are kept.
+        '''
+        with self._written_lock:
+            garbage, self.garbage = self.garbage, []
+            garbage = [key for key in garbage if key not in self.written]
+        for key in garbage:
+            self.db.delete(key)
+        self.pruned += len(garbage)
+
+    def loop_body(self):
+        if not self.step():
+            time.sleep(PRUNE_IDLE_INTERVAL)
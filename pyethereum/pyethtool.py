@@ -89,6 +89,30 @@ def getstate(blockdata, address=None):
         return block.get_storage(address).to_dict()
 
 
+def getproof(blockdata, address):
+    block = blocks.Block.hex_deserialize(blockdata)
+    proof = block.state.get_proof(address.decode('hex'))
+    return [node.encode('hex') for node in proof]
+
+
+def verifyproof(state_root, address, *proof):
+    acct = trie.verify_proof(state_root.decode('hex'), address.decode('hex'),
+                             [node.decode('hex') for node in proof])
+    if acct is None:
+        return None
+    return {name: utils.decoders[typ](acct[i]) if typ == 'int'
+            else acct[i].encode('hex')
+            for i, (name, typ, default) in enumerate(blocks.acct_structure)}
+
+
+def diffstate(blockdata_a, blockdata_b):
+    '''addresses of the accounts which differ between the two blocks'''
+    block_a = blocks.Block.hex_deserialize(blockdata_a)
+    block_b = blocks.Block.hex_deserialize(blockdata_b)
+    return [address.encode('hex') for address, old, new
+            in block_a.state.diff(block_a.state.root, block_b.state.root)]
+
+
 def account_to_dict(blockdata, address):
     block = blocks.Block.hex_deserialize(blockdata)
     return block.account_to_dict(address)
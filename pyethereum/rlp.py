@@ -73,7 +73,201 @@ def descend(data, *indices):
             pos = next(data, pos)
             if pos >= fin:
                 raise Exception("End of list")
-    return data[pos: fin]
+        if pos >= fin:
+            raise Exception("End of list")
+    return data[pos: next(data, pos)]
+
+
+def _bounds(data, pos):
+    '''(is_list, payload start, end) of the item starting at pos'''
+    fchar = ord(data[pos])
+    if fchar < 128:
+        return False, pos, pos + 1
+    elif fchar < 184:
+        return False, pos + 1, pos + 1 + fchar - 128
+    elif fchar < 192:
+        b = fchar - 183
+        return False, pos + 1 + b, \
+            pos + 1 + b + big_endian_to_int(data[pos + 1:pos + 1 + b])
+    elif fchar < 248:
+        return True, pos + 1, pos + 1 + fchar - 192
+    else:
+        b = fchar - 247
+        return True, pos + 1 + b, \
+            pos + 1 + b + big_endian_to_int(data[pos + 1:pos + 1 + b])
+
+
+class OffsetIndex(object):
+
+    '''boundaries of every item in an RLP encoded blob
+
+    Built in a single non-recursive pass over `data`. Items are numbered in
+    depth-first pre-order, item 0 being the whole blob; for each item the
+    index records where its encoding starts, where its payload starts, where
+    it ends and, for lists, the numbers of its children. A path lookup is
+    then O(depth) however many siblings precede it, and the index can be
+    reused for any number of lookups.
+    '''
+
+    def __init__(self, data):
+        self.data = data
+        self.starts = []
+        self.payload_starts = []
+        self.ends = []
+        self.children = []  # None for strings
+        root = self._add(0)
+        stack = [[root, self.payload_starts[root]]] \
+            if self.children[root] is not None else []
+        while stack:
+            frame = stack[-1]
+            item, pos = frame
+            if pos >= self.ends[item]:
+                assert pos == self.ends[item], \
+                    "read beyond list boundary in OffsetIndex"
+                stack.pop()
+                continue
+            child = self._add(pos)
+            self.children[item].append(child)
+            frame[1] = self.ends[child]
+            if self.children[child] is not None:
+                stack.append([child, self.payload_starts[child]])
+        if self.ends[root] > len(data):
+            raise Exception("read beyond end of string in OffsetIndex")
+
+    def _add(self, pos):
+        is_list, payload_start, end = _bounds(self.data, pos)
+        self.starts.append(pos)
+        self.payload_starts.append(payload_start)
+        self.ends.append(end)
+        self.children.append([] if is_list else None)
+        return len(self.starts) - 1
+
+    def find(self, *indices):
+        '''number of the item at the path `indices`'''
+        item = 0
+        for i in indices:
+            children = self.children[item]
+            if children is None:
+                raise Exception("Cannot descend further")
+            try:
+                item = children[i]
+            except IndexError:
+                raise Exception("End of list")
+        return item
+
+    def descend(self, *indices):
+        '''the RLP encoding of the item at the path, like `descend`'''
+        item = self.find(*indices)
+        return self.data[self.starts[item]:self.ends[item]]
+
+    def decode(self, *indices):
+        '''the decoded item at the path'''
+        item = self.find(*indices)
+        if self.children[item] is None:
+            return self.data[self.payload_starts[item]:self.ends[item]]
+        return decode(self.data[self.starts[item]:self.ends[item]])
+
+    def count(self, *indices):
+        '''number of items in the list at the path'''
+        children = self.children[self.find(*indices)]
+        if children is None:
+            raise Exception("Not an RLP list")
+        return len(children)
+
+
+_UNDECODED = object()
+
+
+class LazyList(object):
+
+    '''an RLP list which is only decoded as far as it is accessed
+
+    Holds a reference to the encoded data and the position of the list inside
+    it. The item offsets are found with `next` the first time they are
+    needed, without decoding any item, and an item is decoded only when it is
+    indexed; nested lists are returned as `LazyList` again. Decoded items are
+    kept, so the offsets of a nested list are found once however often it is
+    indexed, and a path lookup repeated on the same list is O(depth).
+    '''
+
+    __slots__ = ('data', 'start', 'end', '_offsets', '_items')
+
+    def __init__(self, data, pos=0):
+        if ord(data[pos]) < 192:
+            raise Exception("Not an RLP list")
+        self.data = data
+        self.start = pos
+        self.end = next(data, pos)
+        self._offsets = None
+        # decoded items, _UNDECODED until indexed
+        self._items = None
+
+    @property
+    def offsets(self):
+        '''positions of the items in `data`'''
+        if self._offsets is None:
+            offsets = []
+            pos = into(self.data, self.start)
+            while pos < self.end:
+                offsets.append(pos)
+                pos = next(self.data, pos)
+            assert pos == self.end, "read beyond list boundary in LazyList"
+            self._offsets = offsets
+        return self._offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _item(self, index):
+        items = self._items
+        if items is None:
+            items = self._items = [_UNDECODED] * len(self.offsets)
+        item = items[index]
+        if item is _UNDECODED:
+            item = items[index] = _decode_lazy(self.data, self.offsets[index])
+        return item
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(len(self)))]
+        return self._item(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._item(i)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyList):
+            return self.encoded() == other.encoded()
+        return self.to_list() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<LazyList %r>' % self.to_list()
+
+    def encoded(self):
+        '''the RLP encoding of this list'''
+        if self.start == 0 and self.end == len(self.data):
+            return self.data
+        return self.data[self.start:self.end]
+
+    def to_list(self):
+        '''fully decode to nested lists, like `decode` does'''
+        return decode(self.encoded())
+
+
+def _decode_lazy(data, pos):
+    if ord(data[pos]) >= 192:
+        return LazyList(data, pos)
+    return __decode(data, pos)[0]
+
+
+def decode_lazy(s):
+    '''like `decode`, but lists are returned as `LazyList`'''
+    if s:
+        return _decode_lazy(s, 0)
 
 
 def encode_length(L, offset):
@@ -87,15 +281,49 @@ def encode_length(L, offset):
 
 
 def encode(s):
-    if isinstance(s, (str, unicode)):
-        s = str(s)
-        if len(s) == 1 and ord(s) < 128:
-            return s
+    '''RLP encode a string or a (nested) list of strings
+
+    Non-recursive: every prefix and string is collected exactly once into a
+    flat list of pieces, list prefixes are filled into their reserved slot as
+    soon as the list payload length is known and the output is allocated and
+    written in one go by ``str.join``.
+    '''
+    pieces = []
+    append = pieces.append
+    stack = []
+    total = 0
+    items = iter([s])
+    while True:
+        for item in items:
+            if isinstance(item, list):
+                stack.append((len(pieces), items, total))
+                append(None)  # reserved for the list prefix
+                items, total = iter(item), 0
+                break
+            if not isinstance(item, str):
+                if isinstance(item, LazyList):
+                    item = item.encoded()
+                    append(item)
+                    total += len(item)
+                    continue
+                if not isinstance(item, unicode):
+                    raise TypeError(
+                        "Encoding of %s not supported" % type(item))
+                item = str(item)
+            n = len(item)
+            if n == 1 and item < '\x80':
+                append(item)
+                total += 1
+                continue
+            prefix = chr(128 + n) if n < 56 else encode_length(n, 128)
+            append(prefix)
+            append(item)
+            total += len(prefix) + n
         else:
-            return encode_length(len(s), 128) + s
-    elif isinstance(s, list):
-        output = ''
-        for item in s:
-            output += encode(item)
-        return encode_length(len(output), 192) + output
-    raise TypeError("Encoding of %s not supported" % type(s))
+            if not stack:
+                return ''.join(pieces)
+            slot, items, parent_total = stack.pop()
+            prefix = chr(192 + total) if total < 56 \
+                else encode_length(total, 192)
+            pieces[slot] = prefix
+            total = parent_total + len(prefix) + total
@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 
 import os
+import multiprocessing
 import rlp
+from contextlib import contextmanager
 from sha3 import sha3_256
 from db import DB
+import dispatch
+import signals
 
 
 def bin_to_nibbles(s):
@@ -24,42 +28,9 @@ def bin_to_nibbles(s):
     return res
 
 
-def nibbles_to_bin(nibbles):
-    if any(x > 15 or x < 0 for x in nibbles):
-        raise Exception("nibbles can only be [0,..15]")
-
-    if len(nibbles) % 2:
-        raise Exception("nibbles must be of even numbers")
-
-    res = ''
-    for i in range(0, len(nibbles), 2):
-        res += chr(16 * nibbles[i] + nibbles[i + 1])
-    return res
-
-
 NIBBLE_TERMINATOR = 16
 
 
-def with_terminator(nibbles):
-    if not nibbles or nibbles[-1] != NIBBLE_TERMINATOR:
-        nibbles.append(NIBBLE_TERMINATOR)
-    return nibbles
-
-
-def without_terminator(nibbles):
-    if nibbles and nibbles[-1] == NIBBLE_TERMINATOR:
-        del nibbles[-1]
-    return nibbles
-
-
-def adapt_terminator(nibbles, has_terminator):
-    if has_terminator:
-        with_terminator(nibbles)
-    else:
-        without_terminator(nibbles)
-    return nibbles
-
-
 def pack_nibbles(nibbles):
     """pack nibbles to binary
 
@@ -101,13 +72,120 @@ def unpack_to_nibbles(bindata):
     return o
 
 
-def starts_with(full, part):
-    ''' test whether the items in the part is
-    the leading items of the full
-    '''
-    if len(full) < len(part):
-        return False
-    return full[:len(part)] == part
+_HEX_DIGITS = '0123456789abcdef'
+_NIBBLE_OF_DIGIT = dict((c, i) for i, c in enumerate(_HEX_DIGITS))
+
+
+class NibblePath(object):
+
+    """immutable nibble sequence, a view into a string of hex digits
+
+    Slicing only creates a new view on the same string, so walking down a
+    key does not copy it. Comparing and packing work on the hex digits
+    directly.
+
+    >>> p = NibblePath.from_bin('he')
+    >>> list(p), list(p[1:3]), p[1:].pack(terminator=True).encode('hex')
+    ([6, 8, 6, 5], [8, 6], '3865')
+    """
+
+    __slots__ = ('digits', 'start', 'end')
+
+    def __init__(self, digits='', start=0, end=None):
+        self.digits = digits
+        self.start = start
+        self.end = len(digits) if end is None else end
+
+    @classmethod
+    def from_bin(cls, s):
+        return cls(s.encode('hex'))
+
+    @classmethod
+    def from_nibble(cls, nibble):
+        return cls(_HEX_DIGITS[nibble])
+
+    @classmethod
+    def unpack(cls, bindata):
+        '''unpack the packed key of a node
+
+        :return: (path, has_terminator)
+        '''
+        digits = bindata.encode('hex')
+        flags = _NIBBLE_OF_DIGIT[digits[0]]
+        return cls(digits, 2 - (flags & 1)), bool(flags & 2)
+
+    def pack(self, terminator=False):
+        '''same as `pack_nibbles`, for a path'''
+        flags = 2 if terminator else 0
+        digits = self.digits[self.start:self.end]
+        if len(digits) % 2:
+            return (_HEX_DIGITS[flags | 1] + digits).decode('hex')
+        return (_HEX_DIGITS[flags] + '0' + digits).decode('hex')
+
+    def to_bin(self):
+        return self.digits[self.start:self.end].decode('hex')
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.end - self.start)
+            if step != 1:
+                raise ValueError("nibble paths can only be sliced by 1")
+            return NibblePath(self.digits, self.start + start,
+                              self.start + max(start, stop))
+        if i < 0:
+            i += self.end - self.start
+        if not 0 <= i < self.end - self.start:
+            raise IndexError("nibble index out of range")
+        return _NIBBLE_OF_DIGIT[self.digits[self.start + i]]
+
+    def __iter__(self):
+        return (_NIBBLE_OF_DIGIT[c]
+                for c in self.digits[self.start:self.end])
+
+    def __add__(self, other):
+        return NibblePath(self.digits[self.start:self.end] +
+                          other.digits[other.start:other.end])
+
+    def __eq__(self, other):
+        if not isinstance(other, NibblePath):
+            return list(self) == other
+        return self.end - self.start == other.end - other.start and \
+            self.digits.startswith(other.digits[other.start:other.end],
+                                   self.start)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digits[self.start:self.end])
+
+    def __repr__(self):
+        return 'NibblePath({0!r})'.format(list(self))
+
+    def startswith(self, prefix):
+        return self.end - self.start >= prefix.end - prefix.start and \
+            self.digits.startswith(prefix.digits[prefix.start:prefix.end],
+                                   self.start)
+
+    def common_prefix_length(self, other):
+        a, b = self.digits, other.digits
+        i, j = self.start, other.start
+        n = min(self.end - i, other.end - j)
+        k = 0
+        while k < n and a[i + k] == b[j + k]:
+            k += 1
+        return k
+
+BLANK_PATH = NibblePath()
+
+
+def copy_value(value):
+    if isinstance(value, list):
+        return [copy_value(x) for x in value]
+    return value
 
 
 sha3 = lambda x: sha3_256(x).digest()
@@ -129,29 +207,108 @@ def is_diverge_type(node_type):
     return node_type in [NODE_TYPE_DIVERGE_WITH_VALUE,
                          NODE_TYPE_DIVERGE_WITHOUT_VALUE]
 
+BLANK_NODE = ''
 
-def is_key_value_type(node_type):
-    return node_type in [NODE_TYPE_LEAF_KEY_VALUE,
-                         NODE_TYPE_INNER_KEY_VALUE]
 
-BLANK_NODE = ''
+class InvalidProof(Exception):
+    pass
+
+
+# prefix of the database key of the number of pairs below a root, a pruner
+# collects it along with the nodes of the root
+SIZE_KEY_PREFIX = 'size:'
+
+
+def size_key(root):
+    return SIZE_KEY_PREFIX + root
+
+# worker processes hashing the dirty subtrees of large batches, 0 hashes
+# everything in the committing thread
+HASH_WORKERS = 0
+# updates a batch needs for its subtrees to be hashed by the workers
+HASH_WORKERS_MIN_UPDATES = 1000
+
+_hash_pool = None
+
+
+def configure_hashing(workers):
+    '''set the number of worker processes hashing large batches'''
+    global HASH_WORKERS, _hash_pool
+    if workers != HASH_WORKERS and _hash_pool is not None:
+        _hash_pool.terminate()
+        _hash_pool = None
+    HASH_WORKERS = workers
+
+
+def _get_hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = multiprocessing.Pool(HASH_WORKERS)
+    return _hash_pool
+
+
+@dispatch.receiver(signals.config_ready)
+def config_trie(sender, **kwargs):
+    configure_hashing(sender.getint('misc', 'hash_workers'))
+
+
+def _store_dirty(node, store):
+    '''hash and store the nodes kept in memory during a batch, bottom up
+
+    :param node: node or hash
+    :param store: stores a node, returning the reference to it
+    :return: the reference to store in the parent node
+    '''
+    if not isinstance(node, list):
+        return node
+    if len(node) == 17:
+        node = [_store_dirty(x, store) for x in node[:16]] + [node[16]]
+    elif len(node) == 2 and not ord(node[0][0]) & 0x20:
+        # no terminator flag, the value is a node too
+        node = [node[0], _store_dirty(node[1], store)]
+    return store(node)
+
+
+def _hash_dirty(node):
+    '''`_store_dirty` in a worker process, without database
+
+    :return: (reference, [(hash, rlp) of every node to store])
+    '''
+    written = []
+
+    def store(node):
+        rlpnode = rlp.encode(node)
+        if len(rlpnode) < 32:
+            return node
+        hashkey = sha3(rlpnode)
+        written.append((hashkey, rlpnode))
+        return hashkey
+
+    return _store_dirty(node, store), written
 
 
 class Trie(object):
 
-    def __init__(self, dbfile, root=BLANK_NODE):
+    def __init__(self, dbfile, root=BLANK_NODE, backend=None):
         '''
         :param dbfile: key value database
         :root: blank or trie node in form of [key, value] or [v0,v1..v15,v]
+        :param backend: backend to open dbfile with, see `db.backends`
         '''
         self.root = root
         dbfile = os.path.abspath(dbfile)
-        self.db = DB(dbfile)
+        self.db = DB(dbfile, backend)
+        self._batch_depth = 0
+        self._batch_updates = 0
+        # (root, number of pairs or None if not stored), once looked up
+        self._size = None
+        # the root whose number of pairs is in the database
+        self._size_stored = None
 
     def clear(self):
         ''' clear all tree data
         '''
-        # FIXME: remove saved (hash, value) from database
+        # the nodes stay in the database until a pruner collects them
         self.root = BLANK_NODE
 
     def _inspect_node(self, node):
@@ -160,17 +317,16 @@ class Trie(object):
         :param node: node or hash
         :return: (NODE_TYPE_*, content), content is the decoded node,
         unless a key-value node, which will result a (key, value)
-        with key is nibbles without the terminator
+        with key is a `NibblePath` without the terminator
         '''
-        content = self._rlp_decode(node)
+        content = self._decode_node(node)
 
         if not content:
             return (NODE_TYPE_BLANK, BLANK_NODE)
 
         if len(content) == 2:
-            nibbles = unpack_to_nibbles(content[0])
-            has_terminator = (nibbles and nibbles[-1] == NIBBLE_TERMINATOR)
-            content = (without_terminator(nibbles), content[1])
+            key, has_terminator = NibblePath.unpack(content[0])
+            content = (key, content[1])
             return (NODE_TYPE_LEAF_KEY_VALUE, content) if has_terminator\
                 else (NODE_TYPE_INNER_KEY_VALUE, content)
 
@@ -178,56 +334,97 @@ class Trie(object):
             return (NODE_TYPE_DIVERGE_WITH_VALUE, content) if content[-1]\
                 else (NODE_TYPE_DIVERGE_WITHOUT_VALUE, content)
 
-    def _get(self, node, is_node, key):
+    def _get(self, node, key):
         """ get value inside a node
 
         :param node: node or hash
-        :param is_node: node is a node or a value
-        :param key: nibble list without terminator
+        :param key: `NibblePath` without terminator
         :return: None if does not exist, otherwise value or hash
-        is_node denote whether the node is a node or a value
         """
-        if not is_node:
-            if not key:
-                return node, False
-            return None, False
-
-        node_type, content = self._inspect_node(node)
-
-        if node_type == NODE_TYPE_BLANK:
-            return None, False
-
-        if is_diverge_type(node_type):
-            # already reach the expected node
-            if not key:
-                return content[-1] if content[-1] else None, False
-            return self._get(content[key[0]], True, key[1:])
-
-        # key value node
-        (curr_key, curr_val) = content
-        if node_type == NODE_TYPE_LEAF_KEY_VALUE:
-            if key == curr_key:
-                return curr_val, True
-            # not found
-            else:
-                return None, True
-
-        if node_type == NODE_TYPE_INNER_KEY_VALUE:
-            # traverse child nodes
-            if starts_with(key, curr_key):
-                return self._get(curr_val, True, key[len(curr_key):])
-            else:
-                return None, True
+        return _walk_path(node, key, self._decode_node)
 
     def _rlp_encode(self, node):
+        '''
+        :return: the reference to store in the parent node, i.e. the node
+        itself or its hash. Inside a batch every node stays in memory
+        unhashed until the batch is committed.
+        '''
+        if self._batch_depth:
+            return node
+        return self._store_node(node)
+
+    def _store(self, node):
         rlpnode = rlp.encode(node)
         if len(rlpnode) < 32:
             return node
 
         hashkey = sha3(rlpnode)
-        self.db.put(hashkey, rlpnode)
+        self.db.put_node(hashkey, rlpnode)
         return hashkey
 
+    def _store_node(self, node):
+        '''like `_store`, the node is also put in the node cache as it is
+        likely to be read again soon
+        '''
+        ref = self._store(node)
+        if ref is not node:
+            self.db.node_cache.put(ref, node)
+        return ref
+
+    def _store_dirty_in_workers(self, node):
+        '''like `_store_dirty`, the dirty subtrees below the first diverge
+        node with more than one of them are hashed by the worker processes.
+        The nodes they return are stored in the order of the slots, so the
+        result does not depend on the workers.
+        '''
+        if not isinstance(node, list):
+            return node
+        if len(node) == 2:
+            if not ord(node[0][0]) & 0x20:
+                node = [node[0], self._store_dirty_in_workers(node[1])]
+            return self._store_node(node)
+
+        dirty = [i for i in range(16) if isinstance(node[i], list)]
+        if len(dirty) < 2:
+            node = [self._store_dirty_in_workers(x) for x in node[:16]] + \
+                [node[16]]
+            return self._store_node(node)
+        node = node[:]
+        results = _get_hash_pool().map(_hash_dirty, [node[i] for i in dirty])
+        for i, (ref, written) in zip(dirty, results):
+            for hashkey, rlpnode in written:
+                self.db.put_node(hashkey, rlpnode)
+            node[i] = ref
+        return self._store_node(node)
+
+    @contextmanager
+    def batch(self):
+        '''group updates and deletes
+
+        Inside the block the nodes touched by `update` and `delete` are kept
+        in memory; on exit every node still reachable is hashed once and all
+        of them are written to the database in one batch. Batches may be
+        nested, the outermost one commits.
+        '''
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.commit()
+
+    def commit(self):
+        size = self._known_size()
+        if HASH_WORKERS and self._batch_updates >= HASH_WORKERS_MIN_UPDATES:
+            self.root = self._store_dirty_in_workers(self.root)
+        else:
+            self.root = _store_dirty(self.root, self._store_node)
+        self._batch_updates = 0
+        self._set_size(size)
+        self._store_size()
+        self.db.commit()
+
     def _rlp_decode(self, node):
         if not isinstance(node, (str, unicode)):
             return node
@@ -238,192 +435,155 @@ class Trie(object):
         else:
             return rlp.decode(self.db.get(node))
 
-    def _update(self, node, is_node, key, value, value_is_node):
-        """ update item inside a node
+    def _decode_node(self, node):
+        '''like `_rlp_decode`, for nodes only: hash references are served
+        from the node cache shared by all tries on the same database.
+
+        .. note::
+
+            the decoded node is shared, it must not be modified in place
+        '''
+        if not isinstance(node, (str, unicode)) or len(node) < 32:
+            return node
+        cache = self.db.node_cache
+        content = cache.get(node)
+        if content is None:
+            content = rlp.decode(self.db.get(node))
+            cache.put(node, content)
+        return content
+
+    def _update(self, node, key, value):
+        """ set the value of a key, walking down its path only once
+
+        The parents passed on the way down are rebuilt bottom up, each one
+        normalized and encoded once.
 
         :param node: node or hash
-        :param is_node: node is a node or a value
-        :param key: nibble list without terminator
-        :param value: node or hash, a blank node means to delete it
-        :param value_is_node: value is leaf or intermediate node
-        :return: (node, is_node) where `node` is the updated normalized node
-        or hash, `is_node` denote whether the node is a node or a value
+        :param key: `NibblePath` without terminator
+        :param value: value or hash, a blank node means to delete the key
+        :return: (the updated node or hash, change of the number of pairs)
         """
-        # FIXME: delete unused data from db
-        if not is_node:
-            if not key:
-                return value, value_is_node
+        root = node
+        # parents, as (diverge content, slot) or (inner key, None)
+        parents = []
+        while True:
+            node_type, content = self._inspect_node(node)
+            if is_diverge_type(node_type) and key:
+                parents.append((content, key[0]))
+                node = content[key[0]]
+                key = key[1:]
+            elif node_type == NODE_TYPE_INNER_KEY_VALUE and \
+                    key.startswith(content[0]):
+                parents.append((content[0], None))
+                node = content[1]
+                key = key[len(content[0]):]
             else:
-                # a new diverge node
-                new_node = [''] * 17
-                new_node[-1] = node
-                new_node[key[0]] = self._update(
-                    BLANK_NODE, True, key[1:], value, value_is_node)
-                return self._normalize_node(
-                    self._rlp_encode(new_node), True)
-
-        # node is a node, rather than a value
-        (node_type, content) = self._inspect_node(node)
+                break
 
         if node_type == NODE_TYPE_BLANK:
-            if not value_is_node:
-                return self._normalize_node(
-                    self._rlp_encode(
-                        [pack_nibbles(with_terminator(key)), value]),
-                    True)
-            # a inner node
-            else:
-                if value == BLANK_NODE:
-                    return BLANK_NODE, True
-
-                return self._normalize_node(
-                    self._rlp_encode([pack_nibbles(key), value]), True)
+            if value == BLANK_NODE:
+                return root, 0
+            node = self._leaf(key, value)
+            delta = 1
 
         elif is_diverge_type(node_type):
-            return self._update_diverge_node(node_type, content, key,
-                                             value, value_is_node)
-
-        elif is_key_value_type(node_type):
-            return self._update_kv_node(node_type, content, key,
-                                        value, value_is_node)
-
-    def _update_diverge_node(self, node_type, content,
-                             key, value, value_is_node):
-        if key:
-            content[key[0]], slot_is_node = self._update(
-                content[key[0]], True, key[1:], value, value_is_node)
-        else:
-            content[-1] = value
+            delta = (value != BLANK_NODE) - (content[-1] != BLANK_NODE)
+            node = content[:]  # may be shared through the node cache
+            node[-1] = value
+            node = self._normalize_diverge(node)
+
+        elif node_type == NODE_TYPE_LEAF_KEY_VALUE and key == content[0]:
+            if value != BLANK_NODE:
+                node, delta = self._leaf(key, value), 0
+            else:
+                node, delta = BLANK_NODE, -1
 
-        return self._normalize_node(
-            self._rlp_encode(content), True)
+        elif value == BLANK_NODE:
+            # the key does not exist
+            return root, 0
 
-    def _update_kv_node(self, node_type, content, key, value, value_is_node):
+        else:
+            node = self._split_key_value(node_type, content, key, value)
+            delta = 1
 
-        '''when the current node is a (key, value) node
+        for parent, slot in reversed(parents):
+            if slot is None:
+                node = self._prepend_key(parent, node)
+            else:
+                diverge_node = parent[:]
+                diverge_node[slot] = self._rlp_encode(node)
+                node = self._normalize_diverge(diverge_node)
+        return self._rlp_encode(node), delta
 
-        :param content: an  (key, value) tuple
-        :param key: nibble list without terminator, must not be blank
-        :param value: node or hash
-        :return: the updated node or hash
+    def _leaf(self, key, value):
+        return [key.pack(terminator=True), value]
 
-        .. note::
+    def _split_key_value(self, node_type, content, key, value):
+        '''insert a key into a key value node it diverges from
 
-            (key, value, value_is_node) has already normalized,
-            content itself as a valid node should already be normalized too
+        :return: a diverge node, behind an inner node for the common prefix
         '''
         curr_key, curr_val = content
-        curr_val_is_node = node_type != NODE_TYPE_LEAF_KEY_VALUE
-
-        without_terminator(curr_key)
-
-        # find longest common prefix
-        prefix_length = 0
-        for i in range(min(len(curr_key), len(key))):
-            if key[i] != curr_key[i]:
-                break
-            prefix_length = i + 1
+        prefix_length = key.common_prefix_length(curr_key)
+        prefix = key[:prefix_length]
+        diverge_node = [BLANK_NODE] * 17
 
-        if not prefix_length:
-            return self._merge_two_pairs(curr_key, curr_val, curr_val_is_node,
-                                         key, value, value_is_node)
+        curr_key = curr_key[prefix_length:]
+        if not curr_key:
+            # only possible for a leaf
+            diverge_node[-1] = curr_val
+        elif node_type == NODE_TYPE_LEAF_KEY_VALUE:
+            diverge_node[curr_key[0]] = self._rlp_encode(
+                self._leaf(curr_key[1:], curr_val))
+        elif len(curr_key) > 1:
+            diverge_node[curr_key[0]] = self._rlp_encode(
+                [curr_key[1:].pack(), curr_val])
+        else:
+            diverge_node[curr_key[0]] = curr_val
 
-        # create node for key postfix
-        post_curr_key_node, is_node = self._update(
-            BLANK_NODE, True,
-            curr_key[prefix_length:], curr_val, curr_val_is_node)
+        key = key[prefix_length:]
+        if not key:
+            diverge_node[-1] = value
+        else:
+            diverge_node[key[0]] = self._rlp_encode(
+                self._leaf(key[1:], value))
 
-        post_curr_key_node, is_node = self._update(
-            post_curr_key_node, is_node,
-            key[prefix_length:], value, value_is_node)
+        if not prefix:
+            return diverge_node
+        return [prefix.pack(), self._rlp_encode(diverge_node)]
 
-        # create node for key prefix
-        return self._update(
-            BLANK_NODE, True,
-            curr_key[:prefix_length], post_curr_key_node, is_node)
+    def _prepend_key(self, key, node):
+        '''the node for an inner key value node with key whose value was
+        updated to node, merging key value nodes
 
-    def _normalize_pair(self, key, value, value_is_node):
-        '''if value is also a key-value node, merge its key to key
-        '''
-        if not value_is_node:
-            return key, value, value_is_node
-        (value_node_type, value_content) = self._inspect_node(value)
-        if is_key_value_type(value_node_type):
-            key.extend(value_content[0])
-            return (key, value_content[1],
-                    value_node_type == NODE_TYPE_INNER_KEY_VALUE)
-        return key, value, value_is_node
-
-    def _normalize_node(self, node, is_node):
-        '''
-        :return: (normalized_node, is_node)
+        :param node: the updated node
         '''
-        if not is_node:
-            return node, is_node
-
-        (node_type, content) = self._inspect_node(node)
-
-        # for NODE_TYPE_LEAF_KEY_VALUE, no need to normalize
-
-        if node_type == NODE_TYPE_INNER_KEY_VALUE:
-            key, value, value_is_node = self._normalize_pair(
-                content[0][:], content[1], True)
-            if not key:
-                return value, value_is_node
-            if key == content[0]:
-                return node, is_node
-            return self._update(BLANK_NODE, True, key, value, value_is_node)
-
-        if is_diverge_type(node_type):
-            not_blank_slots_count = sum(1 for x in range(17) if content[x])
-
-            if not not_blank_slots_count:
-                return BLANK_NODE, True
-
-            if not_blank_slots_count > 1:
-                return node, True
-
-            # only one slot/value is not blank
-
-            # convert to a key value node
-            if content[-1]:
-                return self._update(BLANK_NODE, True, [], content[-1], False)
-
-            index = [i for i, item in enumerate(content) if item][0]
-
-            return self._update(
-                [], True, [index], content[index], value_is_node=True)
-
-        return node, True
-
-    def _merge_two_pairs(self,
-                         key1, value1, value1_is_node,
-                         key2, value2, value2_is_node):
+        if node == BLANK_NODE:
+            return BLANK_NODE
+        if len(node) == 2:
+            node_key, has_terminator = NibblePath.unpack(node[0])
+            return [(key + node_key).pack(has_terminator), node[1]]
+        return [key.pack(), self._rlp_encode(node)]
+
+    def _normalize_diverge(self, content):
         '''
-        merge (key2, value2) to (key1, value1)
-        key1 and key2 has no common prefix
+        :param content: a diverge node, which may have less than two not
+        blank slots left
+        :return: the normalized node
         '''
-        key1, value1, value1_is_node = self._normalize_pair(
-            key1, value1, value1_is_node)
-
-        key2, value2, value2_is_node = self._normalize_pair(
-            key2, value2, value2_is_node)
-
-        diverge_node = [BLANK_NODE] * 17
-
-        if not key1:
-            diverge_node[-1] = value1
-        else:
-            diverge_node[key1[0]] = self._update(
-                [], True, key1[1:], value1, value1_is_node)[0]
-        if not key2:
-            diverge_node[-1] = value2
-        else:
-            diverge_node[key2[0]] = self._update(
-                [], True, key2[1:], value2, value2_is_node)[0]
-
-        return self._normalize_node(
-            self._rlp_encode(diverge_node), True)
+        if content.count(BLANK_NODE) < 16:
+            return content
+        index = [i for i, item in enumerate(content) if item]
+        if not index:
+            return BLANK_NODE
+        if index[0] == 16:
+            return self._leaf(BLANK_PATH, content[-1])
+        key = NibblePath.from_nibble(index[0])
+        child = self._decode_node(content[index[0]])
+        if len(child) == 17:
+            # refer to the stored diverge node as it is
+            return [key.pack(), content[index[0]]]
+        return self._prepend_key(key, child)
 
     def delete(self, key):
         '''
@@ -435,101 +595,233 @@ class Trie(object):
         if len(key) > 32:
             raise Exception("Max key length is 32")
 
-        ''' .. note:: value_is_node should be true, or the key will be updated
-        with a blank value
-        '''
-        self.root, _ = self._update(
-            self.root,
-            True,
-            bin_to_nibbles(str(key)),
-            BLANK_NODE,
-            value_is_node=True)
-        self.db.commit()
+        self._apply(key, BLANK_NODE)
         return self._rlp_decode(self.root)
 
-    def _get_size(self, node, is_node):
-        '''Get counts of (key, value) stored in this and the descendant nodes
-
-        :param node: node or hash
-        :is_node: true if node is not a value, other wise false
-        '''
-        if not is_node:
-            return 1
-
-        (node_type, content) = self._inspect_node(node)
-        if node_type == NODE_TYPE_BLANK:
+    def _apply(self, key, value):
+        size = self._known_size()
+        self.root, delta = self._update(
+            self.root, NibblePath.from_bin(str(key)), value)
+        self._set_size(None if size is None else size + delta)
+        if self._batch_depth:
+            self._batch_updates += 1
+        else:
+            self._store_size()
+            self.db.commit()
+
+    def _known_size(self):
+        '''the number of pairs if it is known without walking the trie'''
+        if self._size is not None and self._size[0] == self.root:
+            return self._size[1]
+        if self.root == BLANK_NODE:
             return 0
-        elif is_key_value_type(node_type):
-            value_is_node = node_type == NODE_TYPE_INNER_KEY_VALUE
-            return self._get_size(content[1], value_is_node)
-        elif is_diverge_type(node_type):
-            return sum(self._get_size(content[x], True) for x in range(16)) \
-                + (1 if content[-1] else 0)
-
-    def _to_dict(self, node, is_node):
-        '''convert (key, value) stored in this and the descendant nodes
-        to dict items.
-
-        :param node: node or hash
-        :is_node: true if node is not a value, other wise false
-
-        .. note::
+        if isinstance(self.root, (str, unicode)):
+            try:
+                size = int(self.db.get(size_key(self.root)))
+                self._size_stored = self.root
+            except KeyError:
+                size = None
+            self._size = (self.root, size)
+            return size
+        return None
+
+    def _set_size(self, size):
+        '''remember the number of pairs of the current root'''
+        self._size = None if size is None else (self.root, size)
+
+    def _store_size(self):
+        '''store the number of pairs of the stored root, if known'''
+        if self._size is None or self._size[0] != self.root \
+                or self._size[1] is None or self._size_stored == self.root:
+            return
+        if not isinstance(self.root, (str, unicode)) or not self.root:
+            return
+        self.db.put_node(size_key(self.root), str(self._size[1]))
+        self._size_stored = self.root
+
+    def _count_pairs(self):
+        count = 0
+        stack = [self.root]
+        while stack:
+            content = self._peek_node(stack.pop())
+            if not content:
+                continue
+            if len(content) == 17:
+                stack.extend(x for x in content[:16] if x)
+                count += content[16] != BLANK_NODE
+            elif ord(content[0][0]) & 0x20:
+                # terminator flag, a leaf
+                count += 1
+            else:
+                stack.append(content[1])
+        return count
 
-            Here key is in full form, rather than key of the individual node
+    def _peek_node(self, node):
+        '''like `_decode_node`, without filling the node cache'''
+        if not isinstance(node, (str, unicode)) or len(node) < 32:
+            return node
+        content = self.db.node_cache.peek(node)
+        if content is None:
+            content = rlp.decode(self.db.get(node))
+        return content
+
+    def iter_items(self, prefix='', start='', end=None, limit=None):
+        '''iterate over the (key, value) pairs in key order
+
+        Nodes are read as the iteration reaches them and subtrees outside
+        of the range are skipped, so a trie of any size can be paged
+        through in constant memory.
+
+        :param prefix: only keys starting with prefix
+        :param start: only keys >= start
+        :param end: only keys < end, None for no upper bound
+        :param limit: at most that many pairs, None for no limit
         '''
-        if not is_node:
-            return {'': self._rlp_decode(node)}
-
-        (node_type, content) = self._inspect_node(node)
-
-        if node_type == NODE_TYPE_BLANK:
-            return {}
-
-        elif is_key_value_type(node_type):
-            key = '+'.join([str(x) for x in content[0]])
-            value_is_node = node_type == NODE_TYPE_INNER_KEY_VALUE
-            sub_dict = self._to_dict(content[1], value_is_node)
-
-            # prepend key of this node to the keys of children
-            res = {}
-            for sub_key, sub_value in sub_dict.iteritems():
-                full_key = '{0}+{1}'.format(key, sub_key) if sub_key else key
-                res[full_key] = sub_value
-            return res
-
-        elif is_diverge_type(node_type):
-            res = {}
-            for i in range(16):
-                sub_dict = self._to_dict(content[i], True)
-
-                for sub_key, sub_value in sub_dict.iteritems():
-                    full_key = '{0}+{1}'.format(i, sub_key) if sub_key else i
-                    res[full_key] = sub_value
-
-            if content[-1]:
-                res[str(NIBBLE_TERMINATOR)] = self._rlp_decode(content[-1])
-            return res
+        # bounds as hex digits, i.e. nibbles, like the paths below
+        start = max(start.encode('hex'), prefix.encode('hex'))
+        end = end.encode('hex') if end is not None else None
+        prefix_end = prefix.encode('hex').rstrip('f')
+        if prefix_end:
+            prefix_end = prefix_end[:-1] + \
+                _HEX_DIGITS[_NIBBLE_OF_DIGIT[prefix_end[-1]] + 1]
+            end = prefix_end if end is None else min(end, prefix_end)
+        if limit is not None and limit <= 0:
+            return
+
+        count = 0
+        # (nibbles of the keys below node, node), smallest keys on top
+        stack = [('', self.root)]
+        while stack:
+            path, node = stack.pop()
+            if path < start[:len(path)]:
+                continue
+            if end is not None and (path > end[:len(path)] or path == end):
+                return
+
+            content = self._peek_node(node)
+            if not content:
+                continue
+            if len(content) == 17:
+                value = content[-1]
+                stack.extend((path + _HEX_DIGITS[i], content[i])
+                             for i in range(15, -1, -1) if content[i])
+            else:
+                key, has_terminator = NibblePath.unpack(content[0])
+                path += key.digits[key.start:]
+                if not has_terminator:
+                    stack.append((path, content[1]))
+                    continue
+                value = content[1]
+
+            if not value or path < start:
+                continue
+            if end is not None and path >= end:
+                return
+            yield path.decode('hex'), copy_value(self._rlp_decode(value))
+            count += 1
+            if count == limit:
+                return
+
+    def _expand(self, subtree):
+        '''the value and the children of a subtree, one nibble down
+
+        :param subtree: (digits of the path to the node, whether the node is
+        a value, node or hash), None if blank
+        :return: (value or hash or None, {digit: subtree})
+        '''
+        if subtree is None:
+            return None, {}
+        path, is_value, node = subtree
+        if path:
+            return None, {path[0]: (path[1:], is_value, node)}
+        if is_value:
+            return node, {}
+        content = self._decode_node(node)
+        if not content:
+            return None, {}
+        if len(content) == 17:
+            return content[-1] or None, dict(
+                (_HEX_DIGITS[i], ('', False, content[i]))
+                for i in range(16) if content[i])
+        key, has_terminator = NibblePath.unpack(content[0])
+        return self._expand(
+            (key.digits[key.start:key.end], has_terminator, content[1]))
+
+    def diff(self, root_a, root_b):
+        '''the pairs which differ between the tries with root_a and root_b
+
+        Both tries are walked side by side and subtrees with the same hash
+        are skipped, so the cost depends on the size of the change rather
+        than on the size of the tries.
+
+        :return: generator of (key, value in a, value in b) in key order,
+        with None for the value of a key which does not exist in one trie
+        '''
+        def decode(value):
+            return None if value is None else copy_value(
+                self._rlp_decode(value))
+
+        stack = [('', ('', False, root_a), ('', False, root_b))]
+        while stack:
+            path, a, b = stack.pop()
+            if a == b:
+                continue
+            value_a, children_a = self._expand(a)
+            value_b, children_b = self._expand(b)
+            if value_a != value_b:
+                yield path.decode('hex'), decode(value_a), decode(value_b)
+            for digit in sorted(set(children_a) | set(children_b),
+                                reverse=True):
+                stack.append((path + digit, children_a.get(digit),
+                              children_b.get(digit)))
 
     def to_dict(self, as_hex=False):
-        d = self._to_dict(self.root, True)
-        res = {}
-        for key_str, value in d.iteritems():
-            nibbles = [int(x) for x in key_str.split('+')]
-            key = nibbles_to_bin(without_terminator(nibbles))
-            res[key] = value
-        return res
+        return dict(self.iter_items())
 
     def get(self, key):
-        rlp_value, _ = self._get(self.root, True, bin_to_nibbles(str(key)))
-        return self._rlp_decode(rlp_value) if rlp_value is not None else None
+        rlp_value = self._get(self.root, NibblePath.from_bin(str(key)))
+        if rlp_value is None:
+            return None
+        # a value short enough to be inlined is part of a shared node
+        return copy_value(self._rlp_decode(rlp_value))
+
+    def get_proof(self, key):
+        '''the nodes proving the value of key, or that it does not exist
+
+        :return: the RLP encoded nodes from the root along the path of key,
+        followed by the value if it is stored by hash. Nodes inlined into
+        their parent are part of it.
+        '''
+        proof = []
+
+        def add(ref):
+            if isinstance(ref, list):
+                return ref
+            rlpdata = self.db.get(ref)
+            proof.append(rlpdata)
+            return rlp.decode(rlpdata)
+
+        rlp_value = _walk_path(self.root, NibblePath.from_bin(str(key)), add)
+        if isinstance(rlp_value, (str, unicode)) and len(rlp_value) == 32:
+            add(rlp_value)
+        return proof
 
     def get_size(self):
-        return self._get_size(self.root, True)
+        '''the number of pairs, tracked by the updates and stored next to
+        the root. It is only counted for roots written without it.
+        '''
+        size = self._known_size()
+        if size is None:
+            size = self._count_pairs()
+            self._set_size(size)
+            if not self._batch_depth:
+                self._store_size()
+        return size
 
     def update(self, key, value):
         '''
         :param key: a string with length of [0, 32]
-        :value: a string or list
+        :value: a string or list, a blank string deletes the key
         '''
         if not isinstance(key, (str, unicode)):
             raise Exception("Key must be strings")
@@ -537,15 +829,158 @@ class Trie(object):
         if len(key) > 32:
             raise Exception("Max key length is 32")
 
-        self.root, _ = self._update(
-            self.root,
-            True,
-            bin_to_nibbles(str(key)),
-            self._rlp_encode(value),
-            value_is_node=False)
-        self.db.commit()
+        self._apply(key, self._store(value))
         return self._rlp_decode(self.root)
 
+    def update_many(self, items):
+        '''update with every (key, value) of `items` in one batch'''
+        with self.batch():
+            for key, value in items:
+                self.update(key, value)
+        return self._rlp_decode(self.root)
+
+    def bulk_load(self, items):
+        '''replace the pairs of the trie by items, building it bottom up
+
+        Every node is complete once the keys after it are read, so it is
+        hashed and written only once; the writes are batched by the journal
+        of the database.
+
+        :param items: iterable of (key, value) sorted by key, without
+        duplicates; pairs with a blank value are skipped
+        '''
+        items = iter(items)
+        # up to two pairs read ahead, as (key in hex digits, value or hash)
+        ahead = []
+        state = dict(last=None, count=0)
+
+        def peek(i):
+            ''':return: the hex digits of the i-th key ahead, None if none'''
+            while len(ahead) <= i:
+                try:
+                    key, value = next(items)
+                except StopIteration:
+                    return None
+                if not isinstance(key, (str, unicode)):
+                    raise Exception("Key must be strings")
+                if len(key) > 32:
+                    raise Exception("Max key length is 32")
+                if state['last'] is not None and key <= state['last']:
+                    raise Exception("Keys must be sorted and unique")
+                state['last'] = key
+                if value == BLANK_NODE:
+                    continue
+                state['count'] += 1
+                ahead.append((str(key).encode('hex'), self._store(value)))
+            return ahead[i][0]
+
+        def build(prefix):
+            '''the subtree of the keys starting with prefix, which the
+            next one does
+
+            :return: (digits of the path below prefix, node, is_leaf), the
+            node being the value of a leaf, the path is not packed yet as
+            it grows while single children are merged upwards
+            '''
+            depth = len(prefix)
+            second = peek(1)
+            if second is None or not second.startswith(prefix):
+                key, value = ahead.pop(0)
+                return key[depth:], value, True
+
+            diverge_node = [BLANK_NODE] * 17
+            if ahead[0][0] == prefix:
+                diverge_node[-1] = ahead.pop(0)[1]
+            children = []
+            while True:
+                key = peek(0)
+                if key is None or not key.startswith(prefix):
+                    break
+                digit = key[depth]
+                children.append((digit, build(prefix + digit)))
+
+            if len(children) == 1 and not diverge_node[-1]:
+                digit, (path, node, is_leaf) = children[0]
+                return digit + path, node, is_leaf
+            for digit, child in children:
+                diverge_node[_NIBBLE_OF_DIGIT[digit]] = \
+                    self._store(encode(child))
+            return '', diverge_node, False
+
+        def encode((path, node, is_leaf)):
+            if is_leaf:
+                return [NibblePath(path).pack(terminator=True), node]
+            if path:
+                return [NibblePath(path).pack(), self._store(node)]
+            return node
+
+        if peek(0) is None:
+            self.root = BLANK_NODE
+        else:
+            self.root = self._store(encode(build('')))
+        self._set_size(state['count'])
+        if not self._batch_depth:
+            self._store_size()
+            self.db.commit()
+
+
+def _walk_path(node, key, load):
+    '''follow key from node
+
+    :param load: decodes the hash or inlined node it is called with
+    :return: the value or hash of key, None if it does not exist
+    '''
+    while node != BLANK_NODE:
+        content = load(node)
+        if not content:
+            return None
+        if len(content) == 17:
+            if not key:
+                return content[-1] or None
+            node = content[key[0]]
+            key = key[1:]
+            continue
+        node_key, has_terminator = NibblePath.unpack(content[0])
+        if has_terminator:
+            return content[1] if key == node_key else None
+        if not key.startswith(node_key):
+            return None
+        node = content[1]
+        key = key[len(node_key):]
+    return None
+
+
+def verify_proof(root, key, proof):
+    '''the value of key in the trie with root, from the nodes returned by
+    `Trie.get_proof`, without any database
+
+    :return: the value, None if the proof shows that key does not exist
+    :raise InvalidProof: if a node of the path is missing or malformed
+    '''
+    nodes = dict((sha3(rlpdata), rlpdata) for rlpdata in proof)
+
+    def load(ref):
+        if ref not in nodes:
+            raise InvalidProof("node %s is missing" % ref.encode('hex'))
+        try:
+            return rlp.decode(nodes[ref])
+        except Exception:
+            raise InvalidProof("node %s is malformed" % ref.encode('hex'))
+
+    def load_node(ref):
+        # inlined into the parent, or the root of a trie that small
+        content = ref if isinstance(ref, list) else load(ref)
+        if not isinstance(content, list) or len(content) not in (2, 17):
+            raise InvalidProof("not a trie node: %r" % content)
+        return content
+
+    rlp_value = _walk_path(root, NibblePath.from_bin(str(key)), load_node)
+    if isinstance(rlp_value, (str, unicode)) and len(rlp_value) == 32:
+        # stored by hash
+        return load(rlp_value)
+    return copy_value(rlp_value)
+
+
 if __name__ == "__main__":
     import sys
 
@@ -118,6 +118,8 @@ def decode_int(v):
 
 
 def decode_root(root):
+    if isinstance(root, rlp.LazyList):
+        root = root.to_list()
     if isinstance(root, list):
         if len(rlp.encode(root)) >= 32:
             raise Exception("Direct RLP roots must have length <32")
@@ -9,4 +9,5 @@ setup(name="pyethereum",
       packages=find_packages("."),
       install_requires=[
           'six', 'leveldb', 'bitcoin', 'pysha3', 'netifaces', 'bottle', 'hyp'],
+      extras_require={'lmdb': ['lmdb']},
       entry_points=dict(console_scripts=console_scripts))
@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+'''micro benchmarks for the hot paths of pyethereum
+
+usage: python tools/benchmark.py [name ...]
+   or: python -m tools.benchmark [name ...]
+
+without arguments all benchmarks are run.
+'''
+import os
+import sys
+import timeit
+import random
+import shutil
+import tempfile
+import multiprocessing
+
+# the checkout, when run as a script rather than with -m
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyethereum import rlp
+from pyethereum import trie
+from pyethereum import blocks
+from pyethereum import processblock
+from pyethereum.packeter import Packeter, PacketReader
+from pyethereum.trie import Trie, NibblePath, sha3, BLANK_NODE, BLANK_PATH
+from pyethereum.db import FLUSH_PER_BLOCK
+from pyethereum.utils import int_to_big_endian
+
+
+def legacy_rlp_encode(s):
+    '''the recursive, concatenating encoder `rlp.encode` replaced'''
+    if isinstance(s, (str, unicode)):
+        s = str(s)
+        if len(s) == 1 and ord(s) < 128:
+            return s
+        else:
+            return rlp.encode_length(len(s), 128) + s
+    elif isinstance(s, list):
+        output = ''
+        for item in s:
+            output += legacy_rlp_encode(item)
+        return rlp.encode_length(len(output), 192) + output
+    raise TypeError("Encoding of %s not supported" % type(s))
+
+
+class LegacyTrie(Trie):
+
+    '''a Trie updated by the recursive engine `Trie._update` replaced
+
+    Every level normalizes, and outside a batch stores, the nodes it builds,
+    including the intermediate ones replaced again by its caller.
+    '''
+
+    def _apply(self, key, value):
+        self.root, _ = self._legacy_update(
+            self.root, True, NibblePath.from_bin(str(key)), value,
+            value == BLANK_NODE)
+        self._set_size(None)
+        if not self._batch_depth:
+            self.db.commit()
+
+    def _rlp_encode(self, node):
+        return node if self._batch_depth else self._store(node)
+
+    def _legacy_update(self, node, is_node, key, value, value_is_node):
+        if not is_node:
+            if not key:
+                return value, value_is_node
+            new_node = [BLANK_NODE] * 17
+            new_node[-1] = node
+            new_node[key[0]] = self._legacy_update(
+                BLANK_NODE, True, key[1:], value, value_is_node)[0]
+            return self._normalize_node(self._rlp_encode(new_node), True)
+
+        node_type, content = self._inspect_node(node)
+        if node_type == trie.NODE_TYPE_BLANK:
+            if not value_is_node:
+                return self._normalize_node(self._rlp_encode(
+                    [key.pack(terminator=True), value]), True)
+            if value == BLANK_NODE:
+                return BLANK_NODE, True
+            return self._normalize_node(
+                self._rlp_encode([key.pack(), value]), True)
+
+        if trie.is_diverge_type(node_type):
+            content = content[:]
+            if key:
+                content[key[0]] = self._legacy_update(
+                    content[key[0]], True, key[1:], value, value_is_node)[0]
+            else:
+                content[-1] = value
+            return self._normalize_node(self._rlp_encode(content), True)
+
+        curr_key, curr_val = content
+        curr_val_is_node = node_type != trie.NODE_TYPE_LEAF_KEY_VALUE
+        prefix_length = key.common_prefix_length(curr_key)
+        if not prefix_length:
+            return self._merge_two_pairs(curr_key, curr_val, curr_val_is_node,
+                                         key, value, value_is_node)
+        post_node, is_node = self._legacy_update(
+            BLANK_NODE, True, curr_key[prefix_length:], curr_val,
+            curr_val_is_node)
+        post_node, is_node = self._legacy_update(
+            post_node, is_node, key[prefix_length:], value, value_is_node)
+        return self._legacy_update(
+            BLANK_NODE, True, curr_key[:prefix_length], post_node, is_node)
+
+    def _normalize_pair(self, key, value, value_is_node):
+        if not value_is_node:
+            return key, value, value_is_node
+        value_type, value_content = self._inspect_node(value)
+        if value_type in (trie.NODE_TYPE_LEAF_KEY_VALUE,
+                          trie.NODE_TYPE_INNER_KEY_VALUE):
+            return (key + value_content[0], value_content[1],
+                    value_type == trie.NODE_TYPE_INNER_KEY_VALUE)
+        return key, value, value_is_node
+
+    def _normalize_node(self, node, is_node):
+        if not is_node:
+            return node, is_node
+        node_type, content = self._inspect_node(node)
+        if node_type == trie.NODE_TYPE_INNER_KEY_VALUE:
+            key, value, value_is_node = self._normalize_pair(
+                content[0], content[1], True)
+            if not key:
+                return value, value_is_node
+            if key == content[0]:
+                return node, is_node
+            return self._legacy_update(
+                BLANK_NODE, True, key, value, value_is_node)
+        if trie.is_diverge_type(node_type):
+            slots = [i for i in range(17) if content[i]]
+            if not slots:
+                return BLANK_NODE, True
+            if len(slots) > 1:
+                return node, True
+            if content[-1]:
+                return self._legacy_update(
+                    BLANK_NODE, True, BLANK_PATH, content[-1], False)
+            return self._legacy_update(
+                BLANK_NODE, True, NibblePath.from_nibble(slots[0]),
+                content[slots[0]], True)
+        return node, True
+
+    def _merge_two_pairs(self, key1, value1, value1_is_node,
+                         key2, value2, value2_is_node):
+        diverge_node = [BLANK_NODE] * 17
+        for key, value, value_is_node in (
+                self._normalize_pair(key1, value1, value1_is_node),
+                self._normalize_pair(key2, value2, value2_is_node)):
+            if not key:
+                diverge_node[-1] = value
+            else:
+                diverge_node[key[0]] = self._legacy_update(
+                    BLANK_NODE, True, key[1:], value, value_is_node)[0]
+        return self._normalize_node(self._rlp_encode(diverge_node), True)
+
+
+def random_bytes(n):
+    return ''.join(chr(random.randint(0, 255)) for i in range(n))
+
+
+def mock_transaction():
+    return [int_to_big_endian(random.randint(0, 2 ** 16)),
+            int_to_big_endian(10 ** 12), int_to_big_endian(10000),
+            random_bytes(20), int_to_big_endian(random.randint(0, 10 ** 18)),
+            random_bytes(random.randint(0, 128)),
+            '\x1b', random_bytes(32), random_bytes(32)]
+
+
+def mock_block(tx_count):
+    header = [random_bytes(32), random_bytes(32), random_bytes(20),
+              random_bytes(32), random_bytes(32), int_to_big_endian(2 ** 22),
+              int_to_big_endian(1000), '', int_to_big_endian(10 ** 6),
+              int_to_big_endian(21000), int_to_big_endian(1400000000), '',
+              random_bytes(32)]
+    txs = [[rlp.encode(mock_transaction()), random_bytes(32), '\x01\x00']
+           for i in range(tx_count)]
+    return [header, txs, []]
+
+
+def temp_dir():
+    '''a fresh directory, removed when the benchmarks exit'''
+    path = tempfile.mkdtemp(prefix='pyethereum-benchmark-')
+    temp_dirs.append(path)
+    return path
+
+
+def temp_trie(cls=Trie):
+    '''a Trie on a fresh database, removed when the benchmarks exit'''
+    return cls(temp_dir())
+
+temp_dirs = []
+
+
+def report(name, seconds, number):
+    print('{0:<40} {1:>10.3f} ms'.format(name, seconds * 1000. / number))
+
+
+def compare(name, candidates, number):
+    for label, func in candidates:
+        report('{0} [{1}]'.format(name, label),
+               timeit.timeit(func, number=number), number)
+
+
+def bench_rlp_encode():
+    random.seed(0)
+    for tx_count in (10, 100, 1000):
+        block = mock_block(tx_count)
+        assert rlp.encode(block) == legacy_rlp_encode(block)
+        compare('rlp.encode block/{0} txs'.format(tx_count),
+                [('legacy', lambda: legacy_rlp_encode(block)),
+                 ('current', lambda: rlp.encode(block))],
+                number=max(10, 1000 / tx_count))
+    blocks = [mock_block(100) for i in range(32)]
+    assert rlp.encode(blocks) == legacy_rlp_encode(blocks)
+    compare('rlp.encode 32 blocks/100 txs',
+            [('legacy', lambda: legacy_rlp_encode(blocks)),
+             ('current', lambda: rlp.encode(blocks))],
+            number=5)
+
+
+def bench_rlp_index():
+    random.seed(0)
+    data = rlp.encode(mock_block(1000))
+
+    def with_descend():
+        return [rlp.descend(data, 1, i, 0) for i in range(1000)]
+
+    def with_index():
+        index = rlp.OffsetIndex(data)
+        return [index.descend(1, i, 0) for i in range(1000)]
+
+    def with_decode_lazy():
+        # every path from the top, the lists on the way are decoded once
+        block = rlp.decode_lazy(data)
+        return [rlp.encode(block[1][i][0]) for i in range(1000)]
+
+    assert with_descend() == with_index() == with_decode_lazy()
+    compare('every tx of block/1000 txs',
+            [('descend', with_descend), ('OffsetIndex', with_index),
+             ('decode_lazy', with_decode_lazy)],
+            number=3)
+
+
+def bench_trie_get():
+    random.seed(0)
+    t = temp_trie()
+    keys = [random_bytes(20) for i in range(2000)]
+    for k in keys:
+        t.update(k, [int_to_big_endian(1), int_to_big_endian(10 ** 18),
+                     '', ''])
+    cache = t.db.node_cache
+
+    def get_all():
+        for k in keys:
+            t.get(k)
+
+    capacity = cache.capacity
+    cache.capacity = 0
+    cache.clear()
+    report('trie.get 2000 accounts [no node cache]',
+           timeit.timeit(get_all, number=3), 3)
+    cache.capacity = capacity
+    get_all()
+    cache.reset_stats()
+    report('trie.get 2000 accounts [node cache]',
+           timeit.timeit(get_all, number=3), 3)
+    print('node cache hits: {0} misses: {1}'.format(cache.hits, cache.misses))
+
+
+def bench_trie_update():
+    random.seed(0)
+    items = [(random_bytes(20), random_bytes(40)) for i in range(1000)]
+
+    def one_by_one():
+        t = temp_trie()
+        for k, v in items:
+            t.update(k, v)
+        return t.root
+
+    def batched():
+        t = temp_trie()
+        t.update_many(items)
+        return t.root
+
+    compare('trie 1000 updates', [('one by one', one_by_one),
+                                  ('update_many', batched)], number=1)
+
+
+def bench_trie_insert_100k():
+    accounts = [(sha3(str(i))[:20],
+                 [int_to_big_endian(i % 7), int_to_big_endian(10 ** 18 + i),
+                  '', ''])
+                for i in range(100000)]
+
+    def unsynced_trie(cls=Trie):
+        # the trie engine is measured, not a synced write per update
+        t = temp_trie(cls)
+        t.db.journal.flush_policy = FLUSH_PER_BLOCK
+        return t
+
+    def legacy_one_by_one():
+        t = unsynced_trie(LegacyTrie)
+        for k, v in accounts:
+            t.update(k, v)
+        t.db.commit_block()
+        return t.root
+
+    def legacy_batched():
+        t = unsynced_trie(LegacyTrie)
+        t.update_many(accounts)
+        t.db.commit_block()
+        return t.root
+
+    def one_by_one():
+        t = unsynced_trie()
+        for k, v in accounts:
+            t.update(k, v)
+        t.db.commit_block()
+        return t.root
+
+    def batched():
+        t = unsynced_trie()
+        t.update_many(accounts)
+        t.db.commit_block()
+        return t.root
+
+    def bulk_loaded():
+        t = unsynced_trie()
+        t.bulk_load(sorted(accounts))
+        t.db.commit_block()
+        return t.root
+
+    assert legacy_batched() == batched() == bulk_loaded()
+    compare('trie 100k inserts', [('legacy one by one', legacy_one_by_one),
+                                  ('legacy update_many', legacy_batched),
+                                  ('one by one', one_by_one),
+                                  ('update_many', batched),
+                                  ('bulk_load', bulk_loaded)], number=1)
+
+
+def bench_trie_parallel_commit():
+    '''only shows a speedup with several cores, on one it is the overhead
+    of the workers
+    '''
+    random.seed(0)
+    items = [(random_bytes(20), random_bytes(40)) for i in range(100000)]
+    roots = set()
+    cores = multiprocessing.cpu_count()
+    print('{0} cores'.format(cores))
+    if cores < 2:
+        print('single core: the workers only add overhead, no speedup')
+    for workers in sorted(set([0, 1, 2, 4, cores])):
+        trie.configure_hashing(workers)
+        t = temp_trie()
+        t.db.journal.flush_policy = FLUSH_PER_BLOCK
+        with t.batch():
+            for k, v in items:
+                t.update(k, v)
+            start = timeit.default_timer()
+        report('commit of 100k updates [{0} workers]'.format(workers),
+               timeit.default_timer() - start, 1)
+        roots.add(t.root)
+    trie.configure_hashing(0)
+    assert len(roots) == 1
+
+
+def bench_vm_dispatch():
+    # loops of operations with a fee of 1 which run until out of gas, so
+    # the gas given is the number of operations executed
+    loops = [
+        # counter: PUSH1 1 ADD PUSH1 2 JUMP
+        ('arithmetic', '6000600101600258', 0),
+        # counter stored in memory: DUP PUSH1 0 MSTORE PUSH1 1 ADD ...
+        ('memory', '600051600054600101600258', 32),
+    ]
+    gas = 100000
+    sender, contract = '1' * 40, '2' * 40
+    block = blocks.genesis({sender: 1}, db_path='benchmark-vm',
+                           backend='memory')
+    for label, code, memory_fee in loops:
+        block.set_code(contract, code.decode('hex'))
+        msg = processblock.Message(sender, contract, 0, gas, '')
+        seconds = timeit.timeit(
+            lambda: processblock.apply_msg(block, None, msg), number=3) / 3
+        print('{0:<40} {1:>10.0f} ops/s'.format(
+            'vm {0} loop'.format(label), (gas - memory_fee) / seconds))
+
+    # a call which returns at once to a contract of 1024 bytes
+    block.set_code(contract, '\x00' + '\x7f' * 1023)
+    msg = processblock.Message(sender, contract, 0, gas, '')
+
+    def decoded_per_call():
+        processblock.program_cache.clear()
+        processblock.apply_msg(block, None, msg)
+
+    compare('call to 1 kB contract',
+            [('decoded per call', decoded_per_call),
+             ('program cache',
+              lambda: processblock.apply_msg(block, None, msg))],
+            number=1000)
+
+
+def bench_vm_memory():
+    gas = 100000
+    sender, contract = '1' * 40, '2' * 40
+    block = blocks.genesis({sender: 1}, db_path='benchmark-vm-memory',
+                           backend='memory')
+    # counter in memory until out of gas: PUSH1 0 MLOAD PUSH1 1 ADD
+    # PUSH1 0 MSTORE PUSH1 0 JUMP, the first MSTORE pays 32 for memory
+    block.set_code(contract, '600053600101600054600058'.decode('hex'))
+    msg = processblock.Message(sender, contract, 0, gas, '')
+    seconds = timeit.timeit(
+        lambda: processblock.apply_msg(block, None, msg), number=3) / 3
+    print('{0:<40} {1:>10.0f} ops/s'.format(
+        'vm mload/mstore loop', (gas - 32) / seconds))
+    # CALLDATACOPY of 1 kB of call data, RETURN of it
+    block.set_code(contract,
+                   '61040060006000366104006000f2'.decode('hex'))
+    msg = processblock.Message(sender, contract, 0, gas, random_bytes(1024))
+    report('vm copy and return of 1 kB',
+           timeit.timeit(lambda: processblock.apply_msg(block, None, msg),
+                         number=100), 100)
+
+
+def bench_vm_storage():
+    gas = 100000
+    sender, contract = '1' * 40, '2' * 40
+    block = blocks.genesis({sender: 1}, db_path=temp_dir())
+    # increments storage slot 1 until out of gas: PUSH1 1 SLOAD PUSH1 1 ADD
+    # PUSH1 1 SSTORE PUSH1 0 JUMP, 126 gas a round
+    block.set_code(contract, '600156600101600157600058'.decode('hex'))
+    msg = processblock.Message(sender, contract, 0, gas, '')
+    report('vm sload/sstore round',
+           timeit.timeit(lambda: processblock.apply_msg(block, None, msg),
+                         number=3), 3 * gas / 126)
+
+
+def bench_packet_reader():
+    random.seed(0)
+    blocks = [rlp.encode(mock_block(100)) for i in range(8)]
+    stream = Packeter.dump_packet([Packeter.cmd_map_by_name['Blocks']] +
+                                  blocks)
+    chunks = [stream[i:i + 2048] for i in range(0, len(stream), 2048)]
+    print('Blocks packet of {0} bytes in {1} chunks'.format(
+        len(stream), len(chunks)))
+
+    def legacy():
+        # what Peer used to do: retry the whole buffer after every chunk
+        buf = ''
+        for chunk in chunks:
+            buf += chunk
+            success, res = Packeter.load_packet(buf)
+            if success:
+                return res
+
+    def current():
+        reader = PacketReader()
+        for chunk in chunks:
+            frames = reader.feed(chunk)
+        return frames
+
+    compare('read Blocks packet',
+            [('legacy', legacy), ('current', current)], number=3)
+
+
+benchmarks = dict((name[len('bench_'):], func)
+                  for name, func in globals().items()
+                  if name.startswith('bench_'))
+
+
+def main():
+    names = sys.argv[1:] or sorted(benchmarks)
+    try:
+        for name in names:
+            benchmarks[name]()
+    finally:
+        for path in temp_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()